@@ -0,0 +1,2 @@
+# -*- coding: utf-8 -*-
+"""Benchmarks of lmod_proxy against a local stub of the LMod API"""
@@ -0,0 +1,387 @@
+# -*- coding: utf-8 -*-
+"""Load test every ``edx_grades`` action against a stub LMod server.
+
+Starts the stub LMod API, serves lmod_proxy pointed at it under the
+shipped ``uwsgi.ini`` (or Werkzeug, or an already running instance with
+``--url``) and posts each action with a fixed concurrency, writing
+throughput and latency percentiles as JSON::
+
+    python -m benchmarks.run --requests 500 --concurrency 20 \\
+        --latency 0.05 --students 2000 --output results.json
+
+Pass ``--baseline`` with an earlier results file to print how each
+action changed.
+"""
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+import configparser
+import csv
+import io
+import json
+import os
+import platform
+import random
+import shutil
+import signal
+import subprocess
+import sys
+import tempfile
+import time
+
+from passlib.apache import HtpasswdFile
+import requests
+
+from benchmarks.stub_lmod import (
+    StubServer,
+    add_arguments,
+    assignment_name,
+    settings_from_args,
+    student_email,
+)
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+ACTION_NAMES = (
+    'get-membership', 'get-assignments', 'get-sections', 'post-grades',
+)
+BENCH_USER = 'bench'
+BENCH_PASSWORD = 'bench'
+
+
+def percentile(ordered, fraction):
+    """Nearest rank percentile of an ordered list"""
+    if not ordered:
+        return None
+    rank = max(int(round(fraction * len(ordered) + 0.5)) - 1, 0)
+    return ordered[min(rank, len(ordered) - 1)]
+
+
+def grade_csv(settings):
+    """Build an edX grade spreadsheet covering the whole stub roster"""
+    assignments = [
+        assignment_name(number) for number in range(settings.assignments)
+    ]
+    output = io.StringIO(newline='')
+    writer = csv.writer(output)
+    writer.writerow(['External email'] + assignments)
+    for number in range(settings.students):
+        writer.writerow(
+            [student_email(number)] +
+            ['{0:.2f}'.format(random.random()) for _ in assignments]
+        )
+    return output.getvalue().encode('utf8')
+
+
+class ProxyServer(object):
+    """lmod_proxy served in a subprocess for the benchmark
+
+    Args:
+        kind (str): ``uwsgi`` or ``werkzeug``
+        uwsgi_ini (str): uwsgi configuration to serve with
+        port (int): Port to listen on
+        environment (dict): lmod_proxy configuration
+        work_dir (str): Directory for generated files
+    """
+
+    def __init__(self, kind, uwsgi_ini, port, environment, work_dir):
+        # pylint: disable=too-many-arguments
+        self.kind = kind
+        self.uwsgi_ini = uwsgi_ini
+        self.port = port
+        self.environment = environment
+        self.work_dir = work_dir
+        self.uwsgi_config = None
+        self._process = None
+
+    @property
+    def url(self):
+        """Base URL of the proxy"""
+        return 'http://127.0.0.1:{0}/'.format(self.port)
+
+    def _command(self):
+        """Return the command serving the application"""
+        if self.kind == 'werkzeug':
+            return [
+                sys.executable, '-c',
+                'from werkzeug.serving import run_simple\n'
+                'from lmod_proxy.web import app\n'
+                'run_simple("127.0.0.1", {0}, app, threaded=True)'.format(
+                    self.port
+                )
+            ]
+        # Shipped configuration with only the socket moved
+        config = configparser.ConfigParser()
+        config.read(os.path.join(ROOT, self.uwsgi_ini))
+        config['uwsgi']['http-socket'] = '127.0.0.1:{0}'.format(self.port)
+        self.uwsgi_config = dict(config['uwsgi'])
+        path = os.path.join(self.work_dir, 'uwsgi.ini')
+        with open(path, 'w') as ini_file:
+            config.write(ini_file)
+        return [shutil.which('uwsgi') or 'uwsgi', '--ini', path]
+
+    def start(self, timeout=60):
+        """Start the server and wait for it to answer"""
+        environment = dict(os.environ, **self.environment)
+        self._process = subprocess.Popen(
+            self._command(), cwd=self.work_dir, env=environment,
+            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+        )
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            if self._process.poll() is not None:
+                raise RuntimeError(
+                    '{0} exited with {1}'.format(
+                        self.kind, self._process.returncode
+                    )
+                )
+            try:
+                requests.get(self.url + 'status/live', timeout=1)
+                return self
+            except requests.RequestException:
+                time.sleep(0.2)
+        self.stop()
+        raise RuntimeError('{0} did not start'.format(self.kind))
+
+    def stop(self):
+        """Stop the server"""
+        if self._process is not None and self._process.poll() is None:
+            self._process.send_signal(signal.SIGTERM)
+            try:
+                self._process.wait(timeout=30)
+            except subprocess.TimeoutExpired:
+                self._process.kill()
+                self._process.wait()
+
+
+def run_action(args, url, action, datafile):
+    """Post ``action`` repeatedly and summarise the responses
+
+    Args:
+        args (argparse.Namespace): Benchmark options
+        url (str): Base URL of the proxy
+        action (str): ``submit`` value
+        datafile (bytes): Grade spreadsheet for ``post-grades``
+    Returns:
+        dict: counts, throughput, latency percentiles and sizes
+    """
+    def post(number):
+        """Make one request, returning latency, status and size"""
+        files = None
+        if action == 'post-grades':
+            files = {'datafile': ('grades.csv', datafile, 'text/csv')}
+        started = time.perf_counter()
+        try:
+            # uwsgi's http-socket closes connections after each response
+            # without saying so, reusing one races with the close
+            response = requests.post(
+                url + 'edx_grades',
+                data=dict(
+                    gradebook='benchmark-{0}'.format(number % args.gradebooks),
+                    user='instructor@example.com',
+                    section='',
+                    submit=action,
+                ),
+                files=files,
+                auth=(BENCH_USER, BENCH_PASSWORD),
+                headers={'Accept-Encoding': args.accept_encoding},
+                timeout=args.timeout,
+            )
+            content = response.content
+        except requests.RequestException:
+            return time.perf_counter() - started, 'error', 0, 0, None
+        return (
+            time.perf_counter() - started,
+            str(response.status_code),
+            # Bytes read off the socket, compressed or chunked
+            response.raw.tell(),
+            len(content),
+            response.headers.get('Content-Encoding', 'identity'),
+        )
+
+    with ThreadPoolExecutor(args.concurrency) as executor:
+        list(executor.map(post, range(args.warmup)))
+        started = time.perf_counter()
+        results = list(executor.map(post, range(args.requests)))
+        elapsed = time.perf_counter() - started
+
+    latencies = sorted(result[0] * 1000 for result in results)
+    statuses = {}
+    encodings = {}
+    for result in results:
+        statuses[result[1]] = statuses.get(result[1], 0) + 1
+        if result[4]:
+            encodings[result[4]] = encodings.get(result[4], 0) + 1
+    return dict(
+        requests=len(results),
+        errors=len(results) - statuses.get('200', 0),
+        status=statuses,
+        seconds=round(elapsed, 3),
+        throughput_rps=round(len(results) / elapsed, 2),
+        latency_ms=dict(
+            mean=round(sum(latencies) / len(latencies), 2),
+            p50=round(percentile(latencies, 0.5), 2),
+            p90=round(percentile(latencies, 0.9), 2),
+            p99=round(percentile(latencies, 0.99), 2),
+            max=round(latencies[-1], 2),
+        ),
+        response_bytes=dict(
+            wire=round(sum(result[2] for result in results) / len(results)),
+            decoded=round(sum(result[3] for result in results) / len(results)),
+        ),
+        content_encoding=encodings,
+    )
+
+
+def compare(baseline, results):
+    """Describe the change of each action from ``baseline``"""
+    lines = []
+    for action, current in sorted(results['actions'].items()):
+        before = baseline.get('actions', {}).get(action)
+        if not before:
+            continue
+        changes = [
+            '{0} {1:+.1f}%'.format(
+                name,
+                100.0 * (current_value - before_value) / before_value
+            )
+            for name, before_value, current_value in (
+                ('p50', before['latency_ms']['p50'],
+                 current['latency_ms']['p50']),
+                ('p99', before['latency_ms']['p99'],
+                 current['latency_ms']['p99']),
+                ('throughput', before['throughput_rps'],
+                 current['throughput_rps']),
+                ('bytes', before['response_bytes']['wire'],
+                 current['response_bytes']['wire']),
+            )
+            if before_value
+        ]
+        lines.append('{0}: {1}'.format(action, ', '.join(changes)))
+    return '\n'.join(lines)
+
+
+def git_commit():
+    """Return the checked out commit, if known"""
+    try:
+        return subprocess.check_output(
+            ['git', 'rev-parse', 'HEAD'], cwd=ROOT,
+            stderr=subprocess.DEVNULL
+        ).decode('ascii').strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def parse_args(argv=None):
+    """Parse command line options"""
+    parser = argparse.ArgumentParser(
+        description=__doc__.splitlines()[0],
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter
+    )
+    parser.add_argument('--server', choices=('uwsgi', 'werkzeug'),
+                        default='uwsgi',
+                        help='How to serve lmod_proxy')
+    parser.add_argument('--uwsgi-ini', default='uwsgi.ini',
+                        help='Shipped uwsgi configuration to serve with, '
+                        'i.e. uwsgi-gevent.ini')
+    parser.add_argument('--url',
+                        help='Benchmark an already running lmod_proxy, '
+                        'configured with the stub and a bench/bench user, '
+                        'instead of starting one')
+    parser.add_argument('--port', type=int, default=8089,
+                        help='Port for the started lmod_proxy')
+    parser.add_argument('--actions', nargs='+', choices=ACTION_NAMES,
+                        default=list(ACTION_NAMES))
+    parser.add_argument('--requests', type=int, default=200,
+                        help='Measured requests per action')
+    parser.add_argument('--warmup', type=int, default=20,
+                        help='Unmeasured requests per action')
+    parser.add_argument('--concurrency', type=int, default=10,
+                        help='Requests in flight at once')
+    parser.add_argument('--gradebooks', type=int, default=10,
+                        help='Distinct gradebooks requests go to')
+    parser.add_argument('--timeout', type=float, default=120)
+    parser.add_argument('--accept-encoding', default='identity',
+                        help='Accept-Encoding header sent with requests')
+    parser.add_argument('--stub-port', type=int, default=0)
+    parser.add_argument('--environment', action='append', default=[],
+                        metavar='NAME=VALUE',
+                        help='Extra lmod_proxy configuration')
+    parser.add_argument('--output', help='File to write JSON results to, '
+                        'standard output if not given')
+    parser.add_argument('--baseline', help='Earlier results to compare to')
+    add_arguments(parser)
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    """Run the benchmark"""
+    args = parse_args(argv)
+    settings = settings_from_args(args)
+    stub = StubServer(settings, port=args.stub_port).start()
+    work_dir = tempfile.mkdtemp(prefix='lmod_proxy_bench')
+    proxy = None
+    try:
+        url = args.url
+        if url is None:
+            htpasswd_path = os.path.join(work_dir, 'htpasswd')
+            users = HtpasswdFile(htpasswd_path, new=True)
+            users.set_password(BENCH_USER, BENCH_PASSWORD)
+            users.save()
+            cert_path = os.path.join(work_dir, 'cert.pem')
+            open(cert_path, 'w').close()
+            environment = dict(
+                LMODP_URLBASE=stub.url,
+                LMODP_CERT=cert_path,
+                LMODP_HTPASSWD_PATH=htpasswd_path,
+                LMODP_STATE_DB=os.path.join(work_dir, 'state.sqlite'),
+                LMODP_METRICS_DIR=os.path.join(work_dir, 'metrics'),
+                # Measure the proxy rather than its rate limits
+                LMODP_READ_RATE_LIMIT='0',
+                LMODP_POST_RATE_LIMIT='0',
+                FLASK_LOG_LEVEL='WARNING',
+                PYTHONPATH=os.pathsep.join(
+                    [ROOT] + sys.path[1:]
+                ),
+            )
+            environment.update(
+                item.split('=', 1) for item in args.environment
+            )
+            proxy = ProxyServer(
+                args.server, args.uwsgi_ini, args.port, environment, work_dir
+            )
+            url = proxy.start().url
+        datafile = grade_csv(settings)
+        results = dict(
+            commit=git_commit(),
+            python=platform.python_version(),
+            server=args.server if args.url is None else args.url,
+            uwsgi_ini=args.uwsgi_ini if args.server == 'uwsgi' else None,
+            uwsgi_config=proxy.uwsgi_config if proxy else None,
+            environment=args.environment,
+            stub=settings.as_dict(),
+            concurrency=args.concurrency,
+            gradebooks=args.gradebooks,
+            accept_encoding=args.accept_encoding,
+            actions={
+                action: run_action(args, url, action, datafile)
+                for action in args.actions
+            },
+        )
+    finally:
+        if proxy is not None:
+            proxy.stop()
+        stub.stop()
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    output = json.dumps(results, indent=2, sort_keys=True)
+    if args.output:
+        with open(args.output, 'w') as output_file:
+            output_file.write(output + '\n')
+    else:
+        print(output)
+    if args.baseline:
+        with open(args.baseline) as baseline_file:
+            print(compare(json.load(baseline_file), results), file=sys.stderr)
+
+
+if __name__ == '__main__':
+    main()
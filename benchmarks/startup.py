@@ -0,0 +1,160 @@
+# -*- coding: utf-8 -*-
+"""Measure how long a fresh process takes to import lmod_proxy.
+
+Each run starts a new interpreter that imports ``lmod_proxy.web``,
+which also builds the application, and reports the wall time and the
+slowest imports by package from ``python -X importtime``::
+
+    python -m benchmarks.startup --runs 20 --output startup.json
+
+``--budget`` fails when the median exceeds the given milliseconds and
+``--baseline`` compares with an earlier results file.
+"""
+import argparse
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+
+from benchmarks.run import ROOT, git_commit, percentile
+
+#: Run in the child, printing the seconds the import took
+IMPORT_CODE = (
+    'import time; started = time.perf_counter(); import {module}; '
+    'print(time.perf_counter() - started)'
+)
+
+
+def parse_importtime(stderr):
+    """Sum ``-X importtime`` self times in milliseconds by top level
+    package
+
+    Args:
+        stderr (str): Standard error of ``python -X importtime``
+    Returns:
+        dict: milliseconds by package name
+    """
+    packages = {}
+    for line in stderr.splitlines():
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+        self_us, _, name = line[len('import time:'):].split('|')
+        package = name.strip().split('.')[0]
+        packages[package] = packages.get(package, 0) + int(self_us) / 1000.0
+    return packages
+
+
+def measure(module, environment, work_dir):
+    """Import ``module`` in a fresh interpreter
+
+    Returns:
+        tuple: import milliseconds and milliseconds by package
+    """
+    process = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c',
+         IMPORT_CODE.format(module=module)],
+        env=environment,
+        cwd=work_dir,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE,
+        universal_newlines=True,
+        check=True,
+    )
+    seconds = float(process.stdout.strip().splitlines()[-1])
+    return seconds * 1000, parse_importtime(process.stderr)
+
+
+def parse_args(argv=None):
+    """Parse command line options"""
+    parser = argparse.ArgumentParser(
+        description=__doc__.splitlines()[0],
+    )
+    parser.add_argument('--module', default='lmod_proxy.web',
+                        help='Module to import')
+    parser.add_argument('--runs', type=int, default=10,
+                        help='Fresh interpreters started')
+    parser.add_argument('--top', type=int, default=15,
+                        help='Slowest packages reported')
+    parser.add_argument('--budget', type=float,
+                        help='Fail if the median import exceeds this many '
+                        'milliseconds')
+    parser.add_argument('--output', help='File to write JSON results to, '
+                        'standard output if not given')
+    parser.add_argument('--baseline', help='Earlier results to compare to')
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    """Run the benchmark"""
+    args = parse_args(argv)
+    with tempfile.TemporaryDirectory(prefix='lmod_proxy_startup') as work:
+        environment = dict(
+            os.environ,
+            LMODP_STATE_DB=os.path.join(work, 'state.sqlite'),
+            LMODP_METRICS_DIR=os.path.join(work, 'metrics'),
+            LMODP_HTPASSWD_PATH=os.path.join(work, 'htpasswd'),
+            PYTHONPATH=os.pathsep.join([ROOT] + sys.path[1:]),
+        )
+        # Compile and cache bytecode outside of the measured runs
+        measure(args.module, environment, work)
+        runs = [
+            measure(args.module, environment, work)
+            for _ in range(args.runs)
+        ]
+
+    times = sorted(run[0] for run in runs)
+    packages = {}
+    for _, run_packages in runs:
+        for package, milliseconds in run_packages.items():
+            packages.setdefault(package, []).append(milliseconds)
+    slowest = sorted(
+        (
+            (package, statistics.median(values))
+            for package, values in packages.items()
+        ),
+        key=lambda item: item[1],
+        reverse=True,
+    )[:args.top]
+    results = dict(
+        commit=git_commit(),
+        python=platform.python_version(),
+        module=args.module,
+        runs=args.runs,
+        import_ms=dict(
+            median=round(statistics.median(times), 1),
+            p90=round(percentile(times, 0.9), 1),
+            min=round(times[0], 1),
+            max=round(times[-1], 1),
+        ),
+        packages_ms={
+            package: round(milliseconds, 1)
+            for package, milliseconds in slowest
+        },
+    )
+
+    output = json.dumps(results, indent=2, sort_keys=True)
+    if args.output:
+        with open(args.output, 'w') as output_file:
+            output_file.write(output + '\n')
+    else:
+        print(output)
+    median = results['import_ms']['median']
+    if args.baseline:
+        with open(args.baseline) as baseline_file:
+            before = json.load(baseline_file)['import_ms']['median']
+        print('import median {0:+.1f}% ({1} -> {2}ms)'.format(
+            100.0 * (median - before) / before, before, median
+        ), file=sys.stderr)
+    if args.budget is not None and median > args.budget:
+        print('Import median {0}ms is over the {1}ms budget'.format(
+            median, args.budget
+        ), file=sys.stderr)
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
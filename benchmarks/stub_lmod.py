@@ -0,0 +1,272 @@
+# -*- coding: utf-8 -*-
+"""Stub of the Learning Modules gradebook API used by pylmod.
+
+Serves made up gradebooks with a configurable roster size, added
+latency and error rate so lmod_proxy can be benchmarked without the
+real service.  Run it on its own with::
+
+    python -m benchmarks.stub_lmod --port 8443 --latency 0.05
+"""
+import argparse
+import hashlib
+import random
+import threading
+import time
+
+from flask import Blueprint, Flask, jsonify, request
+from werkzeug.serving import WSGIRequestHandler, make_server
+
+
+class QuietRequestHandler(WSGIRequestHandler):
+    """Request handler that does not log every request"""
+
+    def log_request(self, *args, **kwargs):
+        """Skip access logging"""
+
+
+class StubSettings(object):
+    """Behaviour of the stub server
+
+    Args:
+        latency (float): Seconds added to every response
+        jitter (float): Random extra seconds, up to this many
+        error_rate (float): Fraction of requests answered with an error
+        students (int): Students enrolled in every gradebook
+        assignments (int): Assignments in every gradebook
+        sections (int): Sections students are spread over
+    """
+    # pylint: disable=too-few-public-methods
+
+    def __init__(
+            self,
+            latency=0.0,
+            jitter=0.0,
+            error_rate=0.0,
+            students=100,
+            assignments=10,
+            sections=4,
+    ):
+        # pylint: disable=too-many-arguments
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.students = students
+        self.assignments = assignments
+        self.sections = sections
+
+    def as_dict(self):
+        """Return the settings for benchmark results"""
+        return dict(vars(self))
+
+
+def student_email(number):
+    """Email address of the stub student ``number``"""
+    return 'student{0}@example.com'.format(number)
+
+
+def assignment_name(number):
+    """Name of the stub assignment ``number``"""
+    return 'Assignment {0:02d}'.format(number)
+
+
+def stub_app(settings):
+    """Build the stub LMod application
+
+    Args:
+        settings (StubSettings): How the stub behaves
+    Returns:
+        flask.Flask: WSGI application
+    """
+    # pylint: disable=unused-variable
+    api = Blueprint('gradebook', __name__)
+    counters = dict(assignments=0)
+    counters_lock = threading.Lock()
+
+    @api.before_request
+    def delay_or_fail():
+        """Add latency and fail a fraction of requests"""
+        delay = settings.latency + random.uniform(0, settings.jitter)
+        if delay > 0:
+            time.sleep(delay)
+        if random.random() < settings.error_rate:
+            response = jsonify(dict(status=-1, message='Stub LMod error'))
+            response.status_code = 503
+            return response
+        return None
+
+    def sections():
+        """Sections of every gradebook"""
+        return [
+            dict(
+                editable=True,
+                groupId=1000 + number,
+                groupingScheme='Recitation',
+                members=None,
+                name='r{0:02d}'.format(number),
+                shortName='r{0:02d}'.format(number),
+                staffs=None,
+            )
+            for number in range(settings.sections)
+        ]
+
+    def students(group_id=None):
+        """Students of every gradebook, optionally in one section"""
+        roster = []
+        for number in range(settings.students):
+            section = number % max(settings.sections, 1)
+            if group_id is not None and 1000 + section != group_id:
+                continue
+            roster.append(dict(
+                accountEmail=student_email(number),
+                displayName='Student {0}'.format(number),
+                email=student_email(number),
+                section='r{0:02d}'.format(section),
+                sectionId=1000 + section,
+                studentId=number + 1,
+            ))
+        return roster
+
+    @api.route('/gradebook', methods=['GET'])
+    def gradebook():
+        """Resolve a gradebook UUID to a stable id"""
+        digest = hashlib.sha1(
+            request.args.get('uuid', '').encode('utf8')
+        ).hexdigest()
+        return jsonify(data=dict(gradebookId=int(digest[:6], 16)))
+
+    @api.route('/gradebook/options/<int:gradebook_id>', methods=['GET'])
+    def options(gradebook_id):
+        """Options of a gradebook"""
+        return jsonify(data=dict(gradebookId=gradebook_id))
+
+    @api.route('/assignments/<int:gradebook_id>', methods=['GET'])
+    def assignments(gradebook_id):
+        """Assignments of a gradebook"""
+        return jsonify(data=[
+            dict(assignmentId=number + 1, name=assignment_name(number))
+            for number in range(settings.assignments)
+        ])
+
+    @api.route('/assignment', methods=['POST'])
+    def create_assignment():
+        """Create an assignment"""
+        with counters_lock:
+            counters['assignments'] += 1
+            assignment_id = 100000 + counters['assignments']
+        return jsonify(status=1, data=dict(assignmentId=assignment_id))
+
+    @api.route('/sections/<int:gradebook_id>', methods=['GET'])
+    def gradebook_sections(gradebook_id):
+        """Sections of a gradebook by type"""
+        return jsonify(data=dict(recitation=sections()))
+
+    @api.route('/students/<int:gradebook_id>', methods=['GET'])
+    @api.route(
+        '/students/<int:gradebook_id>/section/<int:group_id>',
+        methods=['GET']
+    )
+    def gradebook_students(gradebook_id, group_id=None):
+        """Students of a gradebook or of one of its sections"""
+        return jsonify(data=students(group_id))
+
+    @api.route('/multiGrades/<int:gradebook_id>', methods=['POST'])
+    def multi_grades(gradebook_id):
+        """Accept grades, rejecting any that are not numbers"""
+        grades = request.get_json(force=True)
+        failures = [
+            dict(grade, status=-1) for grade in grades
+            if not isinstance(grade.get('numericGradeValue'), (int, float))
+        ]
+        return jsonify(
+            status=1,
+            message='',
+            data=dict(numFailures=len(failures), results=failures)
+        )
+
+    app = Flask(__name__)
+    # pylmod appends this to the configured base URL
+    app.register_blueprint(api, url_prefix='/service/gradebook')
+    return app
+
+
+class StubServer(object):
+    """Stub LMod server running in a background thread
+
+    Args:
+        settings (StubSettings): How the stub behaves
+        host (str): Address to listen on
+        port (int): Port to listen on, 0 picks a free one
+    """
+
+    def __init__(self, settings, host='127.0.0.1', port=0):
+        self.settings = settings
+        self._server = make_server(
+            host, port, stub_app(settings), threaded=True,
+            request_handler=QuietRequestHandler
+        )
+        self._thread = None
+
+    @property
+    def url(self):
+        """Base URL of the stub API"""
+        return 'http://{0}:{1}/'.format(
+            self._server.server_address[0], self._server.server_port
+        )
+
+    def start(self):
+        """Start serving in a daemon thread"""
+        self._thread = threading.Thread(
+            target=self._server.serve_forever, name='stub-lmod', daemon=True
+        )
+        self._thread.start()
+        return self
+
+    def stop(self):
+        """Stop serving"""
+        self._server.shutdown()
+        self._thread.join()
+
+
+def add_arguments(parser):
+    """Add the stub settings to an argument parser"""
+    parser.add_argument('--latency', type=float, default=0.0,
+                        help='Seconds added to every LMod response')
+    parser.add_argument('--jitter', type=float, default=0.0,
+                        help='Random extra seconds per LMod response')
+    parser.add_argument('--error-rate', type=float, default=0.0,
+                        help='Fraction of LMod calls that fail')
+    parser.add_argument('--students', type=int, default=100,
+                        help='Students in every gradebook')
+    parser.add_argument('--assignments', type=int, default=10,
+                        help='Assignments in every gradebook')
+    parser.add_argument('--sections', type=int, default=4,
+                        help='Sections in every gradebook')
+
+
+def settings_from_args(args):
+    """Build :py:class:`StubSettings` from parsed arguments"""
+    return StubSettings(
+        latency=args.latency,
+        jitter=args.jitter,
+        error_rate=args.error_rate,
+        students=args.students,
+        assignments=args.assignments,
+        sections=args.sections,
+    )
+
+
+def main():
+    """Serve the stub LMod API in the foreground"""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8443)
+    add_arguments(parser)
+    args = parser.parse_args()
+    make_server(
+        args.host, args.port, stub_app(settings_from_args(args)),
+        threaded=True
+    ).serve_forever()
+
+
+if __name__ == '__main__':
+    main()
@@ -5,26 +5,39 @@ Flask application for proxying requests to the MIT Learning Modules
 API from edx-platform
 """
 import os.path
-from pkg_resources import get_distribution, DistributionNotFound
+
+__project__ = 'lmod_proxy'
 
 
 def _get_version():
-    """Grab version from pkg_resources"""
-    # pylint: disable=no-member
+    """Grab version from the installed distribution's metadata"""
+    # Only imported when the version is asked for, it is slow to import
+    try:
+        from importlib.metadata import PackageNotFoundError, distribution
+    except ImportError:  # Python < 3.8
+        from importlib_metadata import PackageNotFoundError, distribution
     try:
-        dist = get_distribution(__project__)
-        # Normalize case for Windows systems
-        dist_loc = os.path.normcase(dist.location)
+        dist = distribution(__project__)
+        # Normalize case for Windows systems, the location is relative
+        # when found through a relative sys.path entry such as ''
+        dist_loc = os.path.normcase(
+            os.path.abspath(str(dist.locate_file(__project__)))
+        )
         here = os.path.normcase(os.path.abspath(__file__))
-        if not here.startswith(
-                os.path.join(dist_loc, __project__)
-        ):
+        if not here.startswith(dist_loc):
             # not installed, but there is another version that *is*
-            raise DistributionNotFound
-    except DistributionNotFound:
+            raise PackageNotFoundError(__project__)
+    except PackageNotFoundError:
         return 'Please install this project with setup.py'
     else:
         return dist.version
 
-__project__ = 'lmod_proxy'
-__version__ = _get_version()
+
+def __getattr__(name):
+    """Look up ``__version__`` on first use"""
+    if name == '__version__':
+        globals()['__version__'] = version = _get_version()
+        return version
+    raise AttributeError(
+        'module {0!r} has no attribute {1!r}'.format(__name__, name)
+    )
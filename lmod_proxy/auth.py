@@ -1,7 +1,171 @@
 # -*- coding: utf-8 -*-
 """Basic authentication decorator for views"""
 from functools import wraps
+import hashlib
+import hmac
+import logging
+import os
+import threading
+import time
+
 from flask import current_app, request, Response
+from passlib.apache import HtpasswdFile
+
+from lmod_proxy.cache import TTLCache
+from lmod_proxy.metrics import AUTH_SECONDS
+from lmod_proxy.profiling import phase
+
+log = logging.getLogger(__name__)
+
+
+class CredentialCache(object):
+    """Bounded cache of recently verified username/password pairs.
+
+    Verifying against the htpasswd file costs a full password hash, so
+    successful verifications are remembered for a short time.  Entries
+    are keyed by an HMAC of the credentials using a per-process random
+    key so plaintext passwords are never held by the cache.  Only
+    successful checks are cached, and the whole cache is flushed as soon
+    as the user database it was filled from is replaced or reloaded.
+
+    Args:
+        max_size (int): Maximum number of cached credentials
+        ttl (float): Seconds a verification is trusted for
+    """
+
+    def __init__(self, max_size, ttl):
+        self._cache = TTLCache(max_size, ttl)
+        self._key = os.urandom(32)
+        self._users = None
+        self._users_mtime = None
+
+    @property
+    def hits(self):
+        """Number of verifications answered from the cache"""
+        return self._cache.hits
+
+    @property
+    def misses(self):
+        """Number of verifications that had to hash the password"""
+        return self._cache.misses
+
+    def _digest(self, username, password):
+        """Keyed digest of the credentials.  Basic auth user names
+        cannot contain a colon, so the joined value is unambiguous.
+        """
+        credentials = '{0}:{1}'.format(username, password)
+        return hmac.new(
+            self._key, credentials.encode('utf8'), hashlib.sha256
+        ).digest()
+
+    def _sync(self, users):
+        """Flush the cache if ``users`` is not the database it was
+        filled from."""
+        if users is not self._users or users.mtime != self._users_mtime:
+            self._cache.clear()
+            self._users = users
+            self._users_mtime = users.mtime
+
+    def clear(self):
+        """Forget every cached verification"""
+        self._cache.clear()
+
+    def check_password(self, users, username, password):
+        """Verify credentials, hashing only on a cache miss.
+
+        Args:
+            users (passlib.apache.HtpasswdFile): User database
+            username (str): User to verify
+            password (str): Password to verify
+        Returns:
+            bool: True if the credentials are valid
+        """
+        self._sync(users)
+        key = self._digest(username, password)
+        if self._cache.get(key):
+            return True
+        valid = bool(users.check_password(username, password))
+        if valid:
+            self._cache.set(key, True)
+        return valid
+
+
+class HtpasswdReloader(object):
+    """Reload the htpasswd user database when its file changes.
+
+    The file's modification time, size and inode are compared at most
+    once every ``interval`` seconds, and a changed file is parsed into a
+    new :py:class:`passlib.apache.HtpasswdFile` that replaces the old
+    one in a single assignment, so requests always see a complete user
+    table.
+
+    Args:
+        path (str): Path to the htpasswd file
+        interval (float): Minimum seconds between file checks, a value
+            of zero or less disables reloading.
+    """
+
+    def __init__(self, path, interval):
+        self.path = path
+        self.interval = interval
+        self._signature = None
+        self._next_check = 0
+        self._lock = threading.Lock()
+
+    def _stat(self):
+        """Return a tuple identifying the current file contents or
+        ``None`` if the file cannot be read."""
+        try:
+            stat = os.stat(self.path)
+        except OSError:
+            return None
+        return (stat.st_mtime_ns, stat.st_size, stat.st_ino)
+
+    def load(self):
+        """Load the user database from disk.
+
+        Returns:
+            passlib.apache.HtpasswdFile: Loaded users, or an empty user
+            database if the file could not be read.
+        """
+        # Stat before parsing so a write still in progress shows up as
+        # another change on the next check.
+        self._signature = self._stat()
+        self._next_check = time.monotonic() + self.interval
+        try:
+            return HtpasswdFile(self.path)
+        except IOError:
+            log.critical(
+                'No htpasswd file loaded, please set `LMODP_HTPASSWD`'
+                'environment variable to a valid apache htpasswd file.'
+            )
+            return HtpasswdFile()
+
+    def maybe_reload(self, config):
+        """Swap a fresh user database into ``config['users']`` if the
+        file changed since it was last loaded.
+
+        Args:
+            config (flask.Config): Application configuration
+        Returns:
+            bool: True if the user database was reloaded
+        """
+        if self.interval <= 0 or time.monotonic() < self._next_check:
+            return False
+        if not self._lock.acquire(blocking=False):
+            # Another thread is already checking
+            return False
+        try:
+            self._next_check = time.monotonic() + self.interval
+            signature = self._stat()
+            # Keep the current users if the file is briefly missing
+            if signature is None or signature == self._signature:
+                return False
+            log.info('Reloading changed htpasswd file %s', self.path)
+            config['users'] = self.load()
+            return True
+        finally:
+            self._lock.release()
 
 
 def check_basic_auth(username, password):
@@ -9,7 +173,14 @@ def check_basic_auth(username, password):
     This function is called to check if a username /
     password combination is valid via the htpasswd file.
     """
-    valid = current_app.config['users'].check_password(username, password)
+    current_app.config['users_reloader'].maybe_reload(current_app.config)
+    started = time.monotonic()
+    valid = current_app.config['auth_cache'].check_password(
+        current_app.config['users'], username, password
+    )
+    AUTH_SECONDS.observe(
+        time.monotonic() - started, outcome='valid' if valid else 'invalid'
+    )
     if not valid:
         current_app.logger.warning('Invalid login from %s', username)
         valid = False
@@ -19,6 +190,19 @@ def check_basic_auth(username, password):
     )
 
 
+def is_admin(user):
+    """Return True if ``user`` may use administrative views.  Every
+    authenticated user is an administrator unless ``LMODP_ADMIN_USERS``
+    lists specific users.
+    """
+    admins = [
+        admin.strip()
+        for admin in (current_app.config['LMODP_ADMIN_USERS'] or '').split(',')
+        if admin.strip()
+    ]
+    return not admins or user in admins
+
+
 def auth_failed():
     """
     Sends a 401 response that enables basic auth
@@ -43,9 +227,10 @@ def requires_auth(func):
         basic_auth = request.authorization
         is_valid = False
         if basic_auth:
-            is_valid, user = check_basic_auth(
-                basic_auth.username, basic_auth.password
-            )
+            with phase('auth'):
+                is_valid, user = check_basic_auth(
+                    basic_auth.username, basic_auth.password
+                )
         if not is_valid:
             return auth_failed()
         kwargs['user'] = user
@@ -0,0 +1,87 @@
+# -*- coding: utf-8 -*-
+"""Small in-process caches shared by the application"""
+from collections import OrderedDict
+import threading
+import time
+
+
+class TTLCache(object):
+    """Thread safe least recently used cache whose entries also expire
+    after a fixed number of seconds.
+
+    Args:
+        max_size (int): Maximum number of entries kept before the least
+            recently used one is evicted.
+        ttl (float): Seconds an entry stays valid after it is set.
+    """
+
+    def __init__(self, max_size, ttl):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, key):
+        with self._lock:
+            return self._live_entry(key) is not None
+
+    def _live_entry(self, key):
+        """Return the ``(expires, value)`` entry for ``key`` if it has not
+        expired, dropping it otherwise.  Caller must hold the lock.
+        """
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        if entry[0] <= time.monotonic():
+            del self._entries[key]
+            return None
+        return entry
+
+    def get(self, key, default=None):
+        """Return the cached value for ``key`` and count the hit or miss.
+
+        Args:
+            key (hashable): Cache key
+            default (object): Returned when there is no live entry
+        Returns:
+            object: cached value or ``default``
+        """
+        with self._lock:
+            entry = self._live_entry(key)
+            if entry is None:
+                self.misses += 1
+                return default
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def set(self, key, value):
+        """Store ``value`` under ``key``, evicting the least recently
+        used entries to stay within ``max_size``.
+        """
+        if self.max_size <= 0 or self.ttl <= 0:
+            return
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def pop(self, key, default=None):
+        """Remove ``key`` and return its value if it was still live"""
+        with self._lock:
+            entry = self._live_entry(key)
+            if entry is None:
+                return default
+            del self._entries[key]
+            return entry[1]
+
+    def clear(self):
+        """Drop every entry, leaving the hit and miss counters alone"""
+        with self._lock:
+            self._entries.clear()
@@ -1,6 +1,7 @@
 # -*- coding: utf-8 -*-
 """Command line debug start of flask application"""
 import os
+import sys
 
 from lmod_proxy import config
 
@@ -19,3 +20,21 @@ def run_server():
 
     from lmod_proxy.web import app
     app.run(debug=True, host=host, port=port)
+
+
+def invalidate_gradebook_ids():
+    """Forget cached gradebook UUID to id lookups.
+
+    Takes gradebook UUIDs as arguments, or clears every cached lookup if
+    none are given.  Running workers resolve the ids again on their next
+    request for those gradebooks.
+    """
+    from lmod_proxy.edx_grades.gradebook_ids import GradebookIdCache
+
+    id_cache = GradebookIdCache(
+        config.LMODP_STATE_DB, float(config.LMODP_GRADEBOOK_ID_TTL)
+    )
+    removed = sum(
+        id_cache.invalidate(gbuuid) for gbuuid in sys.argv[1:] or [None]
+    )
+    print('Removed {0} cached gradebook id(s)'.format(removed))
@@ -2,8 +2,6 @@
 """Configuration of flask application via environment, or file"""
 import os
 
-import yaml
-
 CONFIG_PATHS = [
     os.environ.get('LMODP_CONFIG', ''),
     os.path.join(os.getcwd(), 'lmod_proxy.yml'),
@@ -26,11 +24,156 @@ CONFIG_KEYS = {
     # certificate authentication
     'LMODP_URLBASE': 'https://learning-modules.mit.edu:8443/',
 
+    # Maximum number of LMod gradebook clients each worker keeps ready
+    # for reuse, and the seconds an unused client is kept.
+    'LMODP_GRADEBOOK_POOL_SIZE': 32,
+    'LMODP_GRADEBOOK_POOL_IDLE': 300,
+
+    # Seconds a gradebook UUID to id lookup is cached for.  Lookups are
+    # stored in LMODP_STATE_DB and shared by all workers.
+    'LMODP_GRADEBOOK_ID_TTL': 604800,
+
+    # Path to the sqlite database holding state shared between worker
+    # processes.  The containing directory must be writable.
+    'LMODP_STATE_DB': '.lmod_proxy.sqlite',
+
+    # Seconds assignment and section lists are cached per gradebook in
+    # each worker, and the maximum number of cached lists.  Posting
+    # grades to a gradebook drops its cached lists in every worker.
+    'LMODP_READ_CACHE_TTL': 60,
+    'LMODP_READ_CACHE_SIZE': 256,
+
+    # Seconds the last assignment and section lists read are kept to
+    # answer with, marked ``X-Cache: STALE``, while LMod calls are
+    # rejected by the circuit breaker or concurrency limit.
+    'LMODP_STALE_READ_TTL': 3600,
+
+    # Responses whose data lists, like large course rosters, have at
+    # least this many entries are streamed as they are serialized
+    # rather than built in memory first.  0 disables streaming.
+    'LMODP_STREAM_MIN_ITEMS': 1000,
+
+    # Encodings ``edx_grades`` responses may be compressed with, in order
+    # of preference, for clients whose ``Accept-Encoding`` allows it.
+    # ``br`` needs the ``brotli`` package.  Empty disables compression.
+    # Responses shorter than ``LMODP_COMPRESS_MIN_SIZE`` bytes are sent
+    # as is, streamed responses are always compressed.
+    'LMODP_COMPRESSION': 'br,gzip',
+    'LMODP_COMPRESS_MIN_SIZE': 1024,
+    # Compression levels, from 1 (fastest) to 9 for gzip and 0 to 11 for
+    # brotli.
+    'LMODP_GZIP_LEVEL': 6,
+    'LMODP_BROTLI_QUALITY': 4,
+
+    # Circuit breaker protecting LMod.  Once ``LMODP_BREAKER_MIN_CALLS``
+    # of the last ``LMODP_BREAKER_WINDOW`` calls are known and the
+    # fraction that failed to connect or took longer than
+    # ``LMODP_BREAKER_SLOW_CALL_SECONDS`` reaches
+    # ``LMODP_BREAKER_FAILURE_RATE``, calls are rejected for
+    # ``LMODP_BREAKER_OPEN_SECONDS``.  Then
+    # ``LMODP_BREAKER_HALF_OPEN_CALLS`` probe calls decide whether it
+    # closes again.  Grade postings only count when they fail, as
+    # large ones are slow.  A window of 0 disables the breaker.  State
+    # is kept per worker process.
+    'LMODP_BREAKER_WINDOW': 20,
+    'LMODP_BREAKER_MIN_CALLS': 10,
+    'LMODP_BREAKER_FAILURE_RATE': 0.5,
+    'LMODP_BREAKER_SLOW_CALL_SECONDS': 10,
+    'LMODP_BREAKER_OPEN_SECONDS': 30,
+    'LMODP_BREAKER_HALF_OPEN_CALLS': 2,
+
+    # Adaptive limit on LMod calls in flight per worker process.  The
+    # limit grows slowly up to ``LMODP_LMOD_CONCURRENCY_MAX`` while
+    # calls finish within ``LMODP_LMOD_TARGET_SECONDS`` and is
+    # multiplied by ``LMODP_LMOD_CONCURRENCY_BACKOFF`` when one fails or
+    # is slower, grade postings only when they fail, down to
+    # ``LMODP_LMOD_CONCURRENCY_MIN``.  Calls wait up
+    # to ``LMODP_LMOD_QUEUE_SECONDS`` for a free slot.  A maximum of 0
+    # disables the limit.
+    'LMODP_LMOD_CONCURRENCY_MIN': 1,
+    'LMODP_LMOD_CONCURRENCY_MAX': 20,
+    'LMODP_LMOD_TARGET_SECONDS': 2,
+    'LMODP_LMOD_CONCURRENCY_BACKOFF': 0.9,
+    'LMODP_LMOD_QUEUE_SECONDS': 5,
+
+    # Most gradebooks one ``/edx_grades/batch`` request may read, and
+    # how many of them each request reads at the same time.  Calls are
+    # still subject to the LMod concurrency limit.
+    'LMODP_FANOUT_MAX_GRADEBOOKS': 1000,
+    'LMODP_FANOUT_WORKERS': 8,
+
+    # Requests per minute each user may make to ``/edx_grades`` and
+    # ``/edx_grades/batch``, and how many may be made at once after a
+    # quiet period.  Each gradebook of a batch counts as a request.
+    # Grade postings have their own, lower, limit.
+    # Limits are kept in LMODP_STATE_DB and hold across all workers;
+    # requests over them are answered with status 429 and a
+    # ``Retry-After`` header.  A rate of 0 disables the limit.
+    'LMODP_READ_RATE_LIMIT': 600,
+    'LMODP_READ_RATE_BURST': 60,
+    'LMODP_POST_RATE_LIMIT': 30,
+    'LMODP_POST_RATE_BURST': 10,
+
+    # Seconds the result of the LMod check made by ``/status/ready``
+    # is reused.
+    'LMODP_READY_CHECK_TTL': 10,
+
+    # Directory where each worker process writes its metrics for
+    # ``/metrics`` to add up, and the most seconds between writes.  If
+    # empty, ``/metrics`` only reports the worker answering it.
+    'LMODP_METRICS_DIR': '.lmod_proxy_metrics',
+    'LMODP_METRICS_FLUSH_INTERVAL': 10,
+
+    # Directory where request profiles are saved.  If set, requests by
+    # administrators with ``profile=1`` are run under cProfile, sampled
+    # at this fraction of those requests.
+    'LMODP_PROFILE_DIR': '',
+    'LMODP_PROFILE_SAMPLE_RATE': 1.0,
+
     # Any value other than '' or unset enables grade approval in
     # Learning Modules so that instructors do no have to do it
     # manually for all grades posted in this instance.
     'LMODP_APPROVE_GRADES': None,
 
+    # Any value other than '' or unset makes grade posting only send the
+    # grades that changed since the last successful posting, which are
+    # kept in LMODP_STATE_DB.  Requests with ``full=1`` still send every
+    # grade.
+    'LMODP_DELTA_GRADES': None,
+
+    # Number of spreadsheet rows posted to LMod per request when
+    # posting grades.  Zero posts the whole spreadsheet at once.
+    'LMODP_GRADE_BATCH_SIZE': 0,
+
+    # Maximum grade batches posted to LMod at the same time
+    'LMODP_GRADE_BATCH_WORKERS': 4,
+
+    # Background threads per worker posting grades submitted with
+    # ``async=1``, and seconds jobs are kept for status checks after
+    # they last changed.  Jobs of workers that went away are resumed by
+    # another worker.
+    'LMODP_JOB_WORKERS': 2,
+    'LMODP_JOB_RETENTION': 604800,
+
+    # Grade postings that fail with an LMod or connection error are
+    # kept in LMODP_STATE_DB and retried up to this many times.  Zero
+    # disables retrying.
+    'LMODP_RETRY_MAX_ATTEMPTS': 8,
+
+    # Seconds before the first retry, doubling on each attempt up to
+    # the maximum, with random jitter.
+    'LMODP_RETRY_BASE_DELAY': 60,
+    'LMODP_RETRY_MAX_DELAY': 3600,
+
+    # Queued postings retried at the same time across all workers, and
+    # seconds between checks for postings due to be retried.
+    'LMODP_RETRY_MAX_DRAINS': 1,
+    'LMODP_RETRY_POLL_INTERVAL': 30,
+
+    # Comma separated users allowed to use administrative views.  If
+    # empty every authenticated user can.
+    'LMODP_ADMIN_USERS': '',
+
     # Direct path to apache htpasswd file to use for basic auth
     'LMODP_HTPASSWD_PATH': '.htpasswd',
 
@@ -39,6 +182,25 @@ CONFIG_KEYS = {
     # to a file for reading on startup.
     'LMODP_HTPASSWD': None,
 
+    # Build read only state in the uwsgi master process and freeze the
+    # garbage collector before workers are forked, so they share it
+    # copy-on-write.  Has no effect outside of uwsgi or with
+    # ``lazy-apps``.  Pooled LMod clients are dropped in each worker,
+    # which needs ``py-call-osafterfork``.  Set to '' to disable.
+    'LMODP_PRELOAD': 'true',
+
+    # Seconds between checks of the htpasswd file for changes.  A
+    # changed file is reloaded without restarting workers.  Zero
+    # disables reloading.
+    'LMODP_HTPASSWD_RELOAD_INTERVAL': 10,
+
+    # Seconds a successful basic auth verification is remembered so
+    # repeat requests skip the password hash.  Zero disables the cache.
+    'LMODP_AUTH_CACHE_TTL': 300,
+
+    # Maximum number of verified credentials remembered per process
+    'LMODP_AUTH_CACHE_SIZE': 128,
+
     # Logging level
     'FLASK_LOG_LEVEL': 'INFO',
 
@@ -47,6 +209,32 @@ CONFIG_KEYS = {
 }
 
 
+def _write_file(path, contents):
+    """Write ``contents`` to ``path`` unless it already holds them.
+
+    The file is replaced in one step so processes starting at the same
+    time never read it half written, and is left alone when unchanged so
+    running workers do not see it as modified and reload it.  It is
+    written in place if no file can be created next to it, as in the
+    Docker image where only the file itself is writable.
+    """
+    try:
+        with open(path) as rfile:
+            if rfile.read() == contents:
+                return
+    except OSError:
+        pass
+    temp_path = '{0}.{1}.tmp'.format(path, os.getpid())
+    try:
+        with open(temp_path, 'w') as wfile:
+            wfile.write(contents)
+    except OSError:
+        with open(path, 'w') as wfile:
+            wfile.write(contents)
+        return
+    os.replace(temp_path, path)
+
+
 def _configure():
     """Configure the application by trying config file and overriding with
     environment variables.
@@ -58,6 +246,8 @@ def _configure():
             config_file_path = config_path
             break
     if config_file_path:
+        # Only imported when there is a file to read, it is slow to import
+        import yaml
         with open(config_file_path) as config_file:
             fallback_config = yaml.load(config_file)
 
@@ -69,13 +259,16 @@ def _configure():
 
     if configuration['LMODP_HTPASSWD']:
         configuration['LMODP_HTPASSWD_PATH'] = os.path.abspath('.htpasswd')
-        with open(configuration['LMODP_HTPASSWD_PATH'], 'w') as wfile:
-            wfile.write(configuration['LMODP_HTPASSWD'])
+        _write_file(
+            configuration['LMODP_HTPASSWD_PATH'],
+            configuration['LMODP_HTPASSWD']
+        )
 
     if configuration['LMODP_CERT_STRING']:
         configuration['LMODP_CERT'] = os.path.abspath('.cert.pem')
-        with open(configuration['LMODP_CERT'], 'w') as wfile:
-            wfile.write(configuration['LMODP_CERT_STRING'])
+        _write_file(
+            configuration['LMODP_CERT'], configuration['LMODP_CERT_STRING']
+        )
 
     return configuration
 
@@ -2,21 +2,54 @@
 """Blueprint for handling the ``POST`` from the edx-platform
 REMOTE_GRADEBOOK feature.
 """
+from functools import partial
 import logging
+import math
+import time
 
 from flask import (
     Blueprint,
     current_app,
+    g,
+    json,
     jsonify,
     request,
     render_template,
+    stream_with_context,
+    url_for,
 )
-from pylmod import GradeBook
 
-from lmod_proxy.auth import requires_auth
-from lmod_proxy.edx_grades.forms import ACTIONS, EdXGradesForm
+from lmod_proxy.auth import is_admin, requires_auth
+from lmod_proxy.edx_grades.actions import request_flag, retry_grades
+from lmod_proxy.edx_grades.compression import compress_response
+from lmod_proxy.edx_grades.fanout import fan_out, gradebook_form
+from lmod_proxy.edx_grades.forms import (
+    ACTIONS,
+    READ_ACTIONS,
+    EdXGradesForm,
+    FanOutForm,
+)
+from lmod_proxy.edx_grades.streaming import json_response
+from lmod_proxy.metrics import REQUEST_SECONDS
+from lmod_proxy.profiling import (
+    log_timings,
+    phase,
+    phase_timings,
+    profiled,
+    server_timing,
+)
 
 log = logging.getLogger('lmod_proxy.edx_grades')
+
+#: Attributes of :py:data:`flask.g` set by
+#: :py:func:`lmod_proxy.edx_grades.actions.cached_read`
+READ_CACHE_FLAGS = ('read_cache_hit', 'read_cache_stale')
+
+#: Settings of each rate limit, requests per minute and burst
+RATE_LIMITS = {
+    'read': ('LMODP_READ_RATE_LIMIT', 'LMODP_READ_RATE_BURST'),
+    'post': ('LMODP_POST_RATE_LIMIT', 'LMODP_POST_RATE_BURST'),
+}
 edx_grades = Blueprint(
     'edx_grades',
     __name__,
@@ -25,8 +58,263 @@ edx_grades = Blueprint(
 )
 
 
+@edx_grades.before_request
+def start_retries():
+    """Make sure this worker is retrying queued grade postings"""
+    current_app.config['retry_queue'].start(
+        # pylint: disable=protected-access
+        partial(retry_grades, current_app._get_current_object())
+    )
+
+
+@edx_grades.before_request
+def start_timer():
+    """Note when the request started for the latency histogram"""
+    g.request_started = time.monotonic()
+
+
+@edx_grades.after_request
+def observe_latency(response):
+    """Record the request latency labelled by ``submit`` action for
+    API calls, and by view for everything else, and report the time
+    spent in each phase in a ``Server-Timing`` header and log line."""
+    if 'request_started' not in g:
+        return response
+    total = time.monotonic() - g.request_started
+    action = (request.endpoint or '').rpartition('.')[2]
+    if request.method == 'POST' and action == 'index':
+        action = request.form.get('submit')
+        if action not in ACTIONS:
+            action = 'invalid'
+    REQUEST_SECONDS.observe(total, action=action)
+    timings = phase_timings() + [('total', total)]
+    response.headers['Server-Timing'] = server_timing(timings)
+    log_timings(action, response.status_code, timings)
+    return response
+
+
+# Registered after observe_latency so it runs first and is timed
+@edx_grades.after_request
+def compress(response):
+    """Compress responses for clients that accept it"""
+    return compress_response(response)
+
+
+def rate_limited(user, bucket, cost=1):
+    """Take one of ``user``'s requests from the ``bucket`` rate limit.
+
+    Args:
+        user (str): Authenticated user
+        bucket (str): ``read`` or ``post``
+        cost (int): Requests to LMod this one stands for
+    Returns:
+        flask.response: JSON error with status 429 and ``Retry-After``
+        if the user is over the limit, otherwise ``None``
+    """
+    rate_key, burst_key = RATE_LIMITS[bucket]
+    with phase('rate_limit'):
+        wait = current_app.config['rate_limiter'].take(
+            user,
+            bucket,
+            float(current_app.config[rate_key]) / 60,
+            float(current_app.config[burst_key]),
+            cost
+        )
+    if not wait:
+        return None
+    retry_after = int(math.ceil(wait))
+    log.warning(
+        'Rate limited %s request from %s for %d seconds',
+        bucket, user, retry_after
+    )
+    response = jsonify(
+        dict(
+            msg='Too many requests, retry in {0} seconds'.format(retry_after),
+            data=[]
+        )
+    )
+    response.status_code = 429
+    response.headers['Retry-After'] = str(retry_after)
+    return response
+
+
+def dispatch(form):
+    """Run the action requested by ``form``.
+
+    Identical concurrent read actions share a single upstream call, and
+    the read cache state it left on :py:data:`flask.g`, which sets the
+    ``X-Cache`` header of every response sharing it.
+
+    Args:
+        form (lmod_proxy.edx_grades.forms.EdXGradesForm): validated form.
+    Returns:
+        tuple: message(str), data(list), success(bool)
+    """
+    action = form.submit.data
+
+    def run():
+        """Run the action against a pooled gradebook client"""
+        with phase('gradebook'):
+            gradebook = current_app.config['gradebook_pool'].get(
+                form.gradebook.data
+            )
+        with phase('action'):
+            return ACTIONS[action](gradebook, form)
+
+    def read():
+        """Run the action, returning its read cache state along with it"""
+        result = run()
+        return result, {
+            name: g.get(name) for name in READ_CACHE_FLAGS if name in g
+        }
+
+    if action not in READ_ACTIONS:
+        return run()
+    result, cache_flags = current_app.config['single_flight'].do(
+        (action, form.gradebook.data, form.section.data), read
+    )
+    for name, value in cache_flags.items():
+        setattr(g, name, value)
+    return result
+
+
+def queue_grades(form, user):
+    """Store the grade spreadsheet of a ``post-grades`` request as a
+    background job and respond with its id.
+
+    Args:
+        form (lmod_proxy.edx_grades.forms.EdXGradesForm): validated form.
+        user (str): Authenticated user
+    Returns:
+        flask.response: JSON with the job id, status 202
+    """
+    job_id = current_app.config['grade_jobs'].submit(
+        current_app._get_current_object(),  # pylint: disable=protected-access
+        form.gradebook.data,
+        user,
+        form.datafile.data.read().decode('utf8'),
+        full=request_flag('full')
+    )
+    response = jsonify(
+        dict(
+            msg=current_app.config['api_messages'].render(
+                'Grade posting queued as job {0}'.format(job_id), True
+            ),
+            data=[],
+            job=job_id
+        )
+    )
+    response.status_code = 202
+    response.headers['Location'] = url_for(
+        'edx_grades.job_status', job_id=job_id
+    )
+    return response
+
+
+@edx_grades.route('/batch', methods=['POST'])
+@requires_auth
+def batch(user):
+    """Run a read action against many gradebooks at once
+
+    Gradebooks are read concurrently, up to ``LMODP_FANOUT_WORKERS`` at
+    a time, and each result is streamed as a line of JSON as soon as it
+    completes, in no particular order.  Each line holds the
+    ``gradebook`` with the ``msg``, ``data`` and ``success`` of the
+    action, which failed for that gradebook alone if ``success`` is
+    false.
+
+    Each gradebook counts as one request against the read rate limit.
+
+    Returns:
+        flask.response: newline delimited JSON, status 422 for malformed
+        requests
+    """
+    form = FanOutForm()
+    if not form.validate():
+        response = jsonify(
+            dict(msg="Malformed API Call: {0}".format(form.errors), data=[])
+        )
+        response.status_code = 422
+        return response
+    limited = rate_limited(user, 'read', len(form.gradebooks.data))
+    if limited is not None:
+        return limited
+    app = current_app._get_current_object()  # pylint: disable=protected-access
+    action = form.submit.data
+    section = form.section.data
+    log.info(
+        'Batch %s of %d gradebooks for %s',
+        action, len(form.gradebooks.data), user
+    )
+
+    def run(gbuuid):
+        """Run the action for one gradebook"""
+        return dispatch(gradebook_form(gbuuid, section, action))
+
+    def generate():
+        """Write each gradebook's result as it completes"""
+        results = fan_out(
+            app,
+            run,
+            form.gradebooks.data,
+            int(app.config['LMODP_FANOUT_WORKERS'])
+        )
+        for gbuuid, result, error in results:
+            if error is None:
+                message, data, success = result
+            else:
+                message, data, success = str(error), [], False
+            yield json.dumps(
+                dict(
+                    gradebook=gbuuid, msg=message, data=data, success=success
+                )
+            ) + '\n'
+
+    return current_app.response_class(
+        stream_with_context(generate()), mimetype='application/x-ndjson'
+    )
+
+
+@edx_grades.route('/jobs/<job_id>', methods=['GET'])
+@requires_auth
+def job_status(job_id, user):
+    """Report the progress and outcome of a background grade posting
+
+    Returns:
+        flask.response: JSON job state, status 404 for unknown jobs or
+        jobs submitted by another user.
+    """
+    grade_jobs = current_app.config['grade_jobs']
+    grade_jobs.resume(
+        current_app._get_current_object()  # pylint: disable=protected-access
+    )
+    job = grade_jobs.get(job_id)
+    if job is None or job['user'] != user:
+        response = jsonify(dict(msg='No such job', data=[]))
+        response.status_code = 404
+        return response
+    return jsonify(job)
+
+
+@edx_grades.route('/retries', methods=['GET'])
+@requires_auth
+def retry_status(user):
+    """Report the depth and oldest entry of the grade retry queue
+
+    Returns:
+        flask.response: JSON queue statistics, status 403 for users that
+        are not administrators.
+    """
+    if not is_admin(user):
+        response = jsonify(dict(msg='Forbidden', data=[]))
+        response.status_code = 403
+        return response
+    return jsonify(current_app.config['retry_queue'].stats())
+
+
 @edx_grades.route('', methods=['GET', 'POST'])
 @requires_auth
+@profiled
 def index(user):
     """Handle ``POST`` from edx-platform or print available actions, and
     provide an interactive test of the available actions on ``GET``.
@@ -39,30 +327,40 @@ def index(user):
         requestor = request.headers.getlist("X-Forwarded-For")[0]
 
     if request.method == 'POST':
-        form = EdXGradesForm()
-        log.info('edX remote gradebook POST request from %s', requestor)
-        log.debug('Headers: %r', request.headers)
-        log.debug('POST data: %r', request.form)
-        log.debug('Form values: %r', form.data)
-        if form.validate():
-            message, data, success = ACTIONS[form.submit.data](
-                GradeBook(
-                    current_app.config['LMODP_CERT'],
-                    current_app.config['LMODP_URLBASE'],
-                    gbuuid=form.gradebook.data
-                ),
-                form
-            )
-            return jsonify(
-                dict(
-                    msg=render_template(
-                        'api_message.html',
-                        message=message,
-                        success=success
+        limited = rate_limited(
+            user,
+            'post' if request.form.get('submit') == 'post-grades' else 'read'
+        )
+        if limited is not None:
+            return limited
+        with phase('validate'):
+            form = EdXGradesForm()
+            log.info('edX remote gradebook POST request from %s', requestor)
+            log.debug('Headers: %r', request.headers)
+            log.debug('POST data: %r', request.form)
+            log.debug('Form values: %r', form.data)
+            valid = form.validate()
+        if valid:
+            if form.submit.data == 'post-grades' and request_flag('async'):
+                return queue_grades(form, user)
+            message, data, success = dispatch(form)
+            with phase('render'):
+                response = json_response(
+                    dict(
+                        msg=current_app.config['api_messages'].render(
+                            message, success
+                        ),
+                        data=data
                     ),
-                    data=data
+                    int(current_app.config['LMODP_STREAM_MIN_ITEMS'])
                 )
-            )
+            if g.get('read_cache_stale'):
+                response.headers['X-Cache'] = 'STALE'
+            elif 'read_cache_hit' in g:
+                response.headers['X-Cache'] = (
+                    'HIT' if g.read_cache_hit else 'MISS'
+                )
+            return response
         else:
             response = jsonify(
                 dict(
@@ -1,57 +1,314 @@
 # -*- coding: utf-8 -*-
 """Actions to perform based on API request.
 """
+from concurrent.futures import ThreadPoolExecutor
+import io
 import logging
-import tempfile
+import time
 
-from flask import render_template, current_app
+from flask import (
+    current_app,
+    g,
+    has_app_context,
+    has_request_context,
+    request,
+)
 from requests.exceptions import RequestException
 
 from pylmod.exceptions import PyLmodException
 
+from lmod_proxy.edx_grades.batches import post_batches, roster
+from lmod_proxy.edx_grades.messages import render_failed_grades
+from lmod_proxy.edx_grades.upstream import (
+    DIRECT,
+    CircuitOpenError,
+    UpstreamBusyError,
+)
+from lmod_proxy.metrics import CSV_BYTES, FAILED_GRADES
+
 log = logging.getLogger(__name__)
 
+#: Read actions whose results are kept in the read cache
+CACHED_READS = ('assignments', 'sections')
 
-def post_grades(gradebook, form):
-    """post grades to LMod using :py:class::`pylmod.GradeBook`
+
+class UploadStream(object):
+    """Binary upload that :py:class:`io.TextIOWrapper` can decode.
+
+    Werkzeug spools uploads into a
+    :py:class:`tempfile.SpooledTemporaryFile`, which lacks ``readable``
+    and ``seekable`` before Python 3.11.  Everything else is passed
+    through to the upload.
 
     Args:
-        gradebook (pylmod.GradeBook): Instantiated grade book class.
+        stream (file): Readable, seekable binary file object
+    """
+
+    def __init__(self, stream):
+        self._stream = stream
+
+    def __getattr__(self, name):
+        return getattr(self._stream, name)
+
+    def readable(self):  # pylint: disable=no-self-use
+        """Uploads can always be read"""
+        return True
+
+    def writable(self):  # pylint: disable=no-self-use
+        """Uploads are never written through the text wrapper"""
+        return False
+
+    def seekable(self):  # pylint: disable=no-self-use
+        """Uploads are spooled, so they can always be seeked"""
+        return True
+
+
+def request_flag(name):
+    """Return True if the query string or form sets ``name`` to a true
+    value like ``1`` or ``true``."""
+    return request.values.get(name, '').lower() in ('1', 'true', 'yes', 'on')
+
+
+def _read_cache():
+    """Return the application's read cache, or ``None`` when called
+    outside of an application context."""
+    if not has_app_context():
+        return None
+    return current_app.config.get('read_cache')
+
+
+def upstream():
+    """Return the application's guard for LMod calls, or calls without
+    protection outside of an application context."""
+    if not has_app_context():
+        return DIRECT
+    return current_app.config.get('lmod_upstream', DIRECT)
+
+
+def lmod_call(gradebook, name, **kwargs):
+    """Call the method ``name`` of ``gradebook`` with ``kwargs``
+    through the LMod circuit breaker and concurrency limit."""
+    return upstream().call(name, getattr(gradebook, name), **kwargs)
+
+
+def cached_read(name, form, fetch):
+    """Return ``fetch()`` through the read cache keyed by ``name`` and
+    gradebook, recording whether it was a cache hit on ``flask.g``.
+
+    Only successful reads are cached; exceptions from ``fetch``
+    propagate, unless LMod calls are being rejected to protect it and
+    an expired copy of the data is still held.  That copy is returned
+    and ``flask.g.read_cache_stale`` set.  Cached reads are only used
+    while the gradebook's read generation, shared by all workers, is
+    the one they were fetched in.
+
+    Args:
+        name (str): Name of the data being read, i.e. ``sections``
         form (lmod_proxy.edx_grades.forms.EdXGradesForm): validated form.
+        fetch (callable): Retrieves the data from LMod
     Returns:
-        tuple: message(str), data(list), success(bool)
+        object: cached or freshly fetched data
+    """
+    cache = _read_cache()
+    if cache is None:
+        return fetch()
+    key = (name, form.gradebook.data)
+    generation = None
+    generations = current_app.config.get('read_generations')
+    if generations is not None:
+        # Read before fetching, so an invalidation while fetching makes
+        # the cached read stale
+        generation = generations.get(form.gradebook.data)
+    data = None
+    entry = cache.get(key)
+    if entry is not None and entry[0] == generation:
+        data = entry[1]
+    g.read_cache_hit = data is not None
+    if data is None:
+        stale_cache = current_app.config.get('stale_reads')
+        try:
+            data = fetch()
+        except (CircuitOpenError, UpstreamBusyError):
+            if stale_cache is None:
+                raise
+            data = stale_cache.get(key)
+            if data is None:
+                raise
+            g.read_cache_stale = True
+            return data
+        cache.set(key, (generation, data))
+        if stale_cache is not None:
+            stale_cache.set(key, data)
+    return data
+
+
+def invalidate_reads(gbuuid):
+    """Drop every cached read for the gradebook ``gbuuid`` in this
+    worker and make other workers drop theirs"""
+    cache = _read_cache()
+    if cache is not None:
+        for name in CACHED_READS:
+            cache.pop((name, gbuuid))
+        generations = current_app.config.get('read_generations')
+        if generations is not None:
+            generations.bump(gbuuid)
+
+
+def queue_retry(gbuuid, csv_file, error_message):
+    """Store a grade spreadsheet that failed to post in the retry queue,
+    if it is enabled.
+
+    Args:
+        gbuuid (str): UUID of the gradebook
+        csv_file (file): Seekable text CSV of grades
+        error_message (str): Why posting failed
+    """
+    retry_queue = current_app.config['retry_queue']
+    if not retry_queue.enabled:
+        return
+    try:
+        csv_file.seek(0)
+        retry_queue.enqueue(gbuuid, csv_file.read(), error_message)
+    except Exception:  # pylint: disable=broad-except
+        log.exception('Unable to queue grades for %s for retry', gbuuid)
+
+
+def send_grades(
+        gradebook, gbuuid, csv_file, progress=None, retry=True, full=False
+):
+    """Post a grade spreadsheet to LMod, in batches if configured.
+
+    With ``LMODP_DELTA_GRADES`` set, only grades that changed since the
+    last successful posting are sent unless ``full`` is True, and
+    nothing is sent if no grade changed.  When LMod fails, the
+    spreadsheet is put in the retry queue unless ``retry`` is False.  A
+    successful posting supersedes queued postings for the same
+    gradebook.
+
+    Args:
+        gradebook (pylmod.GradeBook): Instantiated grade book class.
+        gbuuid (str): UUID of the gradebook
+        csv_file (file): Readable text CSV of grades
+        progress (callable): Called with the number of batches posted
+            so far when posting in batches.
+        retry (bool): Queue the spreadsheet for retrying on errors
+        full (bool): Send every grade even if posting only changes
+    Returns:
+        tuple: error message(str), LMod response(dict or None)
     """
+    # pylint: disable=too-many-arguments,too-many-locals
+    started = time.time()
     error_message = ''
+    delta = None
+    if current_app.config['LMODP_DELTA_GRADES']:
+        delta = current_app.config['posted_grades'].diff(
+            gbuuid, csv_file, full=full
+        )
+        if not delta.changed:
+            log.info('No grade changes for %s, nothing to post', gbuuid)
+            return error_message, None
+        csv_file = delta.csv_file
     approve_grades = False
     if current_app.config['LMODP_APPROVE_GRADES']:
         approve_grades = True
-    csv_file = tempfile.TemporaryFile(mode='w+')
-    csv_file.write(form.datafile.data.read().decode('utf8'))
-    csv_file.seek(0)
-    log.debug('Received grade CSV: %s', csv_file.read())
-    # Seek back to 0 for future reading
-    csv_file.seek(0)
+    post_options = dict(
+        approve_grades=approve_grades,
+        use_max_points_column=True,
+        max_points_column='max_pts',
+        normalize_column='normalize'
+    )
+    batch_size = int(current_app.config['LMODP_GRADE_BATCH_SIZE'])
     results = None
+    students = None
     try:
-        results, time_taken = gradebook.spreadsheet2gradebook(
-            csv_file=csv_file,
-            approve_grades=approve_grades,
-            use_max_points_column=True,
-            max_points_column='max_pts',
-            normalize_column='normalize'
-        )
-    except PyLmodException as ex:
+        if delta is not None:
+            # Needed to know which grades LMod accepts
+            students = roster(lmod_call(gradebook, 'get_students'))
+        if batch_size > 0:
+            results, time_taken = post_batches(
+                gradebook,
+                csv_file,
+                batch_size,
+                int(current_app.config['LMODP_GRADE_BATCH_WORKERS']),
+                progress=progress,
+                upstream=upstream(),
+                students=students,
+                **post_options
+            )
+        else:
+            results, time_taken = lmod_call(
+                gradebook,
+                'spreadsheet2gradebook',
+                csv_file=csv_file,
+                **post_options
+            )
+    except (PyLmodException, RequestException) as ex:
         error_message = str(ex)
+        if retry:
+            queue_retry(gbuuid, csv_file, error_message)
+    else:
+        # Posting can create assignments
+        invalidate_reads(gbuuid)
+        if current_app.config['retry_queue'].enabled:
+            current_app.config['retry_queue'].supersede(gbuuid, started)
+        # Unknown which grades failed, so only remember complete postings
+        if delta is not None and failed_grades(results)[0] == 0:
+            current_app.config['posted_grades'].record(
+                gbuuid, delta.accepted(students)
+            )
+    return error_message, results
+
+
+def retry_grades(app, gbuuid, csv_text):
+    """Post a queued grade spreadsheet again, for
+    :py:meth:`lmod_proxy.edx_grades.retries.RetryQueue.drain`
+
+    Args:
+        app (flask.Flask): Application to post within
+        gbuuid (str): UUID of the gradebook
+        csv_text (str): Grade spreadsheet
+    Returns:
+        str: error message, empty if the grades were posted
+    """
+    with app.app_context():
+        gradebook = app.config['gradebook_pool'].get(gbuuid)
+        error_message, _ = send_grades(
+            gradebook, gbuuid, io.StringIO(csv_text, newline=''), retry=False
+        )
+    return error_message
 
+
+def failed_grades(results):
+    """Return the number of failed grades and the failed grade rows
+    from an LMod grade posting response.
+
+    Args:
+        results (dict): LMod response or ``None``
+    Returns:
+        tuple: number failed(int), failed grades(list)
+    """
     number_failed = 0
     if results and results.get('data'):
         number_failed = int(results['data'].get('numFailures', 0))
     if number_failed > 0:
-        error_message = render_template(
-            'grade_transfer_failed.html',
-            number_failed=number_failed,
-            failed_grades=results['data']['results']
-        )
+        return number_failed, results['data']['results']
+    return 0, []
+
+
+def grades_result(error_message, results):
+    """Build the action result for a grade posting
+
+    Args:
+        error_message (str): Error from :py:func:`send_grades`
+        results (dict): LMod response from :py:func:`send_grades`
+    Returns:
+        tuple: message(str), data(list), success(bool)
+    """
+    number_failed, failed = failed_grades(results)
+    if results is not None:
+        FAILED_GRADES.observe(number_failed)
+    if number_failed > 0:
+        error_message = render_failed_grades(number_failed, failed)
     return (
         error_message or 'Successfully posted grades',
         [],
@@ -59,6 +316,40 @@ def post_grades(gradebook, form):
     )
 
 
+def post_grades(gradebook, form):
+    """post grades to LMod using :py:class::`pylmod.GradeBook`
+
+    Args:
+        gradebook (pylmod.GradeBook): Instantiated grade book class.
+        form (lmod_proxy.edx_grades.forms.EdXGradesForm): validated form.
+    Returns:
+        tuple: message(str), data(list), success(bool)
+    """
+    upload = form.datafile.data.stream
+    upload.seek(0, io.SEEK_END)
+    CSV_BYTES.observe(upload.tell())
+    upload.seek(0)
+    # Decode the upload as pylmod reads it rather than copying it
+    csv_file = io.TextIOWrapper(
+        UploadStream(upload), encoding='utf8', newline=''
+    )
+    if log.isEnabledFor(logging.DEBUG):
+        log.debug('Received grade CSV: %s', csv_file.read())
+        # Seek back to 0 for future reading
+        csv_file.seek(0)
+    try:
+        error_message, results = send_grades(
+            gradebook,
+            form.gradebook.data,
+            csv_file,
+            full=has_request_context() and request_flag('full')
+        )
+    finally:
+        # Leave the upload open for its owner to close
+        csv_file.detach()
+    return grades_result(error_message, results)
+
+
 def get_membership(gradebook, form):
     """Return students in gradebook specified
 
@@ -70,7 +361,9 @@ def get_membership(gradebook, form):
     """
     error_message = ''
     try:
-        data = gradebook.get_students(
+        data = lmod_call(
+            gradebook,
+            'get_students',
             simple=True,
             section_name=form.section.data
         )
@@ -95,7 +388,11 @@ def get_assignments(gradebook, form):
     """
     error_message = ''
     try:
-        data = gradebook.get_assignments(simple=True)
+        data = cached_read(
+            'assignments',
+            form,
+            lambda: lmod_call(gradebook, 'get_assignments', simple=True)
+        )
     except (PyLmodException, RequestException) as ex:
         data = [{}]
         error_message = str(ex)
@@ -117,7 +414,11 @@ def get_sections(gradebook, form):
     """
     error_message = ''
     try:
-        data = gradebook.get_sections(simple=True)
+        data = cached_read(
+            'sections',
+            form,
+            lambda: lmod_call(gradebook, 'get_sections', simple=True)
+        )
     except (PyLmodException, RequestException) as ex:
         data = [{}]
         error_message = str(ex)
@@ -126,3 +427,52 @@ def get_sections(gradebook, form):
         data,
         not bool(error_message)
     )
+
+
+#: Read actions combined by :py:func:`get_all`, keyed by action name
+COMBINED_READS = (
+    ('get-assignments', get_assignments),
+    ('get-sections', get_sections),
+    ('get-membership', get_membership),
+)
+
+
+def get_all(gradebook, form):
+    """Return the assignments, sections and students of the gradebook
+    in one response, reading them from LMod at the same time through
+    the one client.
+
+    Args:
+        gradebook (pylmod.GradeBook): Instantiated grade book class.
+        form (lmod_proxy.edx_grades.forms.EdXGradesForm): validated form.
+    Returns:
+        tuple: message(str), data(dict), success(bool) where data holds
+        the ``msg``, ``data`` and ``success`` of each read by action
+    """
+    app = current_app._get_current_object()  # pylint: disable=protected-access
+
+    def read(action):
+        """Run one read action in its own application context"""
+        with app.app_context():
+            result = action(gradebook, form)
+            return result, g.get('read_cache_stale', False)
+
+    with ThreadPoolExecutor(max_workers=len(COMBINED_READS)) as executor:
+        futures = [
+            (name, executor.submit(read, action))
+            for name, action in COMBINED_READS
+        ]
+        data = {}
+        errors = []
+        for name, future in futures:
+            (message, items, success), stale = future.result()
+            data[name] = dict(msg=message, data=items, success=success)
+            if not success:
+                errors.append('{0}: {1}'.format(name, message))
+            if stale:
+                g.read_cache_stale = True
+    return (
+        '; '.join(errors) or 'Successfully retrieved gradebook',
+        data,
+        not errors
+    )
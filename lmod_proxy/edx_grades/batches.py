@@ -0,0 +1,307 @@
+# -*- coding: utf-8 -*-
+"""Posting of large grade spreadsheets to LMod in parallel batches."""
+from concurrent.futures import ThreadPoolExecutor
+import csv
+import logging
+import threading
+import time
+
+from pylmod.exceptions import PyLmodFailedAssignmentCreation
+from pylmod.gradebook import DEFAULT_MAX_POINTS
+
+from lmod_proxy.edx_grades.upstream import DIRECT
+
+log = logging.getLogger(__name__)
+
+#: Column holding the student's email in edX grade spreadsheets
+EMAIL_FIELD = 'External email'
+
+#: Columns that are never assignments, as treated by
+#: :py:meth:`pylmod.GradeBook.spreadsheet2gradebook`
+NON_ASSIGNMENT_FIELDS = (
+    'ID', 'Username', 'Full Name', 'edX email', EMAIL_FIELD,
+)
+
+
+def roster(students):
+    """Map the lower cased emails of ``students`` to their student ids,
+    keeping the first student of duplicated emails as pylmod does.
+
+    Args:
+        students (list): Students from :py:meth:`pylmod.GradeBook.get_students`
+    Returns:
+        dict: student id by email
+    """
+    return {
+        student['accountEmail'].lower(): student['studentId']
+        for student in reversed(students)
+    }
+
+
+class GradeArrays(object):
+    """Turns spreadsheet rows into LMod ``multiGrades`` grade arrays the
+    way :py:meth:`pylmod.GradeBook.spreadsheet2gradebook` does, but with
+    the roster and assignments read once for the whole spreadsheet.
+
+    Rows of students missing from the roster, and grades that are not
+    numbers, are skipped as pylmod skips them.  Assignments missing from
+    the gradebook are created once, when the first row of a known
+    student is converted.
+
+    Args:
+        gradebook (pylmod.GradeBook): Instantiated grade book class.
+        fieldnames (list): Columns of the spreadsheet
+        students (dict): student id by lower cased email, see
+            :py:func:`roster`
+        assignments (list): Assignments from
+            :py:meth:`pylmod.GradeBook.get_assignments`
+        upstream (lmod_proxy.edx_grades.upstream.Upstream): Makes the
+            LMod calls
+        approve_grades (bool): Approve the posted grades
+        use_max_points_column (bool): Take the maximum points of created
+            assignments from ``max_points_column`` unless
+            ``normalize_column`` says the grades are normalized.
+        max_points_column (str): Column with maximum points
+        normalize_column (str): Column with the normalize flag
+    """
+    # pylint: disable=too-many-instance-attributes
+
+    def __init__(
+            self,
+            gradebook,
+            fieldnames,
+            students,
+            assignments,
+            upstream=DIRECT,
+            approve_grades=False,
+            use_max_points_column=False,
+            max_points_column=None,
+            normalize_column=None
+    ):
+        # pylint: disable=too-many-arguments
+        self.gradebook = gradebook
+        self.students = students
+        self.upstream = upstream
+        self.approve_grades = approve_grades
+        self.use_max_points_column = use_max_points_column
+        self.max_points_column = max_points_column
+        self.normalize_column = normalize_column
+        skipped = set(NON_ASSIGNMENT_FIELDS)
+        skipped.update(
+            column for column in (max_points_column, normalize_column)
+            if column is not None
+        )
+        self.columns = [field for field in fieldnames if field not in skipped]
+        self.assignment_ids = {
+            assignment['name']: assignment['assignmentId']
+            for assignment in reversed(assignments)
+        }
+        self._created = False
+
+    def _max_points(self, row):
+        """Maximum points of assignments created from ``row``"""
+        if not self.use_max_points_column:
+            return DEFAULT_MAX_POINTS
+        try:
+            normalized = bool(int(row.get(self.normalize_column) or 1))
+        except ValueError:
+            normalized = True
+        if normalized:
+            return DEFAULT_MAX_POINTS
+        try:
+            return float(row.get(self.max_points_column))
+        except (TypeError, ValueError):
+            return DEFAULT_MAX_POINTS
+
+    def _create_assignments(self, row):
+        """Create the assignment columns missing from the gradebook"""
+        self._created = True
+        for name in self.columns:
+            if name in self.assignment_ids:
+                continue
+            log.info('Creating assignment %s', name)
+            response = self.upstream.call(
+                'create_assignment',
+                self.gradebook.create_assignment,
+                name,
+                name[0:3] + name[-2:],
+                1.0,
+                self._max_points(row),
+                '12-15-2013'
+            )
+            data = response.get('data') or {}
+            if 'assignmentId' not in data:
+                raise PyLmodFailedAssignmentCreation(
+                    'Error! Failed to create assignment {0}, got {1}'.format(
+                        name, response
+                    )
+                )
+            self.assignment_ids[name] = data['assignmentId']
+
+    def grades(self, row):
+        """Return the grades of a spreadsheet row for ``multiGrades``
+
+        Args:
+            row (dict): Row read by :py:class:`csv.DictReader`
+        Returns:
+            list: grade dictionaries, empty if the student is unknown
+        """
+        student_id = self.students.get((row.get(EMAIL_FIELD) or '').lower())
+        if student_id is None:
+            log.warning(
+                'Cannot find student id for email="%s"', row.get(EMAIL_FIELD)
+            )
+            return []
+        if not self._created:
+            self._create_assignments(row)
+        grades = []
+        for name in self.columns:
+            try:
+                value = float(row[name])
+            except (TypeError, ValueError):
+                log.warning(
+                    'Grade %r of %s for %s is not a number',
+                    row[name], student_id, name
+                )
+                continue
+            grades.append({
+                'studentId': student_id,
+                'assignmentId': self.assignment_ids[name],
+                'numericGradeValue': value,
+                'mode': 2,
+                'isGradeApproved': self.approve_grades,
+            })
+        return grades
+
+
+def iter_grade_batches(rows, arrays, batch_size):
+    """Convert ``rows`` into grade arrays of at most ``batch_size`` rows.
+    Batches without any grade are not produced.
+
+    Args:
+        rows (iterable): Spreadsheet rows
+        arrays (GradeArrays): Converts the rows
+        batch_size (int): Maximum rows per batch
+    Yields:
+        list: grade array for ``multiGrades``
+    """
+    grades = []
+    count = 0
+    for row in rows:
+        grades.extend(arrays.grades(row))
+        count += 1
+        if count >= batch_size:
+            if grades:
+                yield grades
+            grades = []
+            count = 0
+    if grades:
+        yield grades
+
+
+def merge_results(results):
+    """Combine ``multiGrades`` responses from several batches into one
+    response with the total ``numFailures`` and every result row.
+
+    Args:
+        results (list): LMod responses for each batch
+    Returns:
+        dict: merged response
+    """
+    merged = {'data': {'numFailures': 0, 'results': []}}
+    for result in results:
+        data = (result or {}).get('data') or {}
+        merged['data']['numFailures'] += int(data.get('numFailures', 0))
+        merged['data']['results'].extend(data.get('results') or [])
+    return merged
+
+
+def post_batches(
+        gradebook,
+        csv_file,
+        batch_size,
+        max_workers,
+        progress=None,
+        upstream=DIRECT,
+        students=None,
+        **kwargs
+):
+    """Post a grade spreadsheet to LMod in batches of rows.
+
+    The roster and assignments are read once, and assignments missing
+    from the gradebook created once, before any grade is posted.  Then
+    the grades of each batch are posted with ``multiGrades`` by up to
+    ``max_workers`` threads.  Batches are converted from ``csv_file``
+    only as workers free up, so memory use does not grow with the size
+    of the spreadsheet.  Every batch is attempted even if one fails;
+    the first error is then raised.
+
+    Args:
+        gradebook (pylmod.GradeBook): Instantiated grade book class.
+        csv_file (file): Readable text CSV
+        batch_size (int): Maximum rows per batch
+        max_workers (int): Maximum batches posted at once
+        progress (callable): Called with the number of batches posted so
+            far after each batch completes.
+        upstream (lmod_proxy.edx_grades.upstream.Upstream): Makes the
+            LMod calls
+        students (dict): Roster already read, see :py:func:`roster`
+        kwargs: Options of :py:class:`GradeArrays`, as taken by
+            :py:meth:`pylmod.GradeBook.spreadsheet2gradebook`
+    Returns:
+        tuple: merged response and duration of the operation
+    """
+    # pylint: disable=too-many-arguments,too-many-locals
+    tstart = time.time()
+    reader = csv.DictReader(csv_file, dialect='excel')
+    if students is None:
+        students = roster(
+            upstream.call('get_students', gradebook.get_students)
+        )
+    arrays = GradeArrays(
+        gradebook,
+        reader.fieldnames or [],
+        students,
+        upstream.call('get_assignments', gradebook.get_assignments),
+        upstream=upstream,
+        **kwargs
+    )
+    batches = iter_grade_batches(reader, arrays, batch_size)
+
+    posted = [0]
+    posted_lock = threading.Lock()
+    slots = threading.BoundedSemaphore(max_workers)
+
+    def post(grade_array):
+        """Post one batch, free its slot and return the response"""
+        try:
+            response = upstream.call(
+                'multi_grade', gradebook.multi_grade, grade_array
+            )
+            with posted_lock:
+                posted[0] += 1
+                if progress is not None:
+                    progress(posted[0])
+            return response
+        finally:
+            slots.release()
+
+    results = []
+    errors = []
+    futures = []
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        for grade_array in batches:
+            slots.acquire()
+            futures.append(executor.submit(post, grade_array))
+    for future in futures:
+        try:
+            results.append(future.result())
+        except Exception as ex:  # pylint: disable=broad-except
+            errors.append(ex)
+    log.info(
+        'Posted %d grade batches in %6.2f seconds',
+        len(futures), time.time() - tstart
+    )
+    if errors:
+        raise errors[0]
+    return merge_results(results), time.time() - tstart
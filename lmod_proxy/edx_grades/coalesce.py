@@ -0,0 +1,63 @@
+# -*- coding: utf-8 -*-
+"""Coalescing of identical concurrent upstream reads."""
+import threading
+
+
+class _Call(object):
+    """A call in flight and its outcome"""
+    # pylint: disable=too-few-public-methods
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+        self.waiters = 0
+
+
+class SingleFlight(object):
+    """Share one in-flight call between concurrent callers asking for
+    the same key.
+
+    The first caller for a key runs the function; callers arriving
+    while it runs wait for it and receive the same result, or have the
+    same exception raised.  Nothing is remembered once the call
+    finishes, so later callers always trigger a new call.
+    """
+
+    def __init__(self):
+        self._calls = {}
+        self._lock = threading.Lock()
+
+    def do(self, key, func):
+        """Run ``func`` unless an identical call is already in flight.
+
+        Args:
+            key (hashable): Identifies identical calls
+            func (callable): Called with no arguments
+        Returns:
+            object: return value of the shared call
+        """
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+            else:
+                call.waiters += 1
+
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = func()
+        except BaseException as ex:
+            call.error = ex
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+        return call.result
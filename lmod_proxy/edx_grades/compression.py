@@ -0,0 +1,130 @@
+# -*- coding: utf-8 -*-
+"""Compression of API responses negotiated from ``Accept-Encoding``.
+
+Responses at least ``LMODP_COMPRESS_MIN_SIZE`` bytes long are gzipped,
+or compressed with brotli when the ``brotli`` package is installed and
+the client prefers it.  Streamed responses have no known size and are
+always compressed as they are written.
+"""
+import logging
+import zlib
+
+from flask import current_app, request
+
+try:
+    import brotli
+except ImportError:  # pragma: no cover
+    brotli = None
+
+from lmod_proxy.profiling import phase
+
+log = logging.getLogger(__name__)
+
+#: Mimetypes worth compressing
+COMPRESSIBLE = ('application/json', 'text/html', 'text/plain', 'text/css')
+
+#: ``wbits`` that makes zlib write the gzip format
+GZIP_WBITS = 16 + zlib.MAX_WBITS
+
+
+def available_encodings(names):
+    """Return the encodings in ``names`` this process can produce, in
+    order of preference.
+
+    Args:
+        names (str): Comma separated encodings, i.e. ``br,gzip``
+    Returns:
+        list: supported encoding names
+    """
+    encodings = []
+    for name in names.split(','):
+        name = name.strip().lower()
+        if name == 'gzip' or (name == 'br' and brotli is not None):
+            encodings.append(name)
+        elif name:
+            log.warning('Response compression %s is not available', name)
+    return encodings
+
+
+def negotiate(accept_encodings, encodings):
+    """Pick the encoding the client accepts with the highest quality,
+    preferring earlier ``encodings`` on ties.
+
+    Args:
+        accept_encodings (werkzeug.datastructures.Accept): Parsed
+            ``Accept-Encoding`` header
+        encodings (list): Encodings available in order of preference
+    Returns:
+        str: chosen encoding, or ``None`` to send the response as is
+    """
+    best, best_quality = None, 0
+    for encoding in encodings:
+        quality = accept_encodings.quality(encoding)
+        if quality > best_quality:
+            best, best_quality = encoding, quality
+    return best
+
+
+def compressor(encoding):
+    """Return a new compressor for ``encoding`` with the configured level
+
+    Returns:
+        tuple: functions compressing a chunk and finishing the stream
+    """
+    if encoding == 'br':
+        brotli_compressor = brotli.Compressor(
+            quality=int(current_app.config['LMODP_BROTLI_QUALITY'])
+        )
+        return brotli_compressor.process, brotli_compressor.finish
+    zlib_compressor = zlib.compressobj(
+        int(current_app.config['LMODP_GZIP_LEVEL']), zlib.DEFLATED, GZIP_WBITS
+    )
+    return zlib_compressor.compress, zlib_compressor.flush
+
+
+def _compress_stream(chunks, compress, finish):
+    """Yield ``chunks`` compressed as compressed output becomes ready"""
+    for chunk in chunks:
+        compressed = compress(chunk)
+        if compressed:
+            yield compressed
+    yield finish()
+
+
+def compress_response(response):
+    """Compress ``response`` if the client accepts an available encoding
+    and it is large enough to be worth it.
+
+    Args:
+        response (flask.Response): Response to the current request
+    Returns:
+        flask.Response: the same response, possibly compressed
+    """
+    encodings = current_app.config['compression_encodings']
+    if (
+            not encodings or
+            response.status_code < 200 or
+            response.status_code in (204, 304) or
+            response.direct_passthrough or
+            response.mimetype not in COMPRESSIBLE or
+            'Content-Encoding' in response.headers
+    ):
+        return response
+    response.vary.add('Accept-Encoding')
+    encoding = negotiate(request.accept_encodings, encodings)
+    if encoding is None:
+        return response
+    compress, finish = compressor(encoding)
+    if response.is_streamed:
+        response.response = _compress_stream(
+            response.iter_encoded(), compress, finish
+        )
+        response.headers.pop('Content-Length', None)
+    else:
+        data = response.get_data()
+        if len(data) < int(current_app.config['LMODP_COMPRESS_MIN_SIZE']):
+            return response
+        with phase('compress'):
+            response.set_data(compress(data) + finish())
+    response.headers['Content-Encoding'] = encoding
+    return response
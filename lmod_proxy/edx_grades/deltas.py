@@ -0,0 +1,182 @@
+# -*- coding: utf-8 -*-
+"""Posting only the grades that changed since the last posting."""
+import csv
+import io
+import logging
+
+from lmod_proxy.store import connect
+
+log = logging.getLogger(__name__)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS posted_grades (
+    gradebook TEXT NOT NULL,
+    assignment TEXT NOT NULL,
+    student TEXT NOT NULL,
+    value TEXT NOT NULL,
+    PRIMARY KEY (gradebook, assignment, student)
+) WITHOUT ROWID;
+"""
+
+#: Column holding the student's email in edX grade spreadsheets
+EMAIL_FIELD = 'External email'
+
+#: Columns that are not assignments, as treated by
+#: :py:meth:`pylmod.GradeBook.spreadsheet2gradebook`
+NON_ASSIGNMENT_FIELDS = (
+    'ID', 'Username', 'Full Name', 'edX email', EMAIL_FIELD,
+    'max_pts', 'normalize',
+)
+
+
+class GradeDelta(object):
+    """Changed part of a grade spreadsheet
+
+    Attributes:
+        csv_file (io.StringIO): Spreadsheet with only the rows and
+            assignment columns that have changes
+        cells (list): ``(assignment, student, value)`` of every grade in
+            ``csv_file``, recorded once it is posted
+        changed (int): Number of grades that changed
+    """
+    # pylint: disable=too-few-public-methods
+
+    def __init__(self, csv_file, cells, changed):
+        self.csv_file = csv_file
+        self.cells = cells
+        self.changed = changed
+
+    def accepted(self, students):
+        """Return the cells LMod accepts when the delta is posted.
+
+        Rows of students missing from the roster, and grades that are
+        not numbers, are skipped by
+        :py:meth:`pylmod.GradeBook.spreadsheet2gradebook` and so must
+        not be recorded as posted.
+
+        Args:
+            students (dict): student id by lower cased email, see
+                :py:func:`lmod_proxy.edx_grades.batches.roster`
+        Returns:
+            list: ``(assignment, student, value)`` of the accepted grades
+        """
+        cells = []
+        for assignment, student, value in self.cells:
+            if student not in students:
+                continue
+            try:
+                float(value)
+            except ValueError:
+                continue
+            cells.append((assignment, student, value))
+        return cells
+
+
+class PostedGrades(object):
+    """Last grades successfully posted for each gradebook, assignment and
+    student, kept in the local sqlite database.
+
+    Args:
+        path (str): Path to the sqlite database
+    """
+
+    def __init__(self, path):
+        self.path = path
+
+    def _connect(self):
+        return connect(self.path, SCHEMA)
+
+    def diff(self, gbuuid, csv_file, full=False):
+        """Reduce a grade spreadsheet to the grades that changed.
+
+        Rows without a changed grade are dropped, as are assignment
+        columns without a changed grade in the remaining rows.  Unchanged
+        grades in rows and columns that are kept are posted again.
+
+        Args:
+            gbuuid (str): UUID of the gradebook
+            csv_file (file): Readable text CSV of grades
+            full (bool): Keep every grade, only collecting the cells
+        Returns:
+            GradeDelta: changed part of the spreadsheet
+        """
+        posted = {}
+        if not full:
+            posted = {
+                (assignment, student): value
+                for assignment, student, value in self._connect().execute(
+                    'SELECT assignment, student, value FROM posted_grades '
+                    'WHERE gradebook = ?', (gbuuid,)
+                )
+            }
+        reader = csv.DictReader(csv_file, dialect='excel')
+        fieldnames = reader.fieldnames or []
+        assignments = [
+            field for field in fieldnames
+            if field not in NON_ASSIGNMENT_FIELDS
+        ]
+        rows = []
+        changed_columns = set()
+        changed = 0
+        for row in reader:
+            student = (row.get(EMAIL_FIELD) or '').lower()
+            row_changes = [
+                assignment for assignment in assignments
+                if full or posted.get((assignment, student)) != row[assignment]
+            ]
+            if row_changes:
+                rows.append(row)
+                changed_columns.update(row_changes)
+                changed += len(row_changes)
+
+        columns = [
+            field for field in fieldnames
+            if field in NON_ASSIGNMENT_FIELDS or field in changed_columns
+        ]
+        delta_file = io.StringIO(newline='')
+        writer = csv.DictWriter(
+            delta_file, columns, dialect='excel', extrasaction='ignore'
+        )
+        writer.writeheader()
+        cells = []
+        for row in rows:
+            writer.writerow(row)
+            student = (row.get(EMAIL_FIELD) or '').lower()
+            cells.extend(
+                (assignment, student, row[assignment])
+                for assignment in columns
+                if assignment in changed_columns and
+                row[assignment] is not None
+            )
+        delta_file.seek(0)
+        log.info(
+            '%d changed grades in %d rows for %s', changed, len(rows), gbuuid
+        )
+        return GradeDelta(delta_file, cells, changed)
+
+    def record(self, gbuuid, cells):
+        """Remember grades that were posted successfully
+
+        Args:
+            gbuuid (str): UUID of the gradebook
+            cells (list): ``(assignment, student, value)`` tuples
+        """
+        connection = self._connect()
+        connection.execute('BEGIN')
+        try:
+            connection.executemany(
+                'INSERT OR REPLACE INTO posted_grades '
+                '(gradebook, assignment, student, value) '
+                'VALUES (?, ?, ?, ?)',
+                ((gbuuid,) + cell for cell in cells)
+            )
+            connection.execute('COMMIT')
+        except Exception:
+            connection.execute('ROLLBACK')
+            raise
+
+    def forget(self, gbuuid):
+        """Forget every grade posted to ``gbuuid``"""
+        self._connect().execute(
+            'DELETE FROM posted_grades WHERE gradebook = ?', (gbuuid,)
+        )
@@ -0,0 +1,70 @@
+# -*- coding: utf-8 -*-
+"""Running one read action against many gradebooks at once."""
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor, as_completed
+import logging
+
+log = logging.getLogger(__name__)
+
+#: Stands in for a form field holding ``data``
+Field = namedtuple('Field', ['data'])
+
+#: The fields of :py:class:`lmod_proxy.edx_grades.forms.EdXGradesForm`
+#: that read actions use, for a single gradebook
+GradebookForm = namedtuple('GradebookForm', ['gradebook', 'section', 'submit'])
+
+
+def gradebook_form(gbuuid, section, action):
+    """Return the form of a request for ``action`` on one gradebook
+
+    Args:
+        gbuuid (str): UUID of the gradebook
+        section (str): Section name, or ``None`` for all sections
+        action (str): Read action from
+            :py:data:`lmod_proxy.edx_grades.forms.READ_ACTIONS`
+    Returns:
+        GradebookForm: form for :py:func:`lmod_proxy.edx_grades.dispatch`
+    """
+    return GradebookForm(Field(gbuuid), Field(section), Field(action))
+
+
+def fan_out(app, run, gradebooks, max_workers):
+    """Call ``run`` for each gradebook in up to ``max_workers`` threads,
+    yielding the results as they complete.
+
+    Each call runs in its own application context.  Exceptions are
+    yielded in place of results so one gradebook failing does not stop
+    the others.  Calls not yet started are cancelled if the caller
+    stops iterating, i.e. because the client went away.
+
+    Args:
+        app (flask.Flask): Application to run the calls within
+        run (callable): Called with a gradebook UUID
+        gradebooks (list): Gradebook UUIDs
+        max_workers (int): Most calls running at once
+    Yields:
+        tuple: gradebook UUID, result or ``None``, exception or ``None``
+    """
+    def call(gbuuid):
+        """Run ``run`` for one gradebook within the application"""
+        with app.app_context():
+            return run(gbuuid)
+
+    executor = ThreadPoolExecutor(max_workers=max(1, max_workers))
+    futures = {
+        executor.submit(call, gbuuid): gbuuid for gbuuid in gradebooks
+    }
+    try:
+        for future in as_completed(futures):
+            gbuuid = futures[future]
+            try:
+                result = future.result()
+            except Exception as ex:  # pylint: disable=broad-except
+                log.exception('Fan out call failed for %s', gbuuid)
+                yield gbuuid, None, ex
+            else:
+                yield gbuuid, result, None
+    finally:
+        for future in futures:
+            future.cancel()
+        executor.shutdown(wait=False)
@@ -1,11 +1,20 @@
 # -*- coding: utf-8 -*-
 """Forms needed for the edx_grade blueprint."""
+import re
+
+from flask import current_app
 from flask_wtf import Form
 from flask_wtf.file import FileField
-from wtforms import SelectField, StringField, validators
+from wtforms import (
+    SelectField,
+    StringField,
+    ValidationError,
+    validators,
+)
 
 from lmod_proxy.edx_grades.actions import (
     post_grades,
+    get_all,
     get_membership,
     get_assignments,
     get_sections,
@@ -16,8 +25,14 @@ ACTIONS = {
     'get-membership': get_membership,
     'get-assignments': get_assignments,
     'get-sections': get_sections,
+    'get-all': get_all,
 }
 
+#: Actions that only read from LMod
+READ_ACTIONS = frozenset(
+    ('get-membership', 'get-assignments', 'get-sections', 'get-all')
+)
+
 
 class StrippedField(StringField):
     """Simple override of String field where values are stripped"""
@@ -29,6 +44,22 @@ class StrippedField(StringField):
             self.data = None
 
 
+class GradebookListField(StringField):
+    """Gradebook UUIDs separated by commas or whitespace, given in one
+    or more values.  Duplicates are dropped."""
+    def process_formdata(self, valuelist):
+        """Split the values into a list of unique UUIDs"""
+        self.data = []
+        for value in valuelist:
+            for gbuuid in re.split(r'[\s,]+', value):
+                if gbuuid and gbuuid not in self.data:
+                    self.data.append(gbuuid)
+
+    def _value(self):
+        """Render the UUIDs one per line"""
+        return '\n'.join(self.data or [])
+
+
 class EdXGradesForm(Form):
     """Form given to us by edx-platform."""
     gradebook = StrippedField(validators=[validators.required()])
@@ -41,3 +72,20 @@ class EdXGradesForm(Form):
     submit = SelectField(
         choices=[(x, x) for x in ACTIONS.keys()]
     )
+
+
+class FanOutForm(Form):
+    """Form for running one read action against many gradebooks."""
+    gradebooks = GradebookListField(validators=[validators.required()])
+    section = StrippedField(id=u'section', validators=[validators.Optional()])
+    submit = SelectField(
+        choices=[(x, x) for x in sorted(READ_ACTIONS)]
+    )
+
+    def validate_gradebooks(self, field):  # pylint: disable=no-self-use
+        """Limit the gradebooks read by one request"""
+        maximum = int(current_app.config['LMODP_FANOUT_MAX_GRADEBOOKS'])
+        if len(field.data) > maximum:
+            raise ValidationError(
+                'At most {0} gradebooks may be read at once'.format(maximum)
+            )
@@ -0,0 +1,70 @@
+# -*- coding: utf-8 -*-
+"""Invalidation of cached reads shared by every worker process."""
+import logging
+import sqlite3
+
+from lmod_proxy.store import connect
+
+log = logging.getLogger(__name__)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS read_generations (
+    gradebook TEXT PRIMARY KEY,
+    generation INTEGER NOT NULL
+) WITHOUT ROWID;
+"""
+
+
+class ReadGenerations(object):
+    """Counter per gradebook, kept in the local sqlite database, that is
+    incremented whenever the gradebook's cached reads become stale.
+
+    Workers store the generation with each read they cache and only
+    use the cached read while the generation is unchanged, so a grade
+    posting in one worker invalidates the reads cached by all of them.
+    Database errors are logged and ``None`` is returned as the
+    generation.
+
+    Args:
+        path (str): Path to the sqlite database
+    """
+
+    def __init__(self, path):
+        self.path = path
+
+    def _connect(self):
+        return connect(self.path, SCHEMA)
+
+    def get(self, gbuuid):
+        """Return the current generation of ``gbuuid``'s reads
+
+        Returns:
+            int: generation, 0 if never invalidated, or ``None`` if it
+            could not be read
+        """
+        try:
+            row = self._connect().execute(
+                'SELECT generation FROM read_generations WHERE gradebook = ?',
+                (gbuuid,)
+            ).fetchone()
+        except sqlite3.Error:
+            log.exception('Unable to read the read generation of %s', gbuuid)
+            return None
+        return row[0] if row else 0
+
+    def bump(self, gbuuid):
+        """Invalidate the reads of ``gbuuid`` cached by every worker"""
+        try:
+            connection = self._connect()
+            connection.execute(
+                'INSERT OR IGNORE INTO read_generations '
+                '(gradebook, generation) VALUES (?, 0)',
+                (gbuuid,)
+            )
+            connection.execute(
+                'UPDATE read_generations SET generation = generation + 1 '
+                'WHERE gradebook = ?',
+                (gbuuid,)
+            )
+        except sqlite3.Error:
+            log.exception('Unable to invalidate the reads of %s', gbuuid)
@@ -0,0 +1,95 @@
+# -*- coding: utf-8 -*-
+"""Persistent cache of gradebook UUID to LMod gradebook id lookups."""
+import logging
+import sqlite3
+import time
+
+from lmod_proxy.store import connect
+
+log = logging.getLogger(__name__)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS gradebook_ids (
+    gbuuid TEXT PRIMARY KEY,
+    gradebook_id TEXT NOT NULL,
+    resolved REAL NOT NULL
+);
+"""
+
+
+class GradebookIdCache(object):
+    """Cache of gradebook UUID to id mappings kept in a local sqlite
+    database, so every worker shares them and they survive restarts.
+
+    The mappings practically never change, so entries live for a long
+    ``ttl`` and can be dropped explicitly with :py:meth:`invalidate`.
+    Database errors are logged and treated as cache misses.
+
+    Args:
+        path (str): Path to the sqlite database
+        ttl (float): Seconds a resolved id is trusted for
+    """
+
+    def __init__(self, path, ttl):
+        self.path = path
+        self.ttl = ttl
+
+    def _connect(self):
+        return connect(self.path, SCHEMA)
+
+    def get(self, gbuuid):
+        """Return the cached gradebook id for ``gbuuid`` or ``None``"""
+        try:
+            row = self._connect().execute(
+                'SELECT gradebook_id FROM gradebook_ids '
+                'WHERE gbuuid = ? AND resolved > ?',
+                (gbuuid, time.time() - self.ttl)
+            ).fetchone()
+        except sqlite3.Error:
+            log.exception('Unable to read gradebook id cache')
+            return None
+        return row[0] if row else None
+
+    def set(self, gbuuid, gradebook_id):
+        """Remember that ``gbuuid`` resolves to ``gradebook_id``"""
+        try:
+            self._connect().execute(
+                'INSERT OR REPLACE INTO gradebook_ids '
+                '(gbuuid, gradebook_id, resolved) VALUES (?, ?, ?)',
+                (gbuuid, str(gradebook_id), time.time())
+            )
+        except sqlite3.Error:
+            log.exception('Unable to write gradebook id cache')
+
+    def invalidate(self, gbuuid=None):
+        """Forget the mapping for ``gbuuid``, or all of them if not given.
+
+        Returns:
+            int: number of mappings removed
+        """
+        connection = self._connect()
+        if gbuuid is None:
+            cursor = connection.execute('DELETE FROM gradebook_ids')
+        else:
+            cursor = connection.execute(
+                'DELETE FROM gradebook_ids WHERE gbuuid = ?', (gbuuid,)
+            )
+        return cursor.rowcount
+
+    def resolve(self, gbuuid, lookup):
+        """Return the gradebook id for ``gbuuid``, calling ``lookup`` on
+        a cache miss.
+
+        Args:
+            gbuuid (str): Gradebook UUID
+            lookup (callable): Takes the UUID and returns the id from
+                LMod, i.e. :py:meth:`pylmod.GradeBook.get_gradebook_id`
+        Returns:
+            str: gradebook id
+        """
+        gradebook_id = self.get(gbuuid)
+        if gradebook_id is None:
+            gradebook_id = str(lookup(gbuuid))
+            log.info('Resolved gradebook %s to id %s', gbuuid, gradebook_id)
+            self.set(gbuuid, gradebook_id)
+        return gradebook_id
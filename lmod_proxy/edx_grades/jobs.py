@@ -0,0 +1,291 @@
+# -*- coding: utf-8 -*-
+"""Background posting of grade spreadsheets."""
+from concurrent.futures import ThreadPoolExecutor
+import io
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+import uuid
+
+from lmod_proxy.edx_grades.actions import (
+    failed_grades,
+    grades_result,
+    send_grades,
+)
+from lmod_proxy.store import connect
+
+log = logging.getLogger(__name__)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS grade_jobs (
+    id TEXT PRIMARY KEY,
+    gradebook TEXT NOT NULL,
+    user TEXT NOT NULL,
+    status TEXT NOT NULL,
+    created REAL NOT NULL,
+    updated REAL NOT NULL,
+    batches_posted INTEGER NOT NULL DEFAULT 0,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    full INTEGER NOT NULL DEFAULT 0,
+    claimed_until REAL NOT NULL DEFAULT 0,
+    csv TEXT,
+    success INTEGER,
+    message TEXT,
+    failed_grades TEXT
+);
+"""
+
+#: Job states
+QUEUED = 'queued'
+RUNNING = 'running'
+FINISHED = 'finished'
+
+
+class GradeJobs(object):
+    """Grade postings run by background threads instead of the request.
+
+    Jobs and their spreadsheets are kept in the local sqlite database,
+    so any worker can report on a job no matter which worker runs it.
+    Each worker process runs its own jobs with up to ``max_workers``
+    threads.  A job is claimed with a lease before it runs, which a
+    heartbeat renews for as long as it runs.  Jobs whose lease ran out
+    because their worker went away are resumed by the next worker
+    submitting or checking on a job, and given up on after
+    ``MAX_ATTEMPTS`` claims.
+    Jobs are removed ``retention`` seconds after they last changed.
+
+    Args:
+        path (str): Path to the sqlite database
+        max_workers (int): Jobs run at once by each worker process
+        retention (float): Seconds finished jobs are kept
+    """
+
+    #: Seconds a claimed job is reserved for the worker running it
+    LEASE = 600
+
+    #: Seconds between renewals of a running job's lease
+    HEARTBEAT = 60
+
+    #: Claims of a job before it is failed as abandoned
+    MAX_ATTEMPTS = 3
+
+    def __init__(self, path, max_workers, retention):
+        self.path = path
+        self.max_workers = max_workers
+        self.retention = retention
+        self._executor = None
+        self._executor_pid = None
+        self._lock = threading.Lock()
+
+    def _connect(self):
+        return connect(self.path, SCHEMA)
+
+    def _get_executor(self):
+        """Return this process's thread pool, creating it after a fork"""
+        with self._lock:
+            if self._executor_pid != os.getpid():
+                self._executor = ThreadPoolExecutor(
+                    max_workers=self.max_workers
+                )
+                self._executor_pid = os.getpid()
+            return self._executor
+
+    def _update(self, job_id, **values):
+        """Set columns of a job and its updated time"""
+        values['updated'] = time.time()
+        columns = ', '.join('{0} = ?'.format(key) for key in values)
+        self._connect().execute(
+            'UPDATE grade_jobs SET {0} WHERE id = ?'.format(columns),
+            list(values.values()) + [job_id]
+        )
+
+    def prune(self):
+        """Remove jobs unchanged for the retention period, finished or
+        abandoned"""
+        now = time.time()
+        self._connect().execute(
+            'DELETE FROM grade_jobs WHERE updated < ? AND claimed_until < ?',
+            (now - self.retention, now)
+        )
+
+    def claim(self, job_id=None):
+        """Lease a job to run: ``job_id`` if it is still queued or its
+        lease ran out, otherwise the oldest unfinished job whose lease
+        ran out.
+
+        Returns:
+            tuple: id, gradebook, csv, attempts, full; or ``None``
+        """
+        connection = self._connect()
+        now = time.time()
+        connection.execute('BEGIN IMMEDIATE')
+        try:
+            if job_id is None:
+                row = connection.execute(
+                    'SELECT id, gradebook, csv, attempts, full '
+                    'FROM grade_jobs WHERE status != ? AND claimed_until <= ? '
+                    'ORDER BY created LIMIT 1',
+                    (FINISHED, now)
+                ).fetchone()
+            else:
+                row = connection.execute(
+                    'SELECT id, gradebook, csv, attempts, full '
+                    'FROM grade_jobs WHERE id = ? AND (status = ? OR '
+                    '(status = ? AND claimed_until <= ?))',
+                    (job_id, QUEUED, RUNNING, now)
+                ).fetchone()
+            if row is not None:
+                connection.execute(
+                    'UPDATE grade_jobs SET status = ?, attempts = ?, '
+                    'claimed_until = ?, updated = ? WHERE id = ?',
+                    (RUNNING, row[3] + 1, now + self.LEASE, now, row[0])
+                )
+                row = row[:3] + (row[3] + 1, bool(row[4]))
+            connection.execute('COMMIT')
+        except Exception:
+            connection.execute('ROLLBACK')
+            raise
+        return row
+
+    def resume(self, app):
+        """Start abandoned jobs again in this worker, up to
+        ``max_workers`` of them.
+
+        Args:
+            app (flask.Flask): Application the jobs run in
+        Returns:
+            int: number of jobs resumed
+        """
+        resumed = 0
+        while resumed < self.max_workers:
+            job = self.claim()
+            if job is None:
+                break
+            log.warning('Resuming abandoned grade job %s', job[0])
+            self._get_executor().submit(self._run, app, job)
+            resumed += 1
+        return resumed
+
+    def submit(self, app, gbuuid, user, csv_text, full=False):
+        """Store a grade spreadsheet and start posting it.
+
+        Args:
+            app (flask.Flask): Application the job runs in
+            gbuuid (str): UUID of the gradebook
+            user (str): Authenticated user submitting the job
+            csv_text (str): Grade spreadsheet
+            full (bool): Send every grade even if posting only changes
+        Returns:
+            str: job id
+        """
+        self.prune()
+        self.resume(app)
+        job_id = uuid.uuid4().hex
+        now = time.time()
+        # Reserved for this worker until it gets to run the job
+        self._connect().execute(
+            'INSERT INTO grade_jobs '
+            '(id, gradebook, user, status, created, updated, claimed_until, '
+            'full, csv) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)',
+            (job_id, gbuuid, user, QUEUED, now, now, now + self.LEASE,
+             int(bool(full)), csv_text)
+        )
+        log.info('Queued grade job %s for %s', job_id, gbuuid)
+        self._get_executor().submit(self.run, app, job_id)
+        return job_id
+
+    def run(self, app, job_id):
+        """Claim a queued job and post its grades inside ``app``'s
+        context"""
+        job = self.claim(job_id)
+        if job is not None:
+            self._run(app, job)
+
+    def _heartbeat(self, job_id, stop):
+        """Renew the lease of a running job until ``stop`` is set"""
+        while not stop.wait(self.HEARTBEAT):
+            try:
+                self._update(job_id, claimed_until=time.time() + self.LEASE)
+            except sqlite3.Error:
+                log.exception('Unable to renew the lease of job %s', job_id)
+
+    def _run(self, app, job):
+        """Post the grades of a claimed job inside ``app``'s context"""
+        job_id, gbuuid, csv_text, attempts, full = job
+        if attempts > self.MAX_ATTEMPTS:
+            log.error('Giving up on abandoned grade job %s', job_id)
+            self._update(
+                job_id,
+                status=FINISHED,
+                claimed_until=0,
+                csv=None,
+                success=0,
+                message='Grade posting was interrupted too many times',
+                failed_grades='[]'
+            )
+            return
+        stop = threading.Event()
+        heartbeat = threading.Thread(
+            target=self._heartbeat, args=(job_id, stop), daemon=True
+        )
+        heartbeat.start()
+        with app.app_context():
+            try:
+                gradebook = app.config['gradebook_pool'].get(gbuuid)
+                error_message, results = send_grades(
+                    gradebook,
+                    gbuuid,
+                    io.StringIO(csv_text, newline=''),
+                    full=full,
+                    progress=lambda posted: self._update(
+                        job_id, batches_posted=posted
+                    )
+                )
+                message, _, success = grades_result(error_message, results)
+                _, failed = failed_grades(results)
+            except Exception as ex:  # pylint: disable=broad-except
+                log.exception('Grade job %s failed', job_id)
+                message, success, failed = str(ex), False, []
+            finally:
+                stop.set()
+                heartbeat.join()
+        self._update(
+            job_id,
+            status=FINISHED,
+            claimed_until=0,
+            csv=None,
+            success=int(success),
+            message=message,
+            failed_grades=json.dumps(failed)
+        )
+        log.info('Finished grade job %s, success: %s', job_id, success)
+
+    def get(self, job_id):
+        """Return the state of a job
+
+        Args:
+            job_id (str): Job id
+        Returns:
+            dict: job state, or ``None`` if there is no such job
+        """
+        row = self._connect().execute(
+            'SELECT id, gradebook, user, status, created, updated, '
+            'batches_posted, success, message, failed_grades '
+            'FROM grade_jobs WHERE id = ?', (job_id,)
+        ).fetchone()
+        if row is None:
+            return None
+        job = dict(zip(
+            (
+                'job', 'gradebook', 'user', 'status', 'created', 'updated',
+                'batches_posted', 'success', 'msg', 'failed_grades'
+            ),
+            row
+        ))
+        if job['success'] is not None:
+            job['success'] = bool(job['success'])
+        job['failed_grades'] = json.loads(job['failed_grades'] or '[]')
+        return job
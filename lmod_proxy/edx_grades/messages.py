@@ -0,0 +1,86 @@
+# -*- coding: utf-8 -*-
+"""Rendering of the HTML messages returned in API responses.
+
+``api_message.html`` is rendered once per outcome around a placeholder
+when the application starts, so responses only escape their message
+into place, and the fixed success messages are kept fully rendered.
+Failed grade tables are built directly instead of through
+``grade_transfer_failed.html``, producing the same text.
+"""
+import uuid
+
+from flask import render_template
+from markupsafe import escape
+
+#: Messages of successful actions, rendered in full at startup
+FIXED_MESSAGES = (
+    'Successfully posted grades',
+    'Successfully retrieved students',
+    'Successfully retrieved assignments',
+    'Successfully retrieved sections',
+)
+
+
+class ApiMessages(object):
+    """Pre-rendered ``api_message.html``
+
+    Args:
+        app (flask.Flask): Application with the ``edx_grades``
+            blueprint registered
+    """
+    # pylint: disable=too-few-public-methods
+
+    def __init__(self, app):
+        placeholder = uuid.uuid4().hex
+        self._frames = {}
+        self._fixed = {}
+        with app.app_context():
+            for success in (True, False):
+                self._frames[success] = tuple(render_template(
+                    'api_message.html', message=placeholder, success=success
+                ).split(placeholder))
+        self._fixed = {
+            message: self.render(message, True) for message in FIXED_MESSAGES
+        }
+
+    def render(self, message, success):
+        """Return ``api_message.html`` rendered for ``message``
+
+        Args:
+            message (str): Message, escaped unless it is markup
+            success (bool): Whether the action succeeded
+        Returns:
+            str: rendered message
+        """
+        if success and message in self._fixed:
+            return self._fixed[message]
+        prefix, suffix = self._frames[bool(success)]
+        # Plain strings, as adding to markup would escape the frame
+        return ''.join((prefix, str(escape(message)), suffix))
+
+
+def render_failed_grades(number_failed, failed_grades):
+    """Return the text ``grade_transfer_failed.html`` renders for the
+    grades LMod failed to accept.
+
+    Args:
+        number_failed (int): Number of failed grades
+        failed_grades (list): Per grade results from LMod
+    Returns:
+        str: rendered failures
+    """
+    parts = []
+    for grade in failed_grades:
+        if isinstance(grade, dict) and grade.get('status') == -1:
+            parts.append('\n  \n    ')
+            parts.append(str(grade.get('message', '')))
+            parts.append('\n  \n')
+        else:
+            parts.append('\n  \n')
+    # Only the messages contain characters that need escaping, so the
+    # whole text is escaped at once rather than message by message.
+    return '{0} grade{1} failed to transfer\n{2}'.format(
+        number_failed,
+        's' if number_failed > 1 else '',
+        escape(''.join(parts))
+    )
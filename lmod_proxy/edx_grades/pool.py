@@ -0,0 +1,166 @@
+# -*- coding: utf-8 -*-
+"""Pool of ready to use :py:class:`pylmod.GradeBook` clients."""
+from collections import OrderedDict
+from functools import partial
+import logging
+import threading
+import time
+
+from pylmod import GradeBook
+
+from lmod_proxy.edx_grades.upstream import DIRECT
+
+log = logging.getLogger(__name__)
+
+
+class GradeBookPool(object):
+    """Per process pool of :py:class:`pylmod.GradeBook` clients keyed by
+    gradebook UUID.
+
+    Building a client opens a new HTTP session, handshakes with the
+    client certificate and resolves the gradebook UUID to an id, so
+    clients are kept around and reused by later requests for the same
+    gradebook.  Clients idle for longer than ``idle_timeout`` seconds are
+    dropped, as is the least recently used client once there are more
+    than ``max_size``.
+
+    When an ``id_cache`` is given, gradebook ids come from it instead of
+    a lookup per new client, and pooled clients pick up ids that were
+    invalidated or changed in the cache.
+
+    Args:
+        cert (str): Path to the LMod client certificate
+        urlbase (str): Base URL of the LMod API
+        max_size (int): Maximum number of pooled clients
+        idle_timeout (float): Seconds an unused client is kept
+        id_cache (lmod_proxy.edx_grades.gradebook_ids.GradebookIdCache):
+            Optional shared cache of gradebook ids
+        upstream (lmod_proxy.edx_grades.upstream.Upstream): Makes the
+            LMod calls
+    """
+
+    def __init__(
+            self,
+            cert,
+            urlbase,
+            max_size,
+            idle_timeout,
+            id_cache=None,
+            upstream=DIRECT,
+    ):
+        # pylint: disable=too-many-arguments
+        self.upstream = upstream
+        self.cert = cert
+        self.urlbase = urlbase
+        self.max_size = max_size
+        self.idle_timeout = idle_timeout
+        self.id_cache = id_cache
+        self._clients = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._clients)
+
+    def _prune(self, now):
+        """Drop idle and excess clients.  Caller must hold the lock."""
+        while self._clients:
+            gbuuid, (_, last_used) = next(iter(self._clients.items()))
+            if (
+                    len(self._clients) <= self.max_size and
+                    now - last_used < self.idle_timeout
+            ):
+                break
+            log.debug('Dropping pooled gradebook client for %s', gbuuid)
+            del self._clients[gbuuid]
+
+    def _lookup(self, gradebook):
+        """Return a gradebook id lookup through :py:attr:`upstream`"""
+        return partial(
+            self.upstream.call, 'get_gradebook_id', gradebook.get_gradebook_id
+        )
+
+    def create(self, gbuuid):
+        """Build a new client for ``gbuuid``
+
+        Args:
+            gbuuid (str): Gradebook UUID
+        Returns:
+            pylmod.GradeBook: client bound to the gradebook
+        """
+        if self.id_cache is None:
+            # Looks up the gradebook id
+            return self.upstream.call(
+                'get_gradebook_id',
+                GradeBook,
+                self.cert,
+                self.urlbase,
+                gbuuid=gbuuid
+            )
+        gradebook = GradeBook(self.cert, self.urlbase)
+        gradebook.gradebook_id = self.id_cache.resolve(
+            gbuuid, self._lookup(gradebook)
+        )
+        return gradebook
+
+    def get(self, gbuuid):
+        """Return a pooled client for ``gbuuid``, creating one if needed.
+
+        Args:
+            gbuuid (str): Gradebook UUID
+        Raises:
+            pylmod.exceptions.PyLmodException: gradebook lookup failed
+            requests.RequestException: Exception connection error
+        Returns:
+            pylmod.GradeBook: client bound to the gradebook
+        """
+        now = time.monotonic()
+        gradebook = None
+        with self._lock:
+            self._prune(now)
+            entry = self._clients.get(gbuuid)
+            if entry is not None:
+                gradebook = entry[0]
+                self._clients[gbuuid] = (gradebook, now)
+                self._clients.move_to_end(gbuuid)
+        if gradebook is not None:
+            if self.id_cache is not None:
+                gradebook.gradebook_id = self.id_cache.resolve(
+                    gbuuid, self._lookup(gradebook)
+                )
+            return gradebook
+
+        # Build outside the lock, it makes upstream calls
+        gradebook = self.create(gbuuid)
+        if self.max_size > 0 and self.idle_timeout > 0:
+            with self._lock:
+                self._clients[gbuuid] = (gradebook, time.monotonic())
+                self._clients.move_to_end(gbuuid)
+                self._prune(time.monotonic())
+        return gradebook
+
+    def check(self):
+        """Verify LMod answers by fetching the options of the most
+        recently used pooled gradebook.
+
+        Raises:
+            pylmod.exceptions.PyLmodException: LMod call failed
+            requests.RequestException: Exception connection error
+        Returns:
+            bool: True if LMod answered, ``None`` if no client is pooled
+        """
+        with self._lock:
+            if not self._clients:
+                return None
+            gradebook = next(reversed(self._clients.values()))[0]
+        self.upstream.call(
+            'get_options', gradebook.get_options, gradebook.gradebook_id
+        )
+        return True
+
+    def evict(self, gbuuid=None):
+        """Drop the client for ``gbuuid`` or every client if not given"""
+        with self._lock:
+            if gbuuid is None:
+                self._clients.clear()
+            else:
+                self._clients.pop(gbuuid, None)
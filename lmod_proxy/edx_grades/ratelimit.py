@@ -0,0 +1,112 @@
+# -*- coding: utf-8 -*-
+"""Per user rate limits shared by every worker process."""
+import logging
+import sqlite3
+import time
+
+from lmod_proxy.store import connect
+
+log = logging.getLogger(__name__)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS rate_buckets (
+    user TEXT NOT NULL,
+    bucket TEXT NOT NULL,
+    tokens REAL NOT NULL,
+    updated REAL NOT NULL,
+    PRIMARY KEY (user, bucket)
+);
+"""
+
+
+class RateLimiter(object):
+    """Token buckets per user kept in the local sqlite database, so a
+    limit holds however many workers a user's requests are spread over.
+
+    Each bucket holds up to ``burst`` tokens and is refilled at ``rate``
+    tokens per second.  A request takes one token per LMod read it makes,
+    or is refused if there are not enough.  A request costing more than
+    ``burst`` is allowed once the bucket is full, leaving it in debt
+    until refills pay for the rest.  Buckets are read and updated in one write
+    transaction, so concurrent requests never take the same token.
+    Database errors are logged and the request is allowed, the limit
+    protects LMod and must not make the proxy unavailable.
+
+    Args:
+        path (str): Path to the sqlite database
+    """
+
+    def __init__(self, path):
+        self.path = path
+
+    def _connect(self):
+        return connect(self.path, SCHEMA)
+
+    def take(self, user, bucket, rate, burst, cost=1):
+        """Take ``cost`` tokens from ``user``'s ``bucket`` if there are
+        enough.
+
+        Args:
+            user (str): Authenticated user
+            bucket (str): Name of the limit, i.e. ``read``
+            rate (float): Tokens added per second, zero or less disables
+                the limit.
+            burst (float): Most tokens the bucket holds, and so requests
+                allowed at once after a quiet period
+            cost (int): Tokens the request takes
+        Returns:
+            float: seconds until enough tokens are available, zero if
+            they were taken
+        """
+        if rate <= 0:
+            return 0.0
+        burst = max(1.0, burst)
+        try:
+            connection = self._connect()
+            now = time.time()
+            connection.execute('BEGIN IMMEDIATE')
+            try:
+                row = connection.execute(
+                    'SELECT tokens, updated FROM rate_buckets '
+                    'WHERE user = ? AND bucket = ?',
+                    (user, bucket)
+                ).fetchone()
+                tokens = burst
+                if row is not None:
+                    tokens = min(
+                        burst, row[0] + max(0.0, now - row[1]) * rate
+                    )
+                wait = 0.0
+                needed = min(cost, burst)
+                if tokens >= needed:
+                    tokens -= cost
+                else:
+                    wait = (needed - tokens) / rate
+                connection.execute(
+                    'INSERT OR REPLACE INTO rate_buckets '
+                    '(user, bucket, tokens, updated) VALUES (?, ?, ?, ?)',
+                    (user, bucket, tokens, now)
+                )
+                connection.execute('COMMIT')
+            except Exception:
+                connection.execute('ROLLBACK')
+                raise
+        except sqlite3.Error:
+            log.exception('Unable to check the rate limit of %s', user)
+            return 0.0
+        return wait
+
+    def reset(self, user=None):
+        """Refill the buckets of ``user``, or of every user if not given.
+
+        Returns:
+            int: number of buckets refilled
+        """
+        connection = self._connect()
+        if user is None:
+            cursor = connection.execute('DELETE FROM rate_buckets')
+        else:
+            cursor = connection.execute(
+                'DELETE FROM rate_buckets WHERE user = ?', (user,)
+            )
+        return cursor.rowcount
@@ -0,0 +1,266 @@
+# -*- coding: utf-8 -*-
+"""Durable queue of grade postings to retry after LMod errors."""
+import logging
+import os
+import random
+import threading
+import time
+
+from lmod_proxy.store import connect
+
+log = logging.getLogger(__name__)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS grade_retries (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    gradebook TEXT NOT NULL,
+    csv TEXT NOT NULL,
+    created REAL NOT NULL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    next_attempt REAL NOT NULL,
+    claimed_until REAL NOT NULL DEFAULT 0,
+    last_error TEXT,
+    exhausted INTEGER NOT NULL DEFAULT 0
+);
+CREATE INDEX IF NOT EXISTS grade_retries_due
+    ON grade_retries (exhausted, next_attempt);
+"""
+
+
+class RetryQueue(object):
+    """Grade spreadsheets that failed to post, kept in the local sqlite
+    database until they are posted successfully.
+
+    Every worker process runs a daemon thread that polls for due
+    postings.  A posting is claimed with a lease before it is sent, and
+    no more than ``max_drains`` postings are leased at once across all
+    processes.  Failed attempts are retried with exponential backoff and
+    jitter until ``max_attempts`` is reached, after which the posting is
+    kept as exhausted for an operator to look at.  Since edX always sends
+    a whole course, a successful posting supersedes every older pending
+    posting for the same gradebook.
+
+    Args:
+        path (str): Path to the sqlite database
+        max_attempts (int): Attempts before giving up on a posting, a
+            value of zero disables the queue.
+        base_delay (float): Seconds before the first retry
+        max_delay (float): Maximum seconds between retries
+        max_drains (int): Postings retried at once across all workers
+        poll_interval (float): Seconds between checks for due postings
+    """
+
+    #: Seconds a claimed posting is reserved for the worker sending it
+    LEASE = 600
+
+    def __init__(
+            self, path, max_attempts, base_delay, max_delay, max_drains,
+            poll_interval
+    ):
+        # pylint: disable=too-many-arguments
+        self.path = path
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.max_drains = max_drains
+        self.poll_interval = poll_interval
+        self._thread = None
+        self._thread_pid = None
+        self._lock = threading.Lock()
+
+    @property
+    def enabled(self):
+        """True if failed postings are queued"""
+        return self.max_attempts > 0
+
+    def _connect(self):
+        return connect(self.path, SCHEMA)
+
+    def backoff(self, attempts):
+        """Seconds to wait before the next attempt, half fixed and half
+        random so workers retrying together spread out."""
+        delay = min(self.max_delay, self.base_delay * 2 ** attempts)
+        return delay / 2 + random.uniform(0, delay / 2)
+
+    def enqueue(self, gbuuid, csv_text, error):
+        """Store a posting that failed with ``error`` for retrying
+
+        Returns:
+            int: id of the queued posting
+        """
+        now = time.time()
+        cursor = self._connect().execute(
+            'INSERT INTO grade_retries '
+            '(gradebook, csv, created, next_attempt, last_error) '
+            'VALUES (?, ?, ?, ?, ?)',
+            (gbuuid, csv_text, now, now + self.backoff(0), error)
+        )
+        log.warning(
+            'Queued grades for %s for retry as %s after error: %s',
+            gbuuid, cursor.lastrowid, error
+        )
+        return cursor.lastrowid
+
+    def supersede(self, gbuuid, before):
+        """Drop pending postings for ``gbuuid`` created before ``before``
+
+        Returns:
+            int: number of postings dropped
+        """
+        cursor = self._connect().execute(
+            'DELETE FROM grade_retries WHERE gradebook = ? AND created < ? '
+            'AND exhausted = 0 AND claimed_until < ?',
+            (gbuuid, before, time.time())
+        )
+        if cursor.rowcount:
+            log.info(
+                'Dropped %d superseded grade retries for %s',
+                cursor.rowcount, gbuuid
+            )
+        return cursor.rowcount
+
+    def claim(self):
+        """Lease the next due posting, unless ``max_drains`` postings
+        are already leased.
+
+        Returns:
+            tuple: id, gradebook, csv, created; or ``None``
+        """
+        connection = self._connect()
+        now = time.time()
+        connection.execute('BEGIN IMMEDIATE')
+        try:
+            leased = connection.execute(
+                'SELECT COUNT(*) FROM grade_retries WHERE claimed_until > ?',
+                (now,)
+            ).fetchone()[0]
+            row = None
+            if leased < self.max_drains:
+                row = connection.execute(
+                    'SELECT id, gradebook, csv, created FROM grade_retries '
+                    'WHERE exhausted = 0 AND next_attempt <= ? '
+                    'AND claimed_until <= ? ORDER BY next_attempt LIMIT 1',
+                    (now, now)
+                ).fetchone()
+            if row is not None:
+                connection.execute(
+                    'UPDATE grade_retries SET claimed_until = ? WHERE id = ?',
+                    (now + self.LEASE, row[0])
+                )
+            connection.execute('COMMIT')
+        except Exception:
+            connection.execute('ROLLBACK')
+            raise
+        return row
+
+    def complete(self, retry_id):
+        """Remove a posting that was sent"""
+        self._connect().execute(
+            'DELETE FROM grade_retries WHERE id = ?', (retry_id,)
+        )
+
+    def fail(self, retry_id, error):
+        """Record a failed attempt and schedule the next one"""
+        connection = self._connect()
+        attempts = connection.execute(
+            'SELECT attempts FROM grade_retries WHERE id = ?', (retry_id,)
+        ).fetchone()[0] + 1
+        exhausted = attempts >= self.max_attempts
+        connection.execute(
+            'UPDATE grade_retries SET attempts = ?, next_attempt = ?, '
+            'claimed_until = 0, last_error = ?, exhausted = ? WHERE id = ?',
+            (
+                attempts, time.time() + self.backoff(attempts), error,
+                int(exhausted), retry_id
+            )
+        )
+        if exhausted:
+            log.error(
+                'Giving up on grade retry %s after %d attempts: %s',
+                retry_id, attempts, error
+            )
+
+    def stats(self):
+        """Summarize the queue for administrators
+
+        Returns:
+            dict: ``depth`` of pending postings, ``oldest_pending`` time
+            and ``oldest_age`` in seconds, ``in_flight`` and
+            ``exhausted`` counts.
+        """
+        connection = self._connect()
+        now = time.time()
+        depth, oldest = connection.execute(
+            'SELECT COUNT(*), MIN(created) FROM grade_retries '
+            'WHERE exhausted = 0'
+        ).fetchone()
+        in_flight = connection.execute(
+            'SELECT COUNT(*) FROM grade_retries WHERE claimed_until > ?',
+            (now,)
+        ).fetchone()[0]
+        exhausted = connection.execute(
+            'SELECT COUNT(*) FROM grade_retries WHERE exhausted = 1'
+        ).fetchone()[0]
+        return dict(
+            depth=depth,
+            oldest_pending=oldest,
+            oldest_age=now - oldest if oldest else None,
+            in_flight=in_flight,
+            exhausted=exhausted,
+        )
+
+    def drain(self, post):
+        """Retry due postings until none are left or the drain limit is
+        reached.
+
+        Args:
+            post (callable): Takes gradebook UUID and CSV text, returns
+                an error message, empty if the grades were posted.
+        Returns:
+            int: number of postings attempted
+        """
+        attempted = 0
+        while True:
+            row = self.claim()
+            if row is None:
+                return attempted
+            retry_id, gbuuid, csv_text, created = row
+            attempted += 1
+            try:
+                error_message = post(gbuuid, csv_text)
+            except Exception as ex:  # pylint: disable=broad-except
+                log.exception('Grade retry %s raised', retry_id)
+                error_message = str(ex)
+            if error_message:
+                self.fail(retry_id, error_message)
+            else:
+                log.info('Posted queued grades %s for %s', retry_id, gbuuid)
+                self.complete(retry_id)
+                self.supersede(gbuuid, created)
+
+    def start(self, post):
+        """Start this process's drain thread if it is not running
+
+        Args:
+            post (callable): See :py:meth:`drain`
+        """
+        if not self.enabled:
+            return
+        with self._lock:
+            if self._thread_pid == os.getpid() and self._thread.is_alive():
+                return
+            self._thread = threading.Thread(
+                target=self._run, args=(post,), name='grade-retries'
+            )
+            self._thread.daemon = True
+            self._thread_pid = os.getpid()
+            self._thread.start()
+
+    def _run(self, post):
+        """Drain the queue every ``poll_interval`` seconds"""
+        while True:
+            time.sleep(self.poll_interval)
+            try:
+                self.drain(post)
+            except Exception:  # pylint: disable=broad-except
+                log.exception('Unable to drain grade retry queue')
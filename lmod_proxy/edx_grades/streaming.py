@@ -0,0 +1,117 @@
+# -*- coding: utf-8 -*-
+"""Streaming of large JSON API responses.
+
+Responses with a long ``data`` list are written in chunks instead of
+being built in memory by :py:func:`flask.jsonify`, producing exactly the
+same bytes.  ``orjson`` is used to serialize items when it is installed
+and its output is identical, which is the case for flat objects of
+strings, integers, booleans and nulls that serialize to ASCII.
+"""
+import logging
+import uuid
+
+from flask import current_app, jsonify, request
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover
+    orjson = None
+
+log = logging.getLogger(__name__)
+
+#: Items serialized per chunk written to the response
+CHUNK_ITEMS = 100
+
+#: Types ``orjson`` serializes exactly like :py:mod:`json`
+_SIMPLE_TYPES = (str, int, bool, type(None))
+
+
+def _encoder():
+    """Return the JSON encoder :py:func:`flask.jsonify` would use for
+    compact output in the current request."""
+    blueprint = current_app.blueprints.get(request.blueprint)
+    encoder_class = current_app.json_encoder
+    if blueprint is not None and blueprint.json_encoder:
+        encoder_class = blueprint.json_encoder
+    return encoder_class(
+        separators=(',', ':'),
+        sort_keys=current_app.config['JSON_SORT_KEYS'],
+        ensure_ascii=bool(current_app.config['JSON_AS_ASCII']),
+    )
+
+
+def _fast_encode(items, sort_keys):
+    """Return ``items`` serialized by ``orjson``, or ``None`` if that
+    might differ from :py:mod:`json`."""
+    for item in items:
+        if not isinstance(item, dict):
+            return None
+        for key, value in item.items():
+            # Exact types, subclasses like enums may serialize differently
+            if not isinstance(key, str) or type(value) not in _SIMPLE_TYPES:
+                return None
+    try:
+        encoded = orjson.dumps(
+            items, option=orjson.OPT_SORT_KEYS if sort_keys else 0
+        )
+    except TypeError:
+        # Integers beyond 64 bits
+        return None
+    if not encoded.isascii():
+        return None
+    return encoded.decode('ascii')
+
+
+def _items(data, encoder):
+    """Yield ``data`` serialized in chunks of :py:data:`CHUNK_ITEMS`
+    separated by commas."""
+    for start in range(0, len(data), CHUNK_ITEMS):
+        chunk = data[start:start + CHUNK_ITEMS]
+        encoded = None
+        if orjson is not None:
+            encoded = _fast_encode(chunk, encoder.sort_keys)
+        if encoded is None:
+            encoded = encoder.encode(chunk)
+        # Drop the brackets of the chunk's own list
+        yield (',' if start else '') + encoded[1:-1]
+
+
+def json_response(envelope, min_items):
+    """Return ``envelope`` as JSON, streaming its ``data`` list when it
+    has at least ``min_items`` entries.
+
+    Args:
+        envelope (dict): Response object with a ``data`` key
+        min_items (int): Shortest list streamed, zero disables streaming
+    Returns:
+        flask.Response: response with the bytes :py:func:`flask.jsonify`
+            would produce
+    """
+    data = envelope.get('data')
+    if (
+            min_items <= 0 or
+            not isinstance(data, list) or
+            len(data) < min_items or
+            # Pretty printed output is not worth streaming
+            current_app.config['JSONIFY_PRETTYPRINT_REGULAR'] or
+            current_app.debug
+    ):
+        return jsonify(envelope)
+    encoder = _encoder()
+    # Serialize everything but the data with a placeholder standing in
+    placeholder = uuid.uuid4().hex
+    head, tail = encoder.encode(dict(envelope, data=placeholder)).split(
+        '"{0}"'.format(placeholder), 1
+    )
+
+    def generate():
+        """Write the response as the data is serialized"""
+        yield head + '['
+        for chunk in _items(data, encoder):
+            yield chunk
+        yield ']' + tail + '\n'
+
+    log.debug('Streaming %s JSON items', len(data))
+    return current_app.response_class(
+        generate(), mimetype=current_app.config['JSONIFY_MIMETYPE']
+    )
@@ -0,0 +1,297 @@
+# -*- coding: utf-8 -*-
+"""Protection of LMod from overload while it is degraded.
+
+Every LMod API call goes through an :py:class:`Upstream`, which times
+the call, rejects it straight away while the :py:class:`CircuitBreaker`
+is open and waits for a slot of the :py:class:`ConcurrencyLimiter`.
+Both are kept per worker process.
+"""
+from collections import deque
+import logging
+import threading
+import time
+
+from pylmod.exceptions import PyLmodException
+from requests.exceptions import RequestException
+
+from lmod_proxy.metrics import LMOD_SECONDS
+
+log = logging.getLogger(__name__)
+
+#: Errors that show LMod itself is failing rather than the request
+UPSTREAM_ERRORS = (RequestException, ValueError)
+
+#: Calls whose duration grows with the grades posted, so only their
+#: errors count against LMod, never their slowness
+UNTIMED_CALLS = frozenset(('spreadsheet2gradebook', 'multi_grade'))
+
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half-open'
+
+
+class CircuitOpenError(PyLmodException):
+    """LMod calls are being rejected because it is failing"""
+
+
+class UpstreamBusyError(PyLmodException):
+    """No slot for an LMod call became free in time"""
+
+
+class CircuitBreaker(object):
+    """Stop calling LMod while too many recent calls failed or were slow.
+
+    The outcomes of the last ``window`` calls are kept.  Once at least
+    ``min_calls`` are known and the fraction that failed, or took longer
+    than ``slow_call_seconds``, reaches ``failure_rate`` the circuit
+    opens and calls are rejected for ``open_seconds``.  It then lets
+    ``half_open_calls`` probe calls through: if they all succeed the
+    circuit closes, if any fails it opens again.
+
+    Args:
+        window (int): Recent calls considered, zero disables the breaker
+        min_calls (int): Calls needed before the circuit can open
+        failure_rate (float): Fraction of failed or slow calls that
+            opens the circuit
+        slow_call_seconds (float): Calls slower than this count as
+            failed, zero disables
+        open_seconds (float): Seconds calls are rejected for
+        half_open_calls (int): Probe calls made before closing
+    """
+    # pylint: disable=too-many-instance-attributes
+
+    def __init__(
+            self,
+            window,
+            min_calls,
+            failure_rate,
+            slow_call_seconds,
+            open_seconds,
+            half_open_calls,
+    ):
+        # pylint: disable=too-many-arguments
+        self.window = window
+        self.min_calls = min_calls
+        self.failure_rate = failure_rate
+        self.slow_call_seconds = slow_call_seconds
+        self.open_seconds = open_seconds
+        self.half_open_calls = max(half_open_calls, 1)
+        self.state = CLOSED
+        self._outcomes = deque(maxlen=max(window, 1))
+        self._opened = 0
+        self._probes = 0
+        self._probe_successes = 0
+        self._lock = threading.Lock()
+
+    @property
+    def enabled(self):
+        """True if the breaker can open"""
+        return self.window > 0
+
+    def _open(self, now):
+        """Open the circuit.  Caller must hold the lock."""
+        log.warning(
+            'Opening LMod circuit breaker for %s seconds', self.open_seconds
+        )
+        self.state = OPEN
+        self._opened = now
+        self._outcomes.clear()
+
+    def allow(self):
+        """Check whether a call may be made now
+
+        Raises:
+            CircuitOpenError: the circuit is open, or half-open with
+                every probe already in flight.
+        Returns:
+            bool: True if the call is a half-open probe
+        """
+        if not self.enabled:
+            return False
+        with self._lock:
+            if self.state == OPEN:
+                if time.monotonic() - self._opened < self.open_seconds:
+                    raise CircuitOpenError(
+                        'LMod is failing, not calling it for now'
+                    )
+                log.info('Probing LMod with half-open circuit breaker')
+                self.state = HALF_OPEN
+                self._probes = 0
+                self._probe_successes = 0
+            if self.state == HALF_OPEN:
+                if self._probes >= self.half_open_calls:
+                    raise CircuitOpenError(
+                        'LMod is recovering, not calling it for now'
+                    )
+                self._probes += 1
+                return True
+        return False
+
+    def cancel_probe(self):
+        """Give back a probe allowed by :py:meth:`allow` that was not
+        made"""
+        with self._lock:
+            if self.state == HALF_OPEN and self._probes > 0:
+                self._probes -= 1
+
+    def record(self, success, seconds, probe=False):
+        """Record the outcome of an allowed call
+
+        Args:
+            success (bool): False if the call raised an upstream error
+            seconds (float): How long the call took
+            probe (bool): Value returned by :py:meth:`allow` for the call
+        """
+        if not self.enabled:
+            return
+        failed = not success or (
+            self.slow_call_seconds > 0 and seconds > self.slow_call_seconds
+        )
+        now = time.monotonic()
+        with self._lock:
+            if self.state == HALF_OPEN and probe:
+                if failed:
+                    self._open(now)
+                    return
+                self._probe_successes += 1
+                if self._probe_successes >= self.half_open_calls:
+                    log.info('Closing LMod circuit breaker')
+                    self.state = CLOSED
+                    self._outcomes.clear()
+                return
+            if self.state != CLOSED:
+                return
+            self._outcomes.append(failed)
+            if (
+                    len(self._outcomes) >= self.min_calls and
+                    sum(self._outcomes) >=
+                    self.failure_rate * len(self._outcomes)
+            ):
+                self._open(now)
+
+
+class ConcurrencyLimiter(object):
+    """Adaptive limit on LMod calls in flight using additive increase,
+    multiplicative decrease.
+
+    Each call finishing successfully within ``target_seconds`` raises
+    the limit by one over the current limit, so it grows by about one
+    for every limit's worth of calls.  A failed or slower call
+    multiplies it by ``backoff``.  The limit stays between ``minimum``
+    and ``maximum``.
+
+    Args:
+        minimum (int): Lowest limit
+        maximum (int): Highest limit, zero disables limiting
+        target_seconds (float): Calls slower than this shrink the limit
+        backoff (float): Factor the limit is multiplied by on shrinking
+        queue_seconds (float): Longest wait for a free slot
+    """
+
+    def __init__(
+            self, minimum, maximum, target_seconds, backoff, queue_seconds
+    ):
+        # pylint: disable=too-many-arguments
+        self.minimum = max(minimum, 1)
+        self.maximum = maximum
+        self.target_seconds = target_seconds
+        self.backoff = backoff
+        self.queue_seconds = queue_seconds
+        self.limit = float(max(self.minimum, maximum))
+        self.in_flight = 0
+        self._condition = threading.Condition()
+
+    @property
+    def enabled(self):
+        """True if calls are limited"""
+        return self.maximum > 0
+
+    def acquire(self):
+        """Wait for a free slot
+
+        Raises:
+            UpstreamBusyError: no slot freed within ``queue_seconds``
+        """
+        if not self.enabled:
+            return
+        deadline = time.monotonic() + self.queue_seconds
+        with self._condition:
+            while self.in_flight >= int(self.limit):
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    raise UpstreamBusyError(
+                        'Too many LMod calls in flight, try again later'
+                    )
+                self._condition.wait(remaining)
+            self.in_flight += 1
+
+    def release(self, success, seconds):
+        """Free a slot and adapt the limit to how the call went
+
+        Args:
+            success (bool): False if the call raised an upstream error
+            seconds (float): How long the call took
+        """
+        if not self.enabled:
+            return
+        with self._condition:
+            self.in_flight -= 1
+            if success and seconds <= self.target_seconds:
+                self.limit = min(self.limit + 1.0 / self.limit, self.maximum)
+            else:
+                self.limit = max(self.limit * self.backoff, self.minimum)
+            self._condition.notify()
+
+
+class Upstream(object):
+    """Make LMod calls through an optional circuit breaker and
+    concurrency limiter, timing each in the LMod call histogram.
+
+    Args:
+        breaker (CircuitBreaker): Optional circuit breaker
+        limiter (ConcurrencyLimiter): Optional concurrency limiter
+    """
+
+    def __init__(self, breaker=None, limiter=None):
+        self.breaker = breaker
+        self.limiter = limiter
+
+    def call(self, name, func, *args, **kwargs):
+        """Call ``func`` with the given arguments as the LMod call
+        ``name``.  Calls in :py:data:`UNTIMED_CALLS` are never slow to
+        the breaker and limiter.
+
+        Raises:
+            CircuitOpenError: the circuit breaker rejected the call
+            UpstreamBusyError: no concurrency slot became free
+        Returns:
+            object: return value of ``func``
+        """
+        probe = self.breaker.allow() if self.breaker else False
+        if self.limiter:
+            try:
+                self.limiter.acquire()
+            except UpstreamBusyError:
+                if probe:
+                    self.breaker.cancel_probe()
+                raise
+        success = True
+        started = time.monotonic()
+        try:
+            with LMOD_SECONDS.time(call=name):
+                return func(*args, **kwargs)
+        except UPSTREAM_ERRORS:
+            success = False
+            raise
+        finally:
+            seconds = time.monotonic() - started
+            if name in UNTIMED_CALLS:
+                seconds = 0
+            if self.limiter:
+                self.limiter.release(success, seconds)
+            if self.breaker:
+                self.breaker.record(success, seconds, probe=probe)
+
+
+#: Calls LMod without protection, timing each call
+DIRECT = Upstream()
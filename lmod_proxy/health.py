@@ -0,0 +1,53 @@
+# -*- coding: utf-8 -*-
+"""Cheap health information for the status endpoints"""
+from datetime import datetime
+import os
+import threading
+
+
+class CertificateError(ValueError):
+    """The certificate cannot be parsed"""
+
+
+class CertificateExpiration(object):
+    """Expiration date of the LMod client certificate, parsed once and
+    parsed again only when the certificate file changes.
+
+    Args:
+        path (str): Path to the PEM certificate
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._signature = None
+        self._expiration = None
+        self._lock = threading.Lock()
+
+    def get(self):
+        """Return the certificate's expiration date
+
+        Raises:
+            OSError: Certificate file cannot be read
+            CertificateError: Certificate cannot be parsed
+        Returns:
+            datetime.datetime: expiration date
+        """
+        # pyOpenSSL is slow to import and only needed here
+        from OpenSSL import crypto
+
+        stat = os.stat(self.path)
+        signature = (stat.st_mtime_ns, stat.st_size, stat.st_ino)
+        with self._lock:
+            if signature != self._signature:
+                with open(self.path, 'rt') as cert_file:
+                    try:
+                        app_cert = crypto.load_certificate(
+                            crypto.FILETYPE_PEM, cert_file.read()
+                        )
+                    except crypto.Error as ex:
+                        raise CertificateError(str(ex)) from ex
+                self._expiration = datetime.strptime(
+                    app_cert.get_notAfter().decode('utf8'), '%Y%m%d%H%M%SZ'
+                )
+                self._signature = signature
+            return self._expiration
@@ -0,0 +1,336 @@
+# -*- coding: utf-8 -*-
+"""Prometheus style metrics aggregated across worker processes.
+
+Each process keeps its histograms in memory and writes them to its own
+file in the metrics directory at most once every flush interval.  The
+``/metrics`` endpoint sums the files of every process, so whichever
+worker answers the scrape reports totals for the whole server.  Files of
+processes that exited are merged into one file of retired values, so
+the totals never go down as workers are replaced.
+"""
+import atexit
+from bisect import bisect_left
+import fcntl
+import glob
+import json
+import logging
+import os
+import threading
+import time
+
+log = logging.getLogger(__name__)
+
+#: Default latency buckets in seconds
+LATENCY_BUCKETS = (
+    0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120,
+)
+
+#: Buckets for upload sizes in bytes
+SIZE_BUCKETS = tuple(1024 * 4 ** power for power in range(10))
+
+#: Buckets for counts of failed grades
+COUNT_BUCKETS = (0, 1, 5, 10, 50, 100, 500, 1000, 5000, 10000)
+
+#: File holding the summed values of processes that exited
+RETIRED_FILE = 'metrics-retired.json'
+
+
+def _merge(totals, values):
+    """Add the series of ``values`` into ``totals``"""
+    for name, series_by_key in values.items():
+        metric_totals = totals.setdefault(name, {})
+        for key, series in series_by_key.items():
+            total = metric_totals.get(key)
+            if total is None or len(total) != len(series):
+                metric_totals[key] = list(series)
+            else:
+                metric_totals[key] = [
+                    left + right for left, right in zip(total, series)
+                ]
+
+
+def _read(path):
+    """Return the values in a metrics file, empty if it is unreadable"""
+    try:
+        with open(path) as metrics_file:
+            return json.load(metrics_file)
+    except (OSError, ValueError):
+        return {}
+
+
+def _write(path, values):
+    """Replace the metrics file at ``path`` with ``values``"""
+    temp_path = path + '.tmp'
+    with open(temp_path, 'w') as metrics_file:
+        metrics_file.write(json.dumps(values))
+    os.replace(temp_path, path)
+
+
+def _alive(pid):
+    """Return True if a process with ``pid`` exists"""
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+class Histogram(object):
+    """Histogram of observations with optional labels
+
+    Args:
+        registry (Registry): Registry owning the histogram
+        name (str): Metric name
+        documentation (str): Help text
+        labelnames (tuple): Names of the labels
+        buckets (tuple): Upper bounds of the buckets, ascending
+    """
+
+    def __init__(self, registry, name, documentation, labelnames, buckets):
+        # pylint: disable=too-many-arguments
+        self.registry = registry
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, **labels):
+        """Record ``value`` for the given label values"""
+        key = json.dumps(
+            [str(labels.get(name, '')) for name in self.labelnames]
+        )
+        self.registry.observe(self, key, value)
+
+    def time(self, **labels):
+        """Context manager observing the seconds its block takes"""
+        return _Timer(self, labels)
+
+
+class _Timer(object):
+    """Observe elapsed time of a ``with`` block"""
+    # pylint: disable=too-few-public-methods
+
+    def __init__(self, histogram, labels):
+        self.histogram = histogram
+        self.labels = labels
+        self.start = None
+
+    def __enter__(self):
+        self.start = time.monotonic()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.histogram.observe(time.monotonic() - self.start, **self.labels)
+
+
+class Registry(object):
+    """Process local metric values shared through files"""
+
+    def __init__(self):
+        self.histograms = {}
+        self.directory = ''
+        self.flush_interval = 10
+        self._values = {}
+        self._pid = os.getpid()
+        self._written_pid = None
+        self._dirty = False
+        self._next_flush = 0
+        self._lock = threading.Lock()
+
+    def histogram(self, name, documentation, labelnames=(), buckets=None):
+        """Create and register a :py:class:`Histogram`"""
+        histogram = Histogram(
+            self, name, documentation, labelnames, buckets or LATENCY_BUCKETS
+        )
+        self.histograms[name] = histogram
+        return histogram
+
+    def configure(self, directory, flush_interval):
+        """Set where and how often this process shares its values
+
+        Args:
+            directory (str): Directory holding one file per process, an
+                empty value keeps metrics in the process only.
+            flush_interval (float): Maximum seconds between writes
+        """
+        self.directory = directory
+        self.flush_interval = flush_interval
+
+    def _check_fork(self):
+        """Start from empty values in a forked child.  Caller must hold
+        the lock."""
+        if self._pid != os.getpid():
+            self._pid = os.getpid()
+            self._values = {}
+            self._dirty = False
+            self._next_flush = 0
+
+    def observe(self, histogram, key, value):
+        """Add an observation to a histogram's labelled series"""
+        with self._lock:
+            self._check_fork()
+            series = self._values.setdefault(histogram.name, {}).get(key)
+            if series is None:
+                series = [0] * (len(histogram.buckets) + 3)
+                self._values[histogram.name][key] = series
+            series[bisect_left(histogram.buckets, value)] += 1
+            series[-2] += value
+            series[-1] += 1
+            self._dirty = True
+            flush = self.directory and time.monotonic() >= self._next_flush
+        if flush:
+            self.flush()
+
+    def _path(self, pid):
+        return os.path.join(self.directory, 'metrics-{0}.json'.format(pid))
+
+    def _retire(self, path):
+        """Merge the file of an exited process into the retired values
+        and remove it.  Merging is serialized across processes with a
+        lock file so no values are counted twice or lost."""
+        with open(os.path.join(self.directory, 'metrics.lock'), 'w') as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            if not os.path.exists(path):
+                return
+            retired_path = os.path.join(self.directory, RETIRED_FILE)
+            retired = _read(retired_path)
+            _merge(retired, _read(path))
+            _write(retired_path, retired)
+            os.remove(path)
+
+    def _retire_dead(self):
+        """Retire the files of processes that no longer exist"""
+        for path in glob.glob(os.path.join(self.directory, 'metrics-*.json')):
+            try:
+                pid = int(os.path.basename(path)[len('metrics-'):-5])
+            except ValueError:
+                continue
+            if pid != self._pid and not _alive(pid):
+                log.info('Retiring metrics of exited process %s', pid)
+                self._retire(path)
+
+    def flush(self, create=True):
+        """Write this process's values to its file, if it observed
+        anything since the last write.
+
+        Args:
+            create (bool): Create the directory if it does not exist
+        """
+        if not self.directory:
+            return
+        path = None
+        try:
+            with self._lock:
+                self._check_fork()
+                if not self._dirty:
+                    return
+                if not create and not os.path.isdir(self.directory):
+                    return
+                self._next_flush = time.monotonic() + self.flush_interval
+                values = json.loads(json.dumps(self._values))
+                self._dirty = False
+                path = self._path(self._pid)
+                os.makedirs(self.directory, exist_ok=True)
+                if self._written_pid != self._pid:
+                    # Left by an exited process that had the same pid
+                    self._retire(path)
+                    self._written_pid = self._pid
+            _write(path, values)
+        except OSError:
+            log.exception('Unable to write metrics to %s', path)
+
+    def collect(self):
+        """Sum the values of every process
+
+        Returns:
+            dict: histogram name to label key to series
+        """
+        self.flush()
+        if not self.directory:
+            with self._lock:
+                return json.loads(json.dumps(self._values))
+        try:
+            self._retire_dead()
+        except OSError:
+            log.exception('Unable to retire metrics in %s', self.directory)
+        totals = {}
+        for path in glob.glob(os.path.join(self.directory, 'metrics-*.json')):
+            _merge(totals, _read(path))
+        return totals
+
+    def render(self):
+        """Return every histogram in the Prometheus text format"""
+        totals = self.collect()
+        lines = []
+        for name, histogram in sorted(self.histograms.items()):
+            lines.append(
+                '# HELP {0} {1}'.format(name, histogram.documentation)
+            )
+            lines.append('# TYPE {0} histogram'.format(name))
+            for key, series in sorted(totals.get(name, {}).items()):
+                labels = [
+                    '{0}="{1}"'.format(label, _escape(value))
+                    for label, value
+                    in zip(histogram.labelnames, json.loads(key))
+                ]
+                cumulative = 0
+                bounds = [_format(bound) for bound in histogram.buckets]
+                for bound, count in zip(bounds + ['+Inf'], series[:-2]):
+                    cumulative += count
+                    lines.append('{0}_bucket{{{1}}} {2}'.format(
+                        name,
+                        ','.join(labels + ['le="{0}"'.format(bound)]),
+                        cumulative
+                    ))
+                label_text = ''
+                if labels:
+                    label_text = '{{{0}}}'.format(','.join(labels))
+                lines.append('{0}_sum{1} {2}'.format(
+                    name, label_text, _format(series[-2])
+                ))
+                lines.append('{0}_count{1} {2}'.format(
+                    name, label_text, series[-1]
+                ))
+        return '\n'.join(lines) + '\n'
+
+
+def _escape(value):
+    """Escape a label value"""
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format(number):
+    """Format a number the way Prometheus clients do"""
+    return repr(float(number))
+
+
+REGISTRY = Registry()
+atexit.register(REGISTRY.flush, create=False)
+
+REQUEST_SECONDS = REGISTRY.histogram(
+    'lmodp_request_seconds',
+    'Time to handle edx_grades requests by submit action.',
+    ('action',)
+)
+LMOD_SECONDS = REGISTRY.histogram(
+    'lmodp_lmod_call_seconds',
+    'Time taken by calls to the LMod API by pylmod method.',
+    ('call',)
+)
+AUTH_SECONDS = REGISTRY.histogram(
+    'lmodp_auth_check_seconds',
+    'Time to verify basic auth credentials by outcome.',
+    ('outcome',)
+)
+CSV_BYTES = REGISTRY.histogram(
+    'lmodp_grade_csv_bytes',
+    'Size of uploaded grade spreadsheets.',
+    buckets=SIZE_BUCKETS
+)
+FAILED_GRADES = REGISTRY.histogram(
+    'lmodp_failed_grades',
+    'Number of grades LMod failed to save per grade posting.',
+    buckets=COUNT_BUCKETS
+)
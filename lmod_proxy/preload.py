@@ -0,0 +1,86 @@
+# -*- coding: utf-8 -*-
+"""Preparation of the application in a uwsgi master before it forks.
+
+uwsgi imports the application once in its master process and forks the
+workers from it, unless ``lazy-apps`` is set.  Building everything that
+is read only there, and then freezing the garbage collector, lets all
+workers share those memory pages copy-on-write instead of each building
+and dirtying its own copy.  State bound to a process, like the pooled
+LMod clients and their connections, is dropped in each new worker.
+"""
+import gc
+import logging
+import os
+
+from lmod_proxy.health import CertificateError
+
+try:
+    import uwsgi
+except ImportError:
+    uwsgi = None
+
+log = logging.getLogger(__name__)
+
+#: Templates compiled before forking
+TEMPLATES = ('index.html',)
+
+
+def _uwsgi_option(name):
+    """Return True if the boolean uwsgi option ``name`` is enabled"""
+    value = uwsgi.opt.get(name)
+    if isinstance(value, bytes):
+        value = value.decode('utf8')
+    return str(value).lower() in ('1', 'true', 'yes', 'on')
+
+
+def warm(app):
+    """Build read only state workers would otherwise build on first use
+
+    Args:
+        app (flask.Flask): Application built by
+            :py:func:`lmod_proxy.web.app_factory`
+    """
+    try:
+        app.config['cert_expiration'].get()
+    except (OSError, CertificateError):
+        log.warning('Unable to read the LMod client certificate')
+    with app.app_context():
+        for template in TEMPLATES:
+            app.jinja_env.get_template(template)
+
+
+def after_fork(app):
+    """Drop state that must not be shared with the parent process
+
+    Args:
+        app (flask.Flask): Application built before forking
+    """
+    app.config['gradebook_pool'].evict()
+
+
+def preload(app):
+    """Prepare ``app`` to be shared by forked uwsgi workers
+
+    Does nothing unless ``LMODP_PRELOAD`` is set and the application is
+    being loaded by a uwsgi master that forks its workers.
+
+    Args:
+        app (flask.Flask): Application built by
+            :py:func:`lmod_proxy.web.app_factory`
+    Returns:
+        bool: True if the application was preloaded
+    """
+    if not app.config['LMODP_PRELOAD'] or uwsgi is None:
+        return False
+    if _uwsgi_option('lazy-apps') or _uwsgi_option('lazy'):
+        log.info('Not preloading, uwsgi loads the application per worker')
+        return False
+    warm(app)
+    os.register_at_fork(after_in_child=lambda: after_fork(app))
+    # Keep the collector from touching, and so copying, every page
+    # holding objects made so far in each worker
+    gc.freeze()
+    log.info(
+        'Preloaded application, %s objects frozen', gc.get_freeze_count()
+    )
+    return True
@@ -0,0 +1,119 @@
+# -*- coding: utf-8 -*-
+"""Per request phase timings and on demand profiling"""
+from contextlib import contextmanager
+import cProfile
+from functools import wraps
+import json
+import logging
+import os
+import random
+import time
+
+from flask import current_app, g, has_request_context, request
+
+log = logging.getLogger(__name__)
+
+
+@contextmanager
+def phase(name):
+    """Time the ``with`` block as the phase ``name`` of the current
+    request.  Does nothing outside of a request.
+
+    Args:
+        name (str): Phase name, i.e. ``auth``
+    """
+    if not has_request_context():
+        yield
+        return
+    started = time.monotonic()
+    try:
+        yield
+    finally:
+        if 'phase_timings' not in g:
+            g.phase_timings = []
+        g.phase_timings.append((name, time.monotonic() - started))
+
+
+def phase_timings():
+    """Return the ``(name, seconds)`` phases recorded for the current
+    request in the order they finished."""
+    return list(g.get('phase_timings', []))
+
+
+def server_timing(timings):
+    """Format phase timings as a ``Server-Timing`` header value
+
+    Args:
+        timings (list): ``(name, seconds)`` tuples
+    Returns:
+        str: header value with durations in milliseconds
+    """
+    return ', '.join(
+        '{0};dur={1:.1f}'.format(name, seconds * 1000)
+        for name, seconds in timings
+    )
+
+
+def log_timings(action, status, timings):
+    """Log the phase timings of a request as a single JSON object
+
+    Args:
+        action (str): Action or view of the request
+        status (int): Response status code
+        timings (list): ``(name, seconds)`` tuples
+    """
+    record = {
+        '{0}_ms'.format(name): round(seconds * 1000, 1)
+        for name, seconds in timings
+    }
+    record.update(action=action, status=status)
+    log.info('Request timing %s', json.dumps(record, sort_keys=True))
+
+
+def _should_profile(user):
+    """Return True if this request asked for, and was sampled for,
+    profiling by an administrator."""
+    # Imported here as lmod_proxy.auth uses this module
+    from lmod_proxy.auth import is_admin
+    if not current_app.config['LMODP_PROFILE_DIR']:
+        return False
+    if request.values.get('profile', '').lower() not in (
+            '1', 'true', 'yes', 'on'
+    ):
+        return False
+    if not is_admin(user):
+        return False
+    return random.random() < float(
+        current_app.config['LMODP_PROFILE_SAMPLE_RATE']
+    )
+
+
+def profiled(func):
+    """Decorator for views below :py:func:`lmod_proxy.auth.requires_auth`
+    that runs a sampled fraction of requests made with ``profile=1`` by
+    administrators under cProfile and saves the profile to
+    ``LMODP_PROFILE_DIR``.
+    """
+    @wraps(func)
+    def decorated(*args, **kwargs):
+        """Profile the view if requested and sampled"""
+        if not _should_profile(kwargs.get('user')):
+            return func(*args, **kwargs)
+        profile = cProfile.Profile()
+        try:
+            return profile.runcall(func, *args, **kwargs)
+        finally:
+            directory = current_app.config['LMODP_PROFILE_DIR']
+            path = os.path.join(directory, '{0}-{1}-{2}-{3}.prof'.format(
+                time.strftime('%Y%m%dT%H%M%S'),
+                os.getpid(),
+                request.endpoint,
+                request.values.get('submit', request.method.lower())
+            ))
+            try:
+                os.makedirs(directory, exist_ok=True)
+                profile.dump_stats(path)
+                log.info('Saved request profile to %s', path)
+            except OSError:
+                log.exception('Unable to save request profile to %s', path)
+    return decorated
@@ -0,0 +1,56 @@
+# -*- coding: utf-8 -*-
+"""Local sqlite storage shared by all worker processes on a host."""
+import os
+import sqlite3
+import threading
+
+try:
+    from gevent.monkey import get_original
+except ImportError:
+    get_original = None
+
+#: Seconds to wait on a database locked by another process
+BUSY_TIMEOUT = 30
+
+# Under gevent's monkey patching ``threading.local`` is per greenlet,
+# which would open a connection for every request.  sqlite calls never
+# yield to other greenlets, so they can share their OS thread's.
+if get_original is not None:
+    _local = get_original('threading', 'local')()
+else:
+    _local = threading.local()
+
+
+def connect(path, schema=None):
+    """Return this OS thread's connection to the sqlite database at
+    ``path``.
+
+    Connections are opened in autocommit mode with write ahead logging
+    so readers in other workers are not blocked by writers.  They are
+    cached per OS thread, shared by the greenlets of a gevent worker,
+    and reopened after a fork, since a sqlite connection must never be
+    shared across processes.
+
+    Args:
+        path (str): Path to the sqlite database file
+        schema (str): SQL script run once per connection, typically
+            ``CREATE TABLE IF NOT EXISTS`` statements.
+    Returns:
+        sqlite3.Connection: open connection
+    """
+    pid = os.getpid()
+    if getattr(_local, 'pid', None) != pid:
+        _local.pid = pid
+        _local.connections = {}
+    if path not in _local.connections:
+        connection = sqlite3.connect(
+            path, timeout=BUSY_TIMEOUT, isolation_level=None
+        )
+        connection.execute('PRAGMA journal_mode=WAL')
+        connection.execute('PRAGMA synchronous=NORMAL')
+        _local.connections[path] = (connection, set())
+    connection, schemas = _local.connections[path]
+    if schema is not None and schema not in schemas:
+        connection.executescript(schema)
+        schemas.add(schema)
+    return connection
@@ -5,6 +5,8 @@ problems like basic authentication.
 import base64
 import importlib
 import os
+import shutil
+import tempfile
 import unittest
 import unittest.mock as mock
 
@@ -25,20 +27,30 @@ class CommonTest(unittest.TestCase):
     TEST_PASS = 'bar'
     NOT_USER = 'notuser'
 
-    @mock.patch.dict(
-        'os.environ',
-        {'LMODP_HTPASSWD_PATH': get_htpasswd_path()},
-        clear=True
-    )
     def setUp(self):
         """
         Create the ElasticData Object and make it available to tests.
         """
         import lmod_proxy.config
+        from lmod_proxy.metrics import REGISTRY
         from lmod_proxy.web import app_factory
 
-        importlib.reload(lmod_proxy.config)
-        self.app = app_factory()
+        temp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, temp_dir)
+        self.state_db = os.path.join(temp_dir, 'state.sqlite')
+        with mock.patch.dict(
+                'os.environ',
+                {
+                    'LMODP_HTPASSWD_PATH': get_htpasswd_path(),
+                    'LMODP_STATE_DB': self.state_db,
+                    'LMODP_METRICS_DIR': os.path.join(temp_dir, 'metrics'),
+                },
+                clear=True
+        ):
+            importlib.reload(lmod_proxy.config)
+            self.app = app_factory()
+        # Stop writing metrics into the removed temporary directory
+        self.addCleanup(REGISTRY.configure, '', 10)
 
     def get_basic_auth_headers(self, invalid=False):
         """Return a header dictionary with the appropriate basic
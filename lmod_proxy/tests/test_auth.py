@@ -2,10 +2,21 @@
 """
 Test out the basic authentication module.
 """
+import os
+import shutil
+import tempfile
+import time
 import unittest.mock as mock
 
-from lmod_proxy.auth import check_basic_auth, requires_auth
-from lmod_proxy.tests.common import CommonTest
+from passlib.apache import HtpasswdFile
+
+from lmod_proxy.auth import (
+    CredentialCache,
+    HtpasswdReloader,
+    check_basic_auth,
+    requires_auth,
+)
+from lmod_proxy.tests.common import CommonTest, get_htpasswd_path
 
 
 class TestAuth(CommonTest):
@@ -68,3 +79,96 @@ class TestAuth(CommonTest):
             wrapped, decorated = TestAuth._get_requires_auth_decorator()
             response = decorated()
             self.assertEqual(401, response.status_code)
+
+    def test_credential_cache(self):
+        """Verify successful checks are cached and failures are not"""
+        cache = CredentialCache(max_size=10, ttl=60)
+        users = self.app.config['users']
+        with mock.patch.object(
+                users, 'check_password', wraps=users.check_password
+        ) as check_password:
+            self.assertTrue(
+                cache.check_password(users, self.TEST_USER, self.TEST_PASS)
+            )
+            self.assertTrue(
+                cache.check_password(users, self.TEST_USER, self.TEST_PASS)
+            )
+            self.assertEqual(1, check_password.call_count)
+            self.assertEqual((1, 1), (cache.hits, cache.misses))
+
+            # Bad passwords always hit the user database
+            for _ in range(2):
+                self.assertFalse(
+                    cache.check_password(users, self.TEST_USER, 'blah')
+                )
+            self.assertEqual(3, check_password.call_count)
+
+        # Plaintext credentials are never used as keys
+        for key in cache._cache._entries:
+            self.assertNotIn(self.TEST_PASS.encode('utf8'), key)
+
+    def test_credential_cache_flush(self):
+        """Verify the cache is flushed when the user database changes"""
+        cache = CredentialCache(max_size=10, ttl=60)
+        users = self.app.config['users']
+        cache.check_password(users, self.TEST_USER, self.TEST_PASS)
+        self.assertEqual(1, len(cache._cache))
+
+        # Reloaded file
+        with mock.patch.object(users, '_mtime', users.mtime + 1):
+            cache.check_password(users, self.TEST_USER, 'blah')
+        self.assertEqual(0, len(cache._cache))
+
+        # Replaced database
+        cache.check_password(users, self.TEST_USER, self.TEST_PASS)
+        self.assertFalse(cache.check_password(
+            HtpasswdFile(), self.TEST_USER, self.TEST_PASS
+        ))
+        self.assertEqual(0, len(cache._cache))
+
+    def test_htpasswd_reload(self):
+        """Verify a changed htpasswd file is swapped in, rate limited"""
+        temp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, temp_dir)
+        path = os.path.join(temp_dir, 'htpasswd')
+        shutil.copy(get_htpasswd_path(), path)
+
+        config = {}
+        reloader = HtpasswdReloader(path, 10)
+        config['users'] = reloader.load()
+        self.assertIn(self.TEST_USER, config['users'].users())
+        original_users = config['users']
+
+        with open(path, 'w') as htpasswd_file:
+            htpasswd_file.write('')
+        # Not checked again until the interval passes
+        self.assertFalse(reloader.maybe_reload(config))
+        self.assertIs(original_users, config['users'])
+
+        with mock.patch(
+                'lmod_proxy.auth.time.monotonic',
+                return_value=time.monotonic() + 11
+        ):
+            self.assertTrue(reloader.maybe_reload(config))
+        self.assertNotIn(self.TEST_USER, config['users'].users())
+
+        # A missing file keeps the current users
+        os.remove(path)
+        current_users = config['users']
+        with mock.patch(
+                'lmod_proxy.auth.time.monotonic',
+                return_value=time.monotonic() + 22
+        ):
+            self.assertFalse(reloader.maybe_reload(config))
+        self.assertIs(current_users, config['users'])
+
+    def test_htpasswd_reload_on_request(self):
+        """Verify requests go through the reloader"""
+        with self.app.test_request_context(
+                headers=self.get_basic_auth_headers()
+        ):
+            with mock.patch.object(
+                    self.app.config['users_reloader'], 'maybe_reload'
+            ) as maybe_reload:
+                check_basic_auth(self.TEST_USER, self.TEST_PASS)
+            maybe_reload.assert_called_with(self.app.config)
@@ -0,0 +1,221 @@
+# -*- coding: utf-8 -*-
+"""Verify batched posting of grade spreadsheets"""
+import csv
+import io
+import threading
+import unittest
+
+import unittest.mock as mock
+from pylmod.exceptions import (
+    PyLmodException,
+    PyLmodFailedAssignmentCreation,
+)
+
+from lmod_proxy.edx_grades.batches import (
+    GradeArrays,
+    iter_grade_batches,
+    merge_results,
+    post_batches,
+    roster,
+)
+
+CSV_TEXT = (
+    'External email,Homework 1,Homework 2,max_pts,normalize\r\n'
+    'x@example.com,0.5,0.5,5,0\r\n'
+    'A@example.com,0.1,,5,0\r\n'
+    'b@example.com,0.2,0.4,5,0\r\n'
+    'c@example.com,0.3,0.6,5,0\r\n'
+)
+
+STUDENTS = [
+    {'accountEmail': 'a@example.com', 'studentId': 1},
+    {'accountEmail': 'B@example.com', 'studentId': 2},
+    {'accountEmail': 'c@example.com', 'studentId': 3},
+    {'accountEmail': 'c@example.com', 'studentId': 4},
+]
+
+POST_OPTIONS = dict(
+    approve_grades=True,
+    use_max_points_column=True,
+    max_points_column='max_pts',
+    normalize_column='normalize'
+)
+
+
+def mock_gradebook():
+    """Return a gradebook with students, one assignment and assignment
+    creation mocked
+    """
+    gradebook = mock.MagicMock()
+    gradebook.get_students.return_value = STUDENTS
+    gradebook.get_assignments.return_value = [
+        {'name': 'Homework 1', 'assignmentId': 11},
+    ]
+    gradebook.create_assignment.return_value = {
+        'data': {'assignmentId': 12}
+    }
+    return gradebook
+
+
+def grade(student_id, assignment_id, value):
+    """Return a grade as posted to ``multiGrades``"""
+    return {
+        'studentId': student_id,
+        'assignmentId': assignment_id,
+        'numericGradeValue': value,
+        'mode': 2,
+        'isGradeApproved': True,
+    }
+
+
+class TestBatches(unittest.TestCase):
+    """Exercise converting, posting and merging of grade batches"""
+
+    def test_roster(self):
+        """Verify emails are matched case insensitively, first one wins"""
+        self.assertEqual(
+            {'a@example.com': 1, 'b@example.com': 2, 'c@example.com': 3},
+            roster(STUDENTS)
+        )
+
+    def test_grade_arrays(self):
+        """Verify rows are converted as pylmod converts them"""
+        gradebook = mock_gradebook()
+        reader = csv.DictReader(io.StringIO(CSV_TEXT))
+        arrays = GradeArrays(
+            gradebook,
+            reader.fieldnames,
+            roster(STUDENTS),
+            gradebook.get_assignments(),
+            **POST_OPTIONS
+        )
+        rows = list(reader)
+        self.assertEqual(['Homework 1', 'Homework 2'], arrays.columns)
+        # Unknown students give no grades and create no assignments
+        self.assertEqual([], arrays.grades(rows[0]))
+        self.assertFalse(gradebook.create_assignment.called)
+        # Grades that are not numbers are skipped
+        self.assertEqual([grade(1, 11, 0.1)], arrays.grades(rows[1]))
+        gradebook.create_assignment.assert_called_once_with(
+            'Homework 2', 'Hom 2', 1.0, 5.0, '12-15-2013'
+        )
+        self.assertEqual(
+            [grade(2, 11, 0.2), grade(2, 12, 0.4)], arrays.grades(rows[2])
+        )
+        self.assertEqual(1, gradebook.create_assignment.call_count)
+
+    def test_normalized_max_points(self):
+        """Verify normalized grades create assignments out of one point"""
+        gradebook = mock_gradebook()
+        for normalize in ('1', 'yes', None):
+            row = {'External email': 'a@example.com', 'Homework 2': '1',
+                   'max_pts': '5', 'normalize': normalize}
+            arrays = GradeArrays(
+                gradebook, list(row), {'a@example.com': 1}, [],
+                **POST_OPTIONS
+            )
+            arrays.grades(row)
+            self.assertEqual(1.0, gradebook.create_assignment.call_args[0][3])
+
+    def test_failed_assignment_creation(self):
+        """Verify a failed assignment creation is raised"""
+        gradebook = mock_gradebook()
+        gradebook.create_assignment.return_value = {'data': {}}
+        arrays = GradeArrays(
+            gradebook, ['External email', 'Homework 2'],
+            {'a@example.com': 1}, []
+        )
+        with self.assertRaises(PyLmodFailedAssignmentCreation):
+            arrays.grades(
+                {'External email': 'a@example.com', 'Homework 2': '1'}
+            )
+
+    def test_iter_grade_batches(self):
+        """Verify batches hold the grades of ``batch_size`` rows and empty
+        batches are dropped
+        """
+        arrays = mock.Mock()
+        arrays.grades.side_effect = lambda row: row
+        self.assertEqual(
+            [[1, 2, 3], [4]],
+            list(iter_grade_batches([[], [], [1], [2, 3], [4]], arrays, 2))
+        )
+        self.assertEqual([], list(iter_grade_batches([], arrays, 2)))
+
+    def test_merge_results(self):
+        """Verify failures and result rows are combined"""
+        self.assertEqual(
+            {'data': {'numFailures': 3, 'results': [1, 2, 3]}},
+            merge_results([
+                {'data': {'numFailures': 1, 'results': [1]}},
+                {'data': {'numFailures': '2', 'results': [2, 3]}},
+                {'data': {}},
+                None,
+            ])
+        )
+
+    def test_post_batches(self):
+        """Verify the roster and assignments are read once and every
+        grade is posted once
+        """
+        posted = []
+        lock = threading.Lock()
+
+        def multi_grade(grade_array):
+            """Record the grades and fail student 2's"""
+            with lock:
+                posted.extend(grade_array)
+            failures = [
+                {'status': -1, 'message': str(grade['studentId'])}
+                for grade in grade_array if grade['studentId'] == 2
+            ]
+            return {
+                'data': {'numFailures': len(failures), 'results': failures}
+            }
+
+        gradebook = mock_gradebook()
+        gradebook.multi_grade.side_effect = multi_grade
+        progress = mock.Mock()
+        results, _ = post_batches(
+            gradebook, io.StringIO(CSV_TEXT), 1, 2, progress=progress,
+            **POST_OPTIONS
+        )
+        gradebook.get_students.assert_called_once_with()
+        gradebook.get_assignments.assert_called_once_with()
+        self.assertEqual(1, gradebook.create_assignment.call_count)
+        # The unknown student's batch is not posted
+        self.assertEqual(3, gradebook.multi_grade.call_count)
+        self.assertEqual(3, progress.call_count)
+        self.assertEqual(
+            [
+                grade(1, 11, 0.1),
+                grade(2, 11, 0.2), grade(2, 12, 0.4),
+                grade(3, 11, 0.3), grade(3, 12, 0.6),
+            ],
+            sorted(
+                posted,
+                key=lambda grade: (grade['studentId'], grade['assignmentId'])
+            )
+        )
+        self.assertEqual(2, results['data']['numFailures'])
+
+        # A roster already read is used
+        gradebook = mock_gradebook()
+        post_batches(
+            gradebook, io.StringIO(CSV_TEXT), 10, 2,
+            students={'c@example.com': 3}, **POST_OPTIONS
+        )
+        self.assertFalse(gradebook.get_students.called)
+        gradebook.multi_grade.assert_called_once_with(
+            [grade(3, 11, 0.3), grade(3, 12, 0.6)]
+        )
+
+    def test_post_batches_error(self):
+        """Verify every batch is attempted and the error raised"""
+        gradebook = mock_gradebook()
+        gradebook.multi_grade.side_effect = [
+            {'data': {}}, PyLmodException('test'), {'data': {}}
+        ]
+        with self.assertRaises(PyLmodException):
+            post_batches(gradebook, io.StringIO(CSV_TEXT), 1, 1)
+        self.assertEqual(3, gradebook.multi_grade.call_count)
@@ -0,0 +1,50 @@
+# -*- coding: utf-8 -*-
+"""Verify the in-process caches"""
+import unittest
+
+import unittest.mock as mock
+
+from lmod_proxy.cache import TTLCache
+
+
+class TestTTLCache(unittest.TestCase):
+    """Exercise expiry, eviction and counters of the TTL cache"""
+
+    def test_get_set(self):
+        """Verify basic storage and hit/miss counting"""
+        cache = TTLCache(max_size=2, ttl=10)
+        self.assertIsNone(cache.get('a'))
+        cache.set('a', 1)
+        self.assertEqual(1, cache.get('a'))
+        self.assertIn('a', cache)
+        self.assertEqual((1, 1), (cache.hits, cache.misses))
+        self.assertEqual(1, cache.pop('a'))
+        self.assertNotIn('a', cache)
+
+    def test_lru_eviction(self):
+        """Verify the least recently used entry is evicted"""
+        cache = TTLCache(max_size=2, ttl=10)
+        cache.set('a', 1)
+        cache.set('b', 2)
+        cache.get('a')
+        cache.set('c', 3)
+        self.assertIn('a', cache)
+        self.assertNotIn('b', cache)
+        self.assertIn('c', cache)
+
+    def test_expiry(self):
+        """Verify entries expire after the TTL"""
+        cache = TTLCache(max_size=2, ttl=10)
+        with mock.patch('lmod_proxy.cache.time.monotonic', return_value=100):
+            cache.set('a', 1)
+        with mock.patch('lmod_proxy.cache.time.monotonic', return_value=109):
+            self.assertEqual(1, cache.get('a'))
+        with mock.patch('lmod_proxy.cache.time.monotonic', return_value=110):
+            self.assertIsNone(cache.get('a'))
+        self.assertEqual(0, len(cache))
+
+    def test_disabled(self):
+        """Verify a zero size or TTL disables caching"""
+        for cache in (TTLCache(0, 10), TTLCache(10, 0)):
+            cache.set('a', 1)
+            self.assertNotIn('a', cache)
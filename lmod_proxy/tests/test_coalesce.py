@@ -0,0 +1,76 @@
+# -*- coding: utf-8 -*-
+"""Verify coalescing of concurrent identical reads"""
+import threading
+import time
+import unittest
+
+from lmod_proxy.edx_grades.coalesce import SingleFlight
+
+
+class TestSingleFlight(unittest.TestCase):
+    """Exercise sharing of in-flight calls"""
+
+    def _run_concurrently(self, single_flight, func, count=5):
+        """Call ``func`` through ``single_flight`` from ``count`` threads
+        that all start while the first call is still running.
+
+        Returns:
+            list: results or exceptions from each thread
+        """
+        outcomes = []
+        started = threading.Event()
+        release = threading.Event()
+
+        def blocking():
+            started.set()
+            release.wait(5)
+            return func()
+
+        def worker():
+            try:
+                outcomes.append(single_flight.do('key', blocking))
+            except Exception as ex:  # pylint: disable=broad-except
+                outcomes.append(ex)
+
+        threads = [threading.Thread(target=worker) for _ in range(count)]
+        threads[0].start()
+        started.wait(5)
+        for thread in threads[1:]:
+            thread.start()
+        # Wait for the followers to join the in-flight call
+        while single_flight._calls['key'].waiters < count - 1:
+            time.sleep(0.001)
+        release.set()
+        for thread in threads:
+            thread.join(5)
+        return outcomes
+
+    def test_shared_result(self):
+        """Verify concurrent callers share one call and its result"""
+        calls = []
+
+        def func():
+            calls.append(1)
+            return ['data']
+
+        outcomes = self._run_concurrently(SingleFlight(), func)
+        self.assertEqual(1, len(calls))
+        self.assertEqual([['data']] * 5, outcomes)
+
+    def test_shared_error(self):
+        """Verify every waiter receives the error"""
+        error = ValueError('upstream')
+
+        def func():
+            raise error
+
+        outcomes = self._run_concurrently(SingleFlight(), func)
+        self.assertEqual([error] * 5, outcomes)
+
+    def test_not_cached(self):
+        """Verify finished calls are not remembered"""
+        single_flight = SingleFlight()
+        results = iter([1, 2])
+        self.assertEqual(1, single_flight.do('key', lambda: next(results)))
+        self.assertEqual(2, single_flight.do('key', lambda: next(results)))
+        self.assertEqual({}, single_flight._calls)
@@ -0,0 +1,101 @@
+# -*- coding: utf-8 -*-
+"""Verify negotiated compression of API responses"""
+import gzip
+import json
+
+import brotli
+import unittest.mock as mock
+from werkzeug.datastructures import Accept
+from werkzeug.http import parse_accept_header
+
+from lmod_proxy.edx_grades.compression import negotiate
+from lmod_proxy.tests.common import CommonTest
+
+
+@mock.patch('lmod_proxy.edx_grades.pool.GradeBook', autospec=True)
+class TestCompression(CommonTest):
+    """Exercise encoding choice, threshold and streamed responses"""
+
+    FORM = dict(
+        gradebook='test_gradebook',
+        user='user@example.com',
+        section='',
+        submit='get-membership'
+    )
+
+    STUDENTS = [
+        dict(email='student{0}@example.com'.format(number), studentId=number)
+        for number in range(200)
+    ]
+
+    def setUp(self):
+        """Setup the test client"""
+        super(TestCompression, self).setUp()
+        self.client = self.app.test_client()
+
+    def post(self, accept_encoding, students):
+        """Get the membership of ``students`` accepting the encodings"""
+        with mock.patch(
+                'lmod_proxy.edx_grades.actions.lmod_call',
+                return_value=students
+        ):
+            headers = self.get_basic_auth_headers()
+            headers['Accept-Encoding'] = accept_encoding
+            return self.client.post(
+                '/edx_grades', data=self.FORM, headers=headers
+            )
+
+    def test_negotiate(self, _):
+        """Verify the best accepted encoding wins, preferring ours"""
+        for header, expected in (
+                ('gzip, deflate, br', 'br'),
+                ('gzip;q=1.0, br;q=0.5', 'gzip'),
+                ('br;q=0, gzip', 'gzip'),
+                ('*', 'br'),
+                ('identity', None),
+                ('', None),
+        ):
+            accept = parse_accept_header(header, Accept)
+            self.assertEqual(expected, negotiate(accept, ['br', 'gzip']))
+
+    def test_compressed(self, _):
+        """Verify large responses are compressed and small ones are not"""
+        plain = self.post('identity', self.STUDENTS)
+        self.assertNotIn('Content-Encoding', plain.headers)
+        self.assertEqual('Accept-Encoding', plain.headers['Vary'])
+
+        response = self.post('gzip', self.STUDENTS)
+        self.assertEqual('gzip', response.headers['Content-Encoding'])
+        self.assertEqual(plain.data, gzip.decompress(response.data))
+        self.assertLess(len(response.data), len(plain.data) / 4)
+        self.assertIn('compress;dur=', response.headers['Server-Timing'])
+
+        response = self.post('gzip, br', self.STUDENTS)
+        self.assertEqual('br', response.headers['Content-Encoding'])
+        self.assertEqual(plain.data, brotli.decompress(response.data))
+
+        response = self.post('gzip', self.STUDENTS[:2])
+        self.assertNotIn('Content-Encoding', response.headers)
+
+        with mock.patch.dict(self.app.config, {'compression_encodings': []}):
+            response = self.post('gzip', self.STUDENTS)
+        self.assertNotIn('Content-Encoding', response.headers)
+
+    def test_streamed(self, _):
+        """Verify streamed responses are compressed as they are written"""
+        students = self.STUDENTS * 10
+        self.app.config['LMODP_STREAM_MIN_ITEMS'] = 1000
+        plain = self.post('identity', students)
+        self.assertTrue(plain.is_streamed)
+        for encoding, decompress in (
+                ('gzip', gzip.decompress),
+                ('br', brotli.decompress),
+        ):
+            response = self.post(encoding, students)
+            self.assertTrue(response.is_streamed)
+            self.assertNotIn('Content-Length', response.headers)
+            self.assertEqual(encoding, response.headers['Content-Encoding'])
+            self.assertEqual(plain.data, decompress(response.data))
+            self.assertEqual(
+                students, json.loads(decompress(response.data))['data']
+            )
@@ -0,0 +1,165 @@
+# -*- coding: utf-8 -*-
+"""Verify posting of changed grades only"""
+import csv
+import io
+
+import unittest.mock as mock
+from werkzeug.datastructures import FileStorage
+
+from lmod_proxy.edx_grades.actions import post_grades
+from lmod_proxy.edx_grades.deltas import PostedGrades
+from lmod_proxy.edx_grades.forms import EdXGradesForm
+from lmod_proxy.tests.common import CommonTest
+
+STUDENTS = [
+    {'accountEmail': 'A@example.com', 'studentId': 1},
+    {'accountEmail': 'b@example.com', 'studentId': 2},
+]
+
+CSV_TEXT = (
+    'External email,HW 1,HW 2,max_pts\r\n'
+    'a@example.com,0.1,0.2,1\r\n'
+    'B@example.com,0.3,0.4,1\r\n'
+)
+
+
+class TestPostedGrades(CommonTest):
+    """Exercise diffing spreadsheets against posted grades"""
+
+    def setUp(self):
+        """Create a store in the test database"""
+        super(TestPostedGrades, self).setUp()
+        self.posted = PostedGrades(self.state_db)
+
+    @staticmethod
+    def _rows(delta):
+        """Return the rows of a delta's spreadsheet"""
+        return list(csv.DictReader(delta.csv_file))
+
+    def test_diff(self):
+        """Verify only changed rows and columns are kept"""
+        delta = self.posted.diff('gb', io.StringIO(CSV_TEXT))
+        self.assertEqual(4, delta.changed)
+        self.assertEqual(2, len(self._rows(delta)))
+        self.posted.record('gb', delta.cells)
+
+        # Nothing changed
+        delta = self.posted.diff('gb', io.StringIO(CSV_TEXT))
+        self.assertEqual(0, delta.changed)
+        self.assertEqual([], self._rows(delta))
+
+        # One grade changed
+        changed = CSV_TEXT.replace('0.3', '0.9')
+        delta = self.posted.diff('gb', io.StringIO(changed))
+        self.assertEqual(1, delta.changed)
+        self.assertEqual(
+            [{'External email': 'B@example.com', 'HW 1': '0.9',
+              'max_pts': '1'}],
+            self._rows(delta)
+        )
+        self.assertEqual([('HW 1', 'b@example.com', '0.9')], delta.cells)
+
+        # Other gradebooks and full posts see every grade
+        self.assertEqual(
+            4, self.posted.diff('other', io.StringIO(CSV_TEXT)).changed
+        )
+        delta = self.posted.diff('gb', io.StringIO(CSV_TEXT), full=True)
+        self.assertEqual(4, delta.changed)
+        self.assertEqual(2, len(self._rows(delta)))
+
+        self.posted.forget('gb')
+        self.assertEqual(
+            4, self.posted.diff('gb', io.StringIO(CSV_TEXT)).changed
+        )
+
+    def _post(self, gradebook, query=''):
+        """Post CSV_TEXT with delta posting enabled"""
+        form = dict(
+            gradebook='gb',
+            user='user@example.com',
+            submit='post-grades',
+            datafile=FileStorage(
+                stream=io.BytesIO(CSV_TEXT.encode('utf8')),
+                filename='testfile.csv',
+                content_type='text/csv'
+            )
+        )
+        with self.app.app_context():
+            form = EdXGradesForm(**form)
+        with self.app.test_request_context(query), mock.patch.dict(
+                self.app.config, {'LMODP_DELTA_GRADES': 'yes'}
+        ):
+            return post_grades(gradebook, form)
+
+    def test_post_grades(self):
+        """Verify only changed grades are posted and recorded"""
+        gradebook = mock.MagicMock()
+        gradebook.get_students.return_value = STUDENTS
+        gradebook.spreadsheet2gradebook.return_value = (
+            {'data': {'numFailures': 1, 'results': []}}, 1
+        )
+        self._post(gradebook)
+        # Partial failures are not recorded
+        self.assertEqual(
+            4, self.posted.diff('gb', io.StringIO(CSV_TEXT)).changed
+        )
+
+        gradebook.spreadsheet2gradebook.return_value = ({'data': {}}, 1)
+        _, _, success = self._post(gradebook)
+        self.assertTrue(success)
+        self.assertEqual(2, gradebook.spreadsheet2gradebook.call_count)
+
+        # Unchanged grades are not posted again, unless forced
+        _, _, success = self._post(gradebook)
+        self.assertTrue(success)
+        self.assertEqual(2, gradebook.spreadsheet2gradebook.call_count)
+        self._post(gradebook, '?full=1')
+        self.assertEqual(3, gradebook.spreadsheet2gradebook.call_count)
+
+    def test_accepted(self):
+        """Verify grades LMod skips are not taken as posted"""
+        changed = CSV_TEXT.replace('0.2', 'n/a') + 'c@example.com,1,1,1\r\n'
+        delta = self.posted.diff('gb', io.StringIO(changed))
+        self.assertEqual(6, delta.changed)
+        self.assertEqual(
+            [
+                ('HW 1', 'a@example.com', '0.1'),
+                ('HW 1', 'b@example.com', '0.3'),
+                ('HW 2', 'b@example.com', '0.4'),
+            ],
+            delta.accepted({'a@example.com': 1, 'b@example.com': 2})
+        )
+
+    def test_post_grades_skipped(self):
+        """Verify grades of students missing from the roster are posted
+        again once they are in it
+        """
+        gradebook = mock.MagicMock()
+        gradebook.get_students.return_value = STUDENTS[:1]
+        gradebook.spreadsheet2gradebook.return_value = ({'data': {}}, 1)
+        self._post(gradebook)
+        self.assertEqual(
+            2, self.posted.diff('gb', io.StringIO(CSV_TEXT)).changed
+        )
+
+        gradebook.get_students.return_value = STUDENTS
+        self._post(gradebook)
+        self.assertEqual(
+            0, self.posted.diff('gb', io.StringIO(CSV_TEXT)).changed
+        )
+
+        # Batched posting reuses the roster
+        self.posted.forget('gb')
+        gradebook.reset_mock()
+        gradebook.get_assignments.return_value = []
+        gradebook.create_assignment.return_value = {
+            'data': {'assignmentId': 1}
+        }
+        gradebook.multi_grade.return_value = {'data': {}}
+        with mock.patch.dict(self.app.config, {'LMODP_GRADE_BATCH_SIZE': 1}):
+            self._post(gradebook)
+        gradebook.get_students.assert_called_once_with()
+        self.assertEqual(2, gradebook.multi_grade.call_count)
+        self.assertEqual(
+            0, self.posted.diff('gb', io.StringIO(CSV_TEXT)).changed
+        )
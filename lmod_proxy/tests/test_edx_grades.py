@@ -1,21 +1,27 @@
 # -*- coding: utf-8 -*-
 """Unit testing for the edx_grades blueprint"""
 import copy
+import csv
 import json
 import io
+import threading
+import time
 
 import unittest.mock as mock
+from flask import g
 from pylmod.exceptions import PyLmodException
 from werkzeug.datastructures import FileStorage
 
-from lmod_proxy.edx_grades import edx_grades
-from lmod_proxy.edx_grades.forms import EdXGradesForm, ACTIONS
+from lmod_proxy.edx_grades import dispatch, edx_grades
+from lmod_proxy.edx_grades.forms import EdXGradesForm, ACTIONS, READ_ACTIONS
 from lmod_proxy.edx_grades.actions import (
     get_assignments,
     get_membership,
     get_sections,
     post_grades,
 )
+from lmod_proxy.edx_grades.generations import ReadGenerations
+from lmod_proxy.edx_grades.upstream import CircuitOpenError
 from lmod_proxy.tests.common import CommonTest
 
 
@@ -128,7 +134,7 @@ class TestEdXGrades(CommonTest):
             }
         )
 
-    @mock.patch('lmod_proxy.edx_grades.GradeBook', autospec=True)
+    @mock.patch('lmod_proxy.edx_grades.pool.GradeBook', autospec=True)
     def test_post_actions(self, patched_gradebook):
         """Verify that we call the right functions with each action type"""
         local_form = copy.deepcopy(self.FULL_FORM)
@@ -226,6 +232,243 @@ class TestEdXGrades(CommonTest):
         self.assertEqual(message, 'test')
         self.assertEqual(data, [{}])
 
+    @mock.patch('lmod_proxy.edx_grades.pool.GradeBook', autospec=True)
+    def test_coalesced_cache_header(self, patched_gradebook):
+        """Verify requests sharing a coalesced read all report its cache
+        state"""
+        release = threading.Event()
+
+        def get_sections(**kwargs):
+            """Hold the read until every request is waiting for it"""
+            release.wait(5)
+            return ['section']
+
+        patched_gradebook.return_value.get_sections.side_effect = get_sections
+        local_form = copy.deepcopy(self.FULL_FORM)
+        local_form['submit'] = 'get-sections'
+        responses = []
+
+        def request():
+            """Request the sections"""
+            responses.append(self.app.test_client().post(
+                self.EDX_GRADE_URL,
+                data=local_form,
+                headers=self.get_basic_auth_headers()
+            ))
+
+        threads = [threading.Thread(target=request) for _ in range(3)]
+        for thread in threads:
+            thread.start()
+        calls = self.app.config['single_flight']._calls
+        for _ in range(500):
+            if calls and list(calls.values())[0].waiters == 2:
+                break
+            time.sleep(0.01)
+        release.set()
+        for thread in threads:
+            thread.join(5)
+        self.assertEqual(
+            [(200, 'MISS')] * 3,
+            [(response.status_code, response.headers.get('X-Cache'))
+             for response in responses]
+        )
+        self.assertEqual(
+            1, patched_gradebook.return_value.get_sections.call_count
+        )
+
+    def test_read_cache(self):
+        """Verify assignments and sections are read through the cache
+        and posting grades invalidates them"""
+        with self.app.app_context():
+            form = EdXGradesForm(**self.FULL_FORM)
+        gradebook = mock.MagicMock()
+        gradebook.get_sections.return_value = ['section']
+        gradebook.get_assignments.return_value = ['assignment']
+        gradebook.spreadsheet2gradebook.return_value = ({'data': {}}, 1)
+
+        for action in (get_sections, get_assignments):
+            with self.app.test_request_context():
+                _, data, success = action(gradebook, form)
+                self.assertFalse(g.read_cache_hit)
+            with self.app.test_request_context():
+                _, cached_data, success = action(gradebook, form)
+                self.assertTrue(g.read_cache_hit)
+            self.assertTrue(success)
+            self.assertEqual(data, cached_data)
+        self.assertEqual(1, gradebook.get_sections.call_count)
+        self.assertEqual(1, gradebook.get_assignments.call_count)
+
+        # A posting in another worker invalidates the cached reads
+        ReadGenerations(self.state_db).bump('test_gradebook')
+        with self.app.test_request_context():
+            get_sections(gradebook, form)
+            self.assertFalse(g.read_cache_hit)
+        with self.app.test_request_context():
+            get_sections(gradebook, form)
+            self.assertTrue(g.read_cache_hit)
+        self.assertEqual(2, gradebook.get_sections.call_count)
+
+        # Failures are not cached
+        other_form = copy.deepcopy(self.FULL_FORM)
+        other_form['gradebook'] = 'other'
+        with self.app.app_context():
+            other_form = EdXGradesForm(**other_form)
+        gradebook.get_sections.side_effect = PyLmodException('test')
+        with self.app.test_request_context():
+            _, _, success = get_sections(gradebook, other_form)
+        self.assertFalse(success)
+        self.assertNotIn(
+            ('sections', 'other'), self.app.config['read_cache']
+        )
+
+        # Posting grades drops the cached reads for the gradebook
+        file_form = copy.deepcopy(self.FULL_FORM)
+        file_form['datafile'] = FileStorage(
+            stream=io.BytesIO(b'a,b,c'),
+            filename='testfile.csv',
+            content_type='text/csv')
+        with self.app.test_request_context():
+            post_grades(gradebook, EdXGradesForm(**file_form))
+        for name in ('sections', 'assignments'):
+            self.assertNotIn(
+                (name, 'test_gradebook'), self.app.config['read_cache']
+            )
+        self.assertEqual(
+            2, ReadGenerations(self.state_db).get('test_gradebook')
+        )
+
+    @mock.patch('lmod_proxy.edx_grades.pool.GradeBook', autospec=True)
+    def test_read_cache_header(self, patched_gradebook):
+        """Verify responses report whether they came from the cache"""
+        patched_gradebook.return_value.get_sections.return_value = ['a']
+        local_form = copy.deepcopy(self.FULL_FORM)
+        local_form['submit'] = 'get-sections'
+        for expected in ('MISS', 'HIT'):
+            response = self.client.post(
+                self.EDX_GRADE_URL,
+                data=local_form,
+                headers=self.get_basic_auth_headers()
+            )
+            self.assertEqual(expected, response.headers['X-Cache'])
+            self.assertEqual(json.loads(response.data)['data'], ['a'])
+
+        local_form['submit'] = 'get-membership'
+        response = self.client.post(
+            self.EDX_GRADE_URL,
+            data=local_form,
+            headers=self.get_basic_auth_headers()
+        )
+        self.assertNotIn('X-Cache', response.headers)
+
+    @mock.patch('lmod_proxy.edx_grades.pool.GradeBook', autospec=True)
+    def test_stale_reads(self, patched_gradebook):
+        """Verify expired reads are answered with while LMod calls are
+        rejected"""
+        get_sections_mock = patched_gradebook.return_value.get_sections
+        get_sections_mock.return_value = ['a']
+        local_form = copy.deepcopy(self.FULL_FORM)
+        local_form['submit'] = 'get-sections'
+        self.client.post(
+            self.EDX_GRADE_URL,
+            data=local_form,
+            headers=self.get_basic_auth_headers()
+        )
+        self.app.config['read_cache'].clear()
+        get_sections_mock.side_effect = CircuitOpenError('open')
+        response = self.client.post(
+            self.EDX_GRADE_URL,
+            data=local_form,
+            headers=self.get_basic_auth_headers()
+        )
+        self.assertEqual('STALE', response.headers['X-Cache'])
+        self.assertEqual(json.loads(response.data)['data'], ['a'])
+
+        # Nothing held for the gradebook, so the error is returned
+        self.app.config['stale_reads'].clear()
+        response = self.client.post(
+            self.EDX_GRADE_URL,
+            data=local_form,
+            headers=self.get_basic_auth_headers()
+        )
+        self.assertEqual('MISS', response.headers['X-Cache'])
+        self.assertIn('open', json.loads(response.data)['msg'])
+
+    @mock.patch('lmod_proxy.edx_grades.pool.GradeBook', autospec=True)
+    def test_get_all(self, patched_gradebook):
+        """Verify every read is made through one client and returned
+        keyed by action"""
+        gradebook = patched_gradebook.return_value
+        gradebook.get_assignments.return_value = ['assignment']
+        gradebook.get_sections.return_value = ['section']
+        gradebook.get_students.side_effect = PyLmodException('test')
+        local_form = copy.deepcopy(self.FULL_FORM)
+        local_form['submit'] = 'get-all'
+        response = self.client.post(
+            self.EDX_GRADE_URL,
+            data=local_form,
+            headers=self.get_basic_auth_headers()
+        )
+        self.assertEqual(200, response.status_code)
+        patched_gradebook.assert_called_once_with(mock.ANY, mock.ANY)
+        body = json.loads(response.data)
+        self.assertIn('get-membership: test', body['msg'])
+        self.assertEqual(
+            {
+                'get-assignments': dict(
+                    msg='Successfully retrieved assignments',
+                    data=['assignment'],
+                    success=True
+                ),
+                'get-sections': dict(
+                    msg='Successfully retrieved sections',
+                    data=['section'],
+                    success=True
+                ),
+                'get-membership': dict(msg='test', data=[{}], success=False),
+            },
+            body['data']
+        )
+        gradebook.get_students.assert_called_once_with(
+            simple=True, section_name='test_section'
+        )
+
+        gradebook.get_students.side_effect = None
+        gradebook.get_students.return_value = []
+        response = self.client.post(
+            self.EDX_GRADE_URL,
+            data=local_form,
+            headers=self.get_basic_auth_headers()
+        )
+        body = json.loads(response.data)
+        self.assertIn('Successfully retrieved gradebook', body['msg'])
+        self.assertTrue(
+            all(read['success'] for read in body['data'].values())
+        )
+
+    def test_dispatch_coalesces_reads(self):
+        """Verify only read actions go through single flight"""
+        single_flight = self.app.config['single_flight']
+        local_form = copy.deepcopy(self.FULL_FORM)
+        with mock.patch.object(
+                single_flight, 'do', wraps=single_flight.do
+        ) as patched_do, mock.patch.object(
+            self.app.config['gradebook_pool'], 'get'
+        ), mock.patch.dict(
+            'lmod_proxy.edx_grades.forms.ACTIONS',
+            {key: mock.Mock(return_value=('', [], True)) for key in ACTIONS}
+        ):
+            for action in ACTIONS:
+                local_form['submit'] = action
+                with self.app.test_request_context():
+                    dispatch(EdXGradesForm(**local_form))
+        self.assertEqual(
+            set(READ_ACTIONS),
+            set(call[0][0][0] for call in patched_do.call_args_list)
+        )
+        patched_do.assert_any_call(
+            ('get-membership', 'test_gradebook', 'test_section'), mock.ANY
+        )
+
     @mock.patch('lmod_proxy.edx_grades.actions.log', autospec=True)
     def test_post_grades(self, mock_log):
         """Test post_grades actions as expected"""
@@ -264,20 +507,123 @@ class TestEdXGrades(CommonTest):
 
         with self.app.app_context():
             with mock.patch(
-                    'lmod_proxy.edx_grades.actions.render_template',
+                    'lmod_proxy.edx_grades.actions.render_failed_grades',
                     autospec=True
             ) as mock_template:
                 message, data, success = post_grades(gradebook, form)
 
         self.assertTrue(gradebook.spreadsheet2gradebook.called)
-        mock_template.assert_called_with(
-            'grade_transfer_failed.html',
-            number_failed=100,
-            failed_grades=['completely unexpected']
-        )
+        mock_template.assert_called_with(100, ['completely unexpected'])
         self.assertFalse(success)
         self.assertEqual(data, [])
 
+    @mock.patch('lmod_proxy.edx_grades.actions.log', autospec=True)
+    def test_post_grades_streaming(self, mock_log):
+        """Verify the upload is decoded as a stream and only logged when
+        debug logging is enabled"""
+        csv_text = 'External email,Homework 1\r\nfoo@example.com,0.5\r\n'
+        file_form = copy.deepcopy(self.FULL_FORM)
+        file_form['datafile'] = FileStorage(
+            stream=io.BytesIO(csv_text.encode('utf8')),
+            filename='testfile.csv',
+            content_type='text/csv')
+        with self.app.app_context():
+            form = EdXGradesForm(**file_form)
+        received = []
+
+        def spreadsheet2gradebook(csv_file, **kwargs):
+            """Read the CSV the way pylmod does"""
+            received.append(list(csv.DictReader(csv_file)))
+            return {'data': {}}, 1
+
+        gradebook = mock.MagicMock()
+        gradebook.spreadsheet2gradebook.side_effect = spreadsheet2gradebook
+        mock_log.isEnabledFor.return_value = False
+        with self.app.test_request_context():
+            _, _, success = post_grades(gradebook, form)
+        self.assertTrue(success)
+        self.assertEqual(
+            [[{'External email': 'foo@example.com', 'Homework 1': '0.5'}]],
+            received
+        )
+        self.assertFalse(mock_log.debug.called)
+        # The upload itself is left open
+        self.assertFalse(form.datafile.data.stream.closed)
+
+        # With debug logging the whole file is logged and still posted
+        form.datafile.data.stream.seek(0)
+        mock_log.isEnabledFor.return_value = True
+        with self.app.test_request_context():
+            post_grades(gradebook, form)
+        mock_log.debug.assert_called_with('Received grade CSV: %s', csv_text)
+        self.assertEqual(received[0], received[1])
+
+    @mock.patch('lmod_proxy.edx_grades.pool.GradeBook', autospec=True)
+    def test_post_grades_upload(self, patched_gradebook):
+        """Verify a real multipart upload, which werkzeug spools to a
+        temporary file, is decoded and posted"""
+        csv_text = 'External email,Homework 1\r\nfoo@example.com,0.5\r\n'
+        received = []
+
+        def spreadsheet2gradebook(csv_file, **kwargs):
+            """Read the CSV the way pylmod does"""
+            received.append(list(csv.DictReader(csv_file)))
+            return {'data': {}}, 1
+
+        patched_gradebook.return_value.spreadsheet2gradebook.side_effect = (
+            spreadsheet2gradebook
+        )
+        local_form = copy.deepcopy(self.FULL_FORM)
+        local_form['submit'] = 'post-grades'
+        local_form['datafile'] = (
+            io.BytesIO(csv_text.encode('utf8')), 'grades.csv'
+        )
+        response = self.client.post(
+            self.EDX_GRADE_URL,
+            data=local_form,
+            headers=self.get_basic_auth_headers(),
+            content_type='multipart/form-data'
+        )
+        self.assertEqual(200, response.status_code)
+        self.assertIn(
+            'Successfully posted grades', json.loads(response.data)['msg']
+        )
+        self.assertEqual(
+            [[{'External email': 'foo@example.com', 'Homework 1': '0.5'}]],
+            received
+        )
+
+    def test_post_grades_batched(self):
+        """Verify batched posting is used when configured"""
+        file_form = copy.deepcopy(self.FULL_FORM)
+        file_form['datafile'] = FileStorage(
+            stream=io.BytesIO(b'External email,a\r\nfoo@example.com,1\r\n'),
+            filename='testfile.csv',
+            content_type='text/csv')
+        with self.app.app_context():
+            form = EdXGradesForm(**file_form)
+        gradebook = mock.MagicMock()
+        merged = {'data': {'numFailures': 1, 'results': ['failed']}}
+        with self.app.test_request_context(), mock.patch.dict(
+                self.app.config,
+                {'LMODP_GRADE_BATCH_SIZE': '10',
+                 'LMODP_GRADE_BATCH_WORKERS': '3'}
+        ), mock.patch(
+            'lmod_proxy.edx_grades.actions.post_batches',
+            autospec=True,
+            return_value=(merged, 1)
+        ) as patched_post_batches, mock.patch(
+            'lmod_proxy.edx_grades.actions.render_failed_grades',
+            autospec=True
+        ) as mock_template:
+            _, _, success = post_grades(gradebook, form)
+        self.assertFalse(success)
+        self.assertFalse(gradebook.spreadsheet2gradebook.called)
+        args, kwargs = patched_post_batches.call_args
+        self.assertEqual((gradebook, mock.ANY, 10, 3), args)
+        self.assertEqual('max_pts', kwargs['max_points_column'])
+        mock_template.assert_called_with(1, ['failed'])
+
     def test_post_grades_approve(self):
         """Validate that approve grades works"""
         file_form = copy.deepcopy(self.FULL_FORM)
@@ -0,0 +1,141 @@
+# -*- coding: utf-8 -*-
+"""Verify reading many gradebooks in one request"""
+import json
+import threading
+import time
+
+import unittest.mock as mock
+from pylmod.exceptions import PyLmodException
+
+from lmod_proxy.edx_grades.fanout import fan_out
+from lmod_proxy.tests.common import CommonTest
+
+
+@mock.patch('lmod_proxy.edx_grades.pool.GradeBook', autospec=True)
+class TestFanOut(CommonTest):
+    """Exercise the batch endpoint and the concurrent calls behind it"""
+
+    BATCH_URL = '/edx_grades/batch'
+
+    def setUp(self):
+        """Setup the test client"""
+        super(TestFanOut, self).setUp()
+        self.client = self.app.test_client()
+
+    def post(self, data):
+        """Post ``data`` to the batch endpoint"""
+        return self.client.post(
+            self.BATCH_URL, data=data, headers=self.get_basic_auth_headers()
+        )
+
+    def test_batch(self, _):
+        """Verify each gradebook's result and error is streamed"""
+        def get_sections(gradebook, name, **kwargs):
+            """Fail for one gradebook"""
+            if gradebook.gbuuid == 'bad':
+                raise PyLmodException('No such gradebook')
+            return [dict(name=gradebook.gbuuid)]
+
+        with mock.patch(
+                'lmod_proxy.edx_grades.actions.lmod_call',
+                side_effect=get_sections
+        ), mock.patch.object(
+                self.app.config['gradebook_pool'], 'get',
+                side_effect=lambda gbuuid: mock.Mock(gbuuid=gbuuid)
+        ):
+            response = self.post(
+                dict(gradebooks='a, bad\nc,a', submit='get-sections')
+            )
+            self.assertEqual(200, response.status_code)
+            self.assertEqual('application/x-ndjson', response.mimetype)
+            lines = [
+                json.loads(line) for line in response.data.splitlines()
+            ]
+        results = {line['gradebook']: line for line in lines}
+        self.assertEqual(3, len(lines))
+        self.assertEqual(
+            dict(
+                gradebook='a',
+                msg='Successfully retrieved sections',
+                data=[dict(name='a')],
+                success=True,
+            ),
+            results['a']
+        )
+        self.assertFalse(results['bad']['success'])
+        self.assertEqual('No such gradebook', results['bad']['msg'])
+        self.assertTrue(results['c']['success'])
+
+    def test_unexpected_error(self, _):
+        """Verify an unexpected error only fails its gradebook"""
+        with mock.patch(
+                'lmod_proxy.edx_grades.dispatch',
+                side_effect=[ValueError('broken')]
+        ):
+            response = self.post(
+                dict(gradebooks='a', submit='get-membership')
+            )
+            lines = response.data.splitlines()
+        self.assertEqual(1, len(lines))
+        self.assertEqual(
+            dict(gradebook='a', msg='broken', data=[], success=False),
+            json.loads(lines[0])
+        )
+
+    def test_malformed(self, _):
+        """Verify missing gradebooks, write actions and oversized
+        requests are rejected"""
+        self.app.config['LMODP_FANOUT_MAX_GRADEBOOKS'] = 2
+        for data in (
+                dict(gradebooks='', submit='get-sections'),
+                dict(gradebooks='a', submit='post-grades'),
+                dict(gradebooks='a b c', submit='get-sections'),
+        ):
+            response = self.post(data)
+            self.assertEqual(422, response.status_code)
+            self.assertIn('Malformed API Call', response.json['msg'])
+
+    def test_concurrency(self, _):
+        """Verify calls are limited to the number of workers"""
+        running = [0, 0]
+        lock = threading.Lock()
+        release = threading.Event()
+
+        def run(gbuuid):
+            """Record how many calls run at once"""
+            with lock:
+                running[0] += 1
+                running[1] = max(running)
+                if running[1] == 3:
+                    release.set()
+            release.wait(1)
+            with lock:
+                running[0] -= 1
+            return gbuuid
+
+        results = list(fan_out(self.app, run, [str(x) for x in range(10)], 3))
+        self.assertEqual(3, running[1])
+        self.assertEqual(
+            [str(x) for x in range(10)],
+            sorted(result[0] for result in results)
+        )
+        self.assertTrue(all(result[1] == result[0] for result in results))
+
+    def test_cancel(self, _):
+        """Verify calls not yet started are dropped when iteration stops"""
+        called = []
+        release = threading.Event()
+
+        def run(gbuuid):
+            """Hold up every call after the first"""
+            called.append(gbuuid)
+            if gbuuid != 'a':
+                release.wait(1)
+
+        results = fan_out(self.app, run, ['a', 'b', 'c'], 1)
+        self.assertEqual('a', next(results)[0])
+        results.close()
+        release.set()
+        # Give the worker the chance to wrongly start the last call
+        time.sleep(0.1)
+        self.assertNotIn('c', called)
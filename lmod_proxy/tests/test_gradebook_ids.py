@@ -0,0 +1,81 @@
+# -*- coding: utf-8 -*-
+"""Verify the persistent gradebook id cache"""
+import os
+import shutil
+import sqlite3
+import tempfile
+import time
+import unittest
+
+import unittest.mock as mock
+
+from lmod_proxy.edx_grades.gradebook_ids import GradebookIdCache
+from lmod_proxy.edx_grades.pool import GradeBookPool
+
+
+class TestGradebookIdCache(unittest.TestCase):
+    """Exercise resolution, expiry and invalidation of gradebook ids"""
+
+    def setUp(self):
+        temp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, temp_dir)
+        self.path = os.path.join(temp_dir, 'state.sqlite')
+
+    def test_resolve(self):
+        """Verify lookups are only made on a miss and are shared"""
+        lookup = mock.Mock(return_value=1234)
+        id_cache = GradebookIdCache(self.path, 60)
+        self.assertEqual('1234', id_cache.resolve('STELLAR:/a', lookup))
+        self.assertEqual('1234', id_cache.resolve('STELLAR:/a', lookup))
+        lookup.assert_called_once_with('STELLAR:/a')
+
+        # A second instance, like another worker, sees the same mapping
+        self.assertEqual(
+            '1234', GradebookIdCache(self.path, 60).get('STELLAR:/a')
+        )
+
+        # Expired entries are looked up again
+        with mock.patch(
+                'lmod_proxy.edx_grades.gradebook_ids.time.time',
+                return_value=time.time() + 61
+        ):
+            self.assertIsNone(id_cache.get('STELLAR:/a'))
+
+    def test_invalidate(self):
+        """Verify explicit invalidation of one or all mappings"""
+        id_cache = GradebookIdCache(self.path, 60)
+        id_cache.set('a', 1)
+        id_cache.set('b', 2)
+        self.assertEqual(1, id_cache.invalidate('a'))
+        self.assertIsNone(id_cache.get('a'))
+        self.assertEqual('2', id_cache.get('b'))
+        self.assertEqual(1, id_cache.invalidate())
+        self.assertIsNone(id_cache.get('b'))
+
+    def test_database_errors(self):
+        """Verify database errors fall back to the lookup"""
+        id_cache = GradebookIdCache(self.path, 60)
+        lookup = mock.Mock(return_value=1)
+        with mock.patch(
+                'lmod_proxy.edx_grades.gradebook_ids.connect',
+                side_effect=sqlite3.OperationalError('locked')
+        ):
+            self.assertEqual('1', id_cache.resolve('a', lookup))
+            self.assertEqual('1', id_cache.resolve('a', lookup))
+        self.assertEqual(2, lookup.call_count)
+
+    @mock.patch('lmod_proxy.edx_grades.pool.GradeBook', autospec=True)
+    def test_pool(self, patched_gradebook):
+        """Verify the pool resolves ids through the cache"""
+        id_cache = GradebookIdCache(self.path, 60)
+        id_cache.set('a', 1234)
+        pool = GradeBookPool('cert', 'https://lmod/', 2, 60, id_cache)
+        gradebook = pool.get('a')
+        patched_gradebook.assert_called_once_with('cert', 'https://lmod/')
+        self.assertEqual('1234', gradebook.gradebook_id)
+        self.assertFalse(gradebook.get_gradebook_id.called)
+
+        # Pooled clients pick up invalidated ids
+        id_cache.invalidate('a')
+        gradebook.get_gradebook_id.return_value = 4321
+        self.assertEqual('4321', pool.get('a').gradebook_id)
@@ -0,0 +1,226 @@
+# -*- coding: utf-8 -*-
+"""Verify background grade posting jobs"""
+import io
+import json
+import time
+
+import unittest.mock as mock
+from pylmod.exceptions import PyLmodException
+
+from lmod_proxy.edx_grades.jobs import FINISHED, QUEUED, RUNNING, SCHEMA
+from lmod_proxy.store import connect
+from lmod_proxy.tests.common import CommonTest
+
+
+@mock.patch('lmod_proxy.edx_grades.pool.GradeBook', autospec=True)
+class TestGradeJobs(CommonTest):
+    """Post grades through jobs and check on them"""
+
+    EDX_GRADE_URL = '/edx_grades'
+    FORM = dict(
+        gradebook='test_gradebook',
+        user='user@example.com',
+        submit='post-grades'
+    )
+
+    def setUp(self):
+        """Setup the flask test client"""
+        super(TestGradeJobs, self).setUp()
+        self.client = self.app.test_client()
+        self.jobs = self.app.config['grade_jobs']
+
+    def _submit(self, query=''):
+        """Submit a job and wait for it to finish
+
+        Returns:
+            tuple: submit response, job status response
+        """
+        form = dict(self.FORM)
+        form['datafile'] = (io.BytesIO(b'External email,a\r\n'), 'grades.csv')
+        response = self.client.post(
+            self.EDX_GRADE_URL + '?async=1' + query,
+            data=form,
+            headers=self.get_basic_auth_headers()
+        )
+        job_id = json.loads(response.data)['job']
+        for _ in range(500):
+            if self.jobs.get(job_id)['status'] == FINISHED:
+                break
+            time.sleep(0.01)
+        status = self.client.get(
+            response.headers['Location'],
+            headers=self.get_basic_auth_headers()
+        )
+        return response, status
+
+    def test_job(self, patched_gradebook):
+        """Verify a job is queued, run and reported"""
+        patched_gradebook.return_value.spreadsheet2gradebook.return_value = (
+            {'data': {'numFailures': 1, 'results': [{'status': -1}]}}, 1
+        )
+        response, status = self._submit()
+        self.assertEqual(202, response.status_code)
+        self.assertEqual([], json.loads(response.data)['data'])
+        self.assertEqual(200, status.status_code)
+        job = json.loads(status.data)
+        self.assertEqual(FINISHED, job['status'])
+        self.assertFalse(job['success'])
+        self.assertEqual([{'status': -1}], job['failed_grades'])
+        self.assertIn('1 grade failed', job['msg'])
+        self.assertEqual(self.TEST_USER, job['user'])
+
+        # The spreadsheet is dropped once the job is done
+        self.assertIsNone(connect(self.state_db).execute(
+            'SELECT csv FROM grade_jobs WHERE id = ?', (job['job'],)
+        ).fetchone()[0])
+
+    def test_job_error(self, patched_gradebook):
+        """Verify upstream errors are reported by the job"""
+        patched_gradebook.return_value.spreadsheet2gradebook.side_effect = (
+            PyLmodException('test')
+        )
+        _, status = self._submit()
+        job = json.loads(status.data)
+        self.assertFalse(job['success'])
+        self.assertEqual('test', job['msg'])
+
+    def test_full(self, patched_gradebook):
+        """Verify a job sends every grade when asked to"""
+        with mock.patch(
+                'lmod_proxy.edx_grades.jobs.send_grades',
+                return_value=('', None)
+        ) as send_grades:
+            for query, full in (('', False), ('&full=1', True)):
+                _, status = self._submit(query)
+                self.assertTrue(json.loads(status.data)['success'])
+                self.assertIs(full, send_grades.call_args[1]['full'])
+
+    def test_unknown_job(self, patched_gradebook):
+        """Verify unknown jobs and other users' jobs are not found"""
+        response = self.client.get(
+            self.EDX_GRADE_URL + '/jobs/nope',
+            headers=self.get_basic_auth_headers()
+        )
+        self.assertEqual(404, response.status_code)
+
+        _, status = self._submit()
+        connect(self.state_db).execute(
+            'UPDATE grade_jobs SET user = ?', ('x',)
+        )
+        response = self.client.get(
+            self.EDX_GRADE_URL + '/jobs/' + json.loads(status.data)['job'],
+            headers=self.get_basic_auth_headers()
+        )
+        self.assertEqual(404, response.status_code)
+
+    def test_synchronous_default(self, patched_gradebook):
+        """Verify grades are posted in the request without the flag"""
+        patched_gradebook.return_value.spreadsheet2gradebook.return_value = (
+            {'data': {}}, 1
+        )
+        form = dict(self.FORM)
+        form['datafile'] = (io.BytesIO(b'External email,a\r\n'), 'grades.csv')
+        with mock.patch.object(self.jobs, 'submit') as patched_submit:
+            response = self.client.post(
+                self.EDX_GRADE_URL,
+                data=form,
+                headers=self.get_basic_auth_headers()
+            )
+        self.assertEqual(200, response.status_code)
+        self.assertFalse(patched_submit.called)
+        self.assertNotIn('job', json.loads(response.data))
+
+    def _abandon(self, status, attempts=0, job_id='old'):
+        """Store a job left behind by a worker that went away
+
+        Returns:
+            str: job id
+        """
+        connect(self.state_db, SCHEMA).execute(
+            'INSERT INTO grade_jobs '
+            '(id, gradebook, user, status, created, updated, attempts, '
+            'claimed_until, csv) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)',
+            (job_id, 'test_gradebook', self.TEST_USER, status, 1, 1,
+             attempts, 1, 'External email,a\r\n')
+        )
+        return job_id
+
+    def _wait(self, job_id):
+        """Wait for a job to finish and return its state"""
+        for _ in range(500):
+            job = self.jobs.get(job_id)
+            if job['status'] == FINISHED:
+                break
+            time.sleep(0.01)
+        return job
+
+    def test_claim(self, patched_gradebook):
+        """Verify a job is only claimed once while its lease lasts"""
+        job_id = self._abandon(QUEUED)
+        connect(self.state_db).execute(
+            'UPDATE grade_jobs SET claimed_until = ?', (time.time() + 60,)
+        )
+        # Reserved for the submitting worker, which can still claim it
+        self.assertIsNone(self.jobs.claim())
+        self.assertEqual(job_id, self.jobs.claim(job_id)[0])
+        self.assertEqual(RUNNING, self.jobs.get(job_id)['status'])
+        self.assertIsNone(self.jobs.claim(job_id))
+        self.assertIsNone(self.jobs.claim())
+
+    def test_resume(self, patched_gradebook):
+        """Verify jobs of a worker that went away are run again"""
+        patched_gradebook.return_value.spreadsheet2gradebook.return_value = (
+            {'data': {}}, 1
+        )
+        for status in (QUEUED, RUNNING):
+            job_id = self._abandon(status)
+            response = self.client.get(
+                self.EDX_GRADE_URL + '/jobs/' + job_id,
+                headers=self.get_basic_auth_headers()
+            )
+            self.assertEqual(200, response.status_code)
+            job = self._wait(job_id)
+            self.assertTrue(job['success'])
+            connect(self.state_db).execute('DELETE FROM grade_jobs')
+        self.assertEqual(
+            2, patched_gradebook.return_value.spreadsheet2gradebook.call_count
+        )
+
+    def test_heartbeat(self, patched_gradebook):
+        """Verify a long running job keeps its lease"""
+        claims = []
+
+        def spreadsheet2gradebook(**kwargs):
+            """Outlast the lease while another worker tries to claim"""
+            for _ in range(5):
+                time.sleep(0.05)
+                claims.append(self.jobs.claim())
+            return {'data': {}}, 1
+
+        patched_gradebook.return_value.spreadsheet2gradebook.side_effect = (
+            spreadsheet2gradebook
+        )
+        with mock.patch.object(self.jobs, 'LEASE', 0.1), \
+                mock.patch.object(self.jobs, 'HEARTBEAT', 0.01):
+            job = json.loads(self._submit()[1].data)
+        self.assertTrue(job['success'])
+        self.assertEqual([None] * 5, claims)
+
+    def test_abandoned(self, patched_gradebook):
+        """Verify jobs interrupted too often are failed and pruned"""
+        job_id = self._abandon(RUNNING, attempts=self.jobs.MAX_ATTEMPTS)
+        self.assertEqual(1, self.jobs.resume(self.app))
+        job = self._wait(job_id)
+        self.assertFalse(job['success'])
+        self.assertIn('interrupted', job['msg'])
+        self.assertFalse(
+            patched_gradebook.return_value.spreadsheet2gradebook.called
+        )
+
+        # Along with finished jobs, abandoned ones are eventually removed
+        self._abandon(RUNNING, job_id='older')
+        with mock.patch.object(self.jobs, 'retention', 0):
+            self.jobs.prune()
+        self.assertEqual(0, connect(self.state_db).execute(
+            'SELECT COUNT(*) FROM grade_jobs'
+        ).fetchone()[0])
@@ -0,0 +1,54 @@
+# -*- coding: utf-8 -*-
+"""Verify pre-rendered API messages match their templates"""
+from flask import render_template
+from markupsafe import Markup
+
+from lmod_proxy.edx_grades.messages import FIXED_MESSAGES, render_failed_grades
+from lmod_proxy.tests.common import CommonTest
+
+
+class TestMessages(CommonTest):
+    """Compare the fast paths with rendering the templates"""
+
+    def test_api_message(self):
+        """Verify messages render as ``api_message.html`` does"""
+        messages = self.app.config['api_messages']
+        cases = [(message, True) for message in FIXED_MESSAGES] + [
+            ('Successfully retrieved sections', False),
+            ('<b>bad</b> & "quoted"', False),
+            ('<b>bad</b> & "quoted"', True),
+            (Markup('<i>markup</i>'), True),
+            ('', False),
+        ]
+        with self.app.app_context():
+            for message, success in cases:
+                self.assertEqual(
+                    render_template(
+                        'api_message.html', message=message, success=success
+                    ),
+                    messages.render(message, success)
+                )
+
+    def test_failed_grades(self):
+        """Verify failed grades render as ``grade_transfer_failed.html``
+        does"""
+        cases = [
+            (1, [dict(status=-1, message='Grade <1> & "2"')]),
+            (3, [
+                dict(status=-1, message='first'),
+                dict(status=1, message='not shown'),
+                dict(status=-1),
+                'completely unexpected',
+            ]),
+            (2, []),
+        ]
+        with self.app.app_context():
+            for number_failed, failed_grades in cases:
+                self.assertEqual(
+                    render_template(
+                        'grade_transfer_failed.html',
+                        number_failed=number_failed,
+                        failed_grades=failed_grades
+                    ),
+                    render_failed_grades(number_failed, failed_grades)
+                )
@@ -0,0 +1,134 @@
+# -*- coding: utf-8 -*-
+"""Verify metrics are recorded, shared between processes and rendered"""
+import os
+import shutil
+import tempfile
+import unittest
+
+import unittest.mock as mock
+
+from lmod_proxy.metrics import RETIRED_FILE, Registry
+
+
+class TestRegistry(unittest.TestCase):
+    """Exercise histograms and the per process metric files"""
+
+    def setUp(self):
+        """Make a registry writing to a temporary directory"""
+        temp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, temp_dir)
+        self.directory = os.path.join(temp_dir, 'metrics')
+        self.registry = Registry()
+        self.registry.configure(self.directory, 60)
+        self.histogram = self.registry.histogram(
+            'test_seconds', 'Test latency.', ('action',), buckets=(0.1, 1)
+        )
+
+    def test_render(self):
+        """Verify cumulative buckets, sum and count"""
+        self.histogram.observe(0.05, action='get')
+        self.histogram.observe(0.5, action='get')
+        self.histogram.observe(5, action='get')
+        self.assertEqual(
+            '# HELP test_seconds Test latency.\n'
+            '# TYPE test_seconds histogram\n'
+            'test_seconds_bucket{action="get",le="0.1"} 1\n'
+            'test_seconds_bucket{action="get",le="1.0"} 2\n'
+            'test_seconds_bucket{action="get",le="+Inf"} 3\n'
+            'test_seconds_sum{action="get"} 5.55\n'
+            'test_seconds_count{action="get"} 3\n',
+            self.registry.render()
+        )
+
+    def _path(self):
+        """Return the metrics file of this process"""
+        return os.path.join(
+            self.directory, 'metrics-{0}.json'.format(os.getpid())
+        )
+
+    def test_flush_interval(self):
+        """Verify observations are written at most once per interval"""
+        self.histogram.observe(0.05, action='get')
+        path = os.path.join(
+            self.directory, 'metrics-{0}.json'.format(os.getpid())
+        )
+        self.assertTrue(os.path.exists(path))
+        with open(path) as metrics_file:
+            written = metrics_file.read()
+        self.histogram.observe(0.05, action='get')
+        with open(path) as metrics_file:
+            self.assertEqual(written, metrics_file.read())
+
+    def test_aggregate_processes(self):
+        """Verify every process's file is added up"""
+        self.histogram.observe(0.05, action='get')
+        self.histogram.observe(0.5, action='post')
+        # Another worker process with its own registry
+        with mock.patch('os.getpid', return_value=os.getpid() + 1):
+            other = Registry()
+            other.configure(self.directory, 60)
+            other.histogram(
+                'test_seconds', 'Test latency.', ('action',), (0.1, 1)
+            ).observe(0.05, action='get')
+        totals = self.registry.collect()['test_seconds']
+        self.assertEqual([2, 0, 0, 0.1, 2], totals['["get"]'])
+        self.assertEqual([0, 1, 0, 0.5, 1], totals['["post"]'])
+
+    def test_flush_observed_only(self):
+        """Verify nothing is written before anything is observed, and
+        the directory is only created when asked to"""
+        self.registry.flush()
+        self.assertFalse(os.path.exists(self.directory))
+        self.histogram.observe(0.05, action='get')
+        self.registry.configure(self.directory + '-exit', 60)
+        self.histogram.observe(0.05, action='get')
+        self.registry.flush(create=False)
+        self.assertFalse(os.path.exists(self.directory + '-exit'))
+        self.registry.flush()
+        self.assertTrue(os.path.exists(self.directory + '-exit'))
+
+    def test_retire_exited(self):
+        """Verify files of exited processes are merged, not lost or
+        overwritten by a process reusing the pid"""
+        self.histogram.observe(0.05, action='get')
+        dead_path = os.path.join(self.directory, 'metrics-99999999.json')
+        with open(self._path(), 'r') as metrics_file:
+            written = metrics_file.read()
+        with open(dead_path, 'w') as metrics_file:
+            metrics_file.write(written.replace('0.05', '0.5'))
+
+        totals = self.registry.collect()['test_seconds']
+        self.assertEqual([2, 0, 0, 0.55, 2], totals['["get"]'])
+        self.assertFalse(os.path.exists(dead_path))
+        self.assertTrue(
+            os.path.exists(os.path.join(self.directory, RETIRED_FILE))
+        )
+
+        # A new process with the pid of this one that exited
+        reused = Registry()
+        reused.configure(self.directory, 60)
+        reused.histogram(
+            'test_seconds', 'Test latency.', ('action',), (0.1, 1)
+        ).observe(0.5, action='get')
+        totals = reused.collect()['test_seconds']
+        self.assertEqual([2, 1, 0, 1.05, 3], totals['["get"]'])
+
+    def test_fork_resets(self):
+        """Verify a forked child does not repeat its parent's values"""
+        self.registry.configure('', 60)
+        self.histogram.observe(0.05, action='get')
+        with mock.patch('os.getpid', return_value=os.getpid() + 1):
+            self.histogram.observe(0.5, action='get')
+            self.assertEqual(
+                {'["get"]': [0, 1, 0, 0.5, 1]},
+                self.registry.collect()['test_seconds']
+            )
+
+    def test_no_directory(self):
+        """Verify metrics stay in the process without a directory"""
+        self.registry.configure('', 60)
+        self.histogram.observe(0.05, action='get')
+        self.assertFalse(os.path.exists(self.directory))
+        self.assertIn(
+            'test_seconds_count{action="get"} 1', self.registry.render()
+        )
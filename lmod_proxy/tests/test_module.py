@@ -2,6 +2,7 @@
 """
 Testing of the module level stuff itself
 """
+import os
 import unittest
 
 import unittest.mock as mock
@@ -24,23 +25,59 @@ class TestModule(unittest.TestCase):
 
     def test_bad_version(self):
         """Verify bad version handling"""
-        from pkg_resources import DistributionNotFound
+        # The same module _get_version uses
+        try:
+            import importlib.metadata as metadata
+        except ImportError:  # Python < 3.8
+            import importlib_metadata as metadata
         from lmod_proxy import _get_version
 
         error_string = 'Please install this project with setup.py'
 
-        with mock.patch(
-                'lmod_proxy.get_distribution',
-                autospec=True
+        with mock.patch.object(
+                metadata, 'distribution', autospec=True
         ) as mock_distribution:
             # Test with distribution not found:
-            mock_distribution.side_effect = DistributionNotFound()
+            mock_distribution.side_effect = metadata.PackageNotFoundError()
             self.assertEqual(_get_version(), error_string)
 
-        # Test with loc path not matching
-        with mock.patch('os.path.abspath', autospec=True) as mock_path:
-            mock_path.return_value = 'not/where/we/are'
+            # Test with loc path not matching
+            mock_distribution.side_effect = None
+            mock_distribution.return_value.locate_file.return_value = (
+                'not/where/we/are'
+            )
             self.assertEqual(_get_version(), error_string)
-            # Bonus regression test to make sure we are calling
-            # abspath.
-            self.assertTrue(mock_path.called)
+            # Bonus regression test to make sure we are checking where
+            # it is installed.
+            self.assertTrue(
+                mock_distribution.return_value.locate_file.called
+            )
+
+            # Found through a relative sys.path entry, i.e. '' in the
+            # directory holding the package
+            mock_distribution.return_value.version = '1.2.3'
+            here = os.path.dirname(os.path.dirname(os.path.dirname(
+                os.path.abspath(__file__)
+            )))
+            mock_distribution.return_value.locate_file.return_value = (
+                'lmod_proxy'
+            )
+            cwd = os.getcwd()
+            os.chdir(here)
+            try:
+                self.assertEqual('1.2.3', _get_version())
+            finally:
+                os.chdir(cwd)
+
+    def test_lazy_version(self):
+        """Verify the version is only looked up when asked for"""
+        import lmod_proxy
+
+        with mock.patch(
+                'lmod_proxy._get_version', return_value='1.2.3'
+        ), mock.patch.dict(vars(lmod_proxy)):
+            vars(lmod_proxy).pop('__version__', None)
+            self.assertEqual('1.2.3', lmod_proxy.__version__)
+            self.assertEqual('1.2.3', vars(lmod_proxy)['__version__'])
+        with self.assertRaises(AttributeError):
+            lmod_proxy.not_an_attribute  # pylint: disable=pointless-statement
@@ -0,0 +1,64 @@
+# -*- coding: utf-8 -*-
+"""Verify pooling of GradeBook clients"""
+import time
+import unittest
+
+import unittest.mock as mock
+
+from lmod_proxy.edx_grades.pool import GradeBookPool
+
+
+@mock.patch('lmod_proxy.edx_grades.pool.GradeBook', autospec=True)
+class TestGradeBookPool(unittest.TestCase):
+    """Exercise reuse and eviction of pooled clients"""
+
+    def test_reuse(self, patched_gradebook):
+        """Verify clients are built once per gradebook"""
+        pool = GradeBookPool('cert', 'https://lmod/', 2, 60)
+        first = pool.get('a')
+        self.assertIs(first, pool.get('a'))
+        patched_gradebook.assert_called_once_with(
+            'cert', 'https://lmod/', gbuuid='a'
+        )
+        pool.get('b')
+        self.assertEqual(2, patched_gradebook.call_count)
+
+    def test_eviction(self, patched_gradebook):
+        """Verify size bound, idle timeout and explicit eviction"""
+        patched_gradebook.side_effect = lambda *args, **kwargs: object()
+        pool = GradeBookPool('cert', 'https://lmod/', 2, 60)
+        first = pool.get('a')
+        pool.get('b')
+        pool.get('c')
+        self.assertEqual(2, len(pool))
+        self.assertIsNot(first, pool.get('a'))
+
+        with mock.patch(
+                'lmod_proxy.edx_grades.pool.time.monotonic',
+                return_value=time.monotonic() + 61
+        ):
+            pool.get('b')
+        self.assertEqual(1, len(pool))
+
+        pool.evict('b')
+        self.assertEqual(0, len(pool))
+        pool.get('a')
+        pool.evict()
+        self.assertEqual(0, len(pool))
+
+    def test_disabled(self, patched_gradebook):
+        """Verify a zero sized pool builds a client every time"""
+        pool = GradeBookPool('cert', 'https://lmod/', 0, 60)
+        pool.get('a')
+        pool.get('a')
+        self.assertEqual(2, patched_gradebook.call_count)
+        self.assertEqual(0, len(pool))
+
+    def test_check(self, patched_gradebook):
+        """Verify the health check uses the most recently used client"""
+        pool = GradeBookPool('cert', 'https://lmod/', 2, 60)
+        self.assertIsNone(pool.check())
+        gradebook = pool.get('a')
+        gradebook.gradebook_id = '1234'
+        self.assertTrue(pool.check())
+        gradebook.get_options.assert_called_with('1234')
@@ -0,0 +1,120 @@
+# -*- coding: utf-8 -*-
+"""Verify preparation of the application before uwsgi forks workers"""
+import os
+import tempfile
+
+import unittest.mock as mock
+
+from lmod_proxy.config import _write_file
+from lmod_proxy.health import CertificateError
+from lmod_proxy.preload import after_fork, preload
+from lmod_proxy.tests.common import CommonTest
+
+
+class TestPreload(CommonTest):
+    """Exercise preloading, after fork cleanup and config file writing"""
+
+    def preload(self, options):
+        """Preload the application in a uwsgi with ``options``"""
+        uwsgi = mock.Mock(opt=options)
+        with mock.patch('lmod_proxy.preload.uwsgi', uwsgi), \
+                mock.patch('lmod_proxy.preload.gc') as patched_gc, \
+                mock.patch(
+                    'lmod_proxy.preload.os.register_at_fork'
+                ) as register, \
+                mock.patch.object(
+                    self.app.config['cert_expiration'], 'get'
+                ) as get_expiration, \
+                mock.patch.object(
+                    self.app.jinja_env, 'get_template',
+                    wraps=self.app.jinja_env.get_template
+                ) as get_template:
+            preloaded = preload(self.app)
+        self.get_template = get_template
+        return preloaded, patched_gc, register, get_expiration
+
+    def test_preload(self):
+        """Verify state is built and the collector frozen before forking"""
+        preloaded, patched_gc, register, get_expiration = self.preload(
+            {'lazy-apps': b'false'}
+        )
+        self.assertTrue(preloaded)
+        get_expiration.assert_called_once_with()
+        patched_gc.freeze.assert_called_once_with()
+        self.get_template.assert_called_once_with('index.html')
+        with mock.patch.object(
+                self.app.config['gradebook_pool'], 'evict'
+        ) as evict:
+            register.call_args[1]['after_in_child']()
+        evict.assert_called_once_with()
+
+    def test_not_preloaded(self):
+        """Verify nothing is done outside of a forking uwsgi or if
+        disabled
+        """
+        for options in ({'lazy-apps': b'true'}, {'lazy': True}):
+            preloaded, patched_gc, register, _ = self.preload(options)
+            self.assertFalse(preloaded)
+            self.assertFalse(patched_gc.freeze.called)
+            self.assertFalse(register.called)
+
+        with mock.patch('lmod_proxy.preload.uwsgi', None):
+            self.assertFalse(preload(self.app))
+
+        self.app.config['LMODP_PRELOAD'] = ''
+        preloaded, patched_gc, _, _ = self.preload({})
+        self.assertFalse(preloaded)
+        self.assertFalse(patched_gc.freeze.called)
+
+    def test_unreadable_certificate(self):
+        """Verify a bad certificate does not stop preloading"""
+        with mock.patch.object(
+                self.app.config['cert_expiration'], 'get',
+                side_effect=CertificateError('bad')
+        ), mock.patch('lmod_proxy.preload.uwsgi', mock.Mock(opt={})), \
+                mock.patch('lmod_proxy.preload.gc'), \
+                mock.patch('lmod_proxy.preload.os.register_at_fork'):
+            self.assertTrue(preload(self.app))
+
+    def test_after_fork(self):
+        """Verify pooled clients are not carried into a new worker"""
+        pool = self.app.config['gradebook_pool']
+        with mock.patch('lmod_proxy.edx_grades.pool.GradeBook'):
+            pool.get('a')
+        self.assertEqual(1, len(pool))
+        after_fork(self.app)
+        self.assertEqual(0, len(pool))
+
+    def test_write_file(self):
+        """Verify config files are replaced only when they change"""
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, '.htpasswd')
+            _write_file(path, 'foo:bar\n')
+            with open(path) as rfile:
+                self.assertEqual('foo:bar\n', rfile.read())
+            modified = os.stat(path).st_mtime_ns
+
+            with mock.patch('lmod_proxy.config.os.replace') as replace:
+                _write_file(path, 'foo:bar\n')
+            self.assertFalse(replace.called)
+            self.assertEqual(modified, os.stat(path).st_mtime_ns)
+
+            _write_file(path, 'foo:baz\n')
+            with open(path) as rfile:
+                self.assertEqual('foo:baz\n', rfile.read())
+            self.assertEqual(['.htpasswd'], os.listdir(directory))
+
+            # A directory that only lets the file itself be written
+            real_open = open
+
+            def temp_denied(name, *args, **kwargs):
+                """Refuse to create temporary files"""
+                if name.endswith('.tmp'):
+                    raise PermissionError(name)
+                return real_open(name, *args, **kwargs)
+
+            with mock.patch('builtins.open', side_effect=temp_denied):
+                _write_file(path, 'foo:qux\n')
+            with open(path) as rfile:
+                self.assertEqual('foo:qux\n', rfile.read())
+            self.assertEqual(['.htpasswd'], os.listdir(directory))
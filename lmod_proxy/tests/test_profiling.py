@@ -0,0 +1,88 @@
+# -*- coding: utf-8 -*-
+"""Verify request phase timings and on demand profiling"""
+import os
+import pstats
+import shutil
+import tempfile
+
+import unittest.mock as mock
+
+from lmod_proxy.profiling import server_timing
+from lmod_proxy.tests.common import CommonTest
+
+
+@mock.patch('lmod_proxy.edx_grades.pool.GradeBook', autospec=True)
+class TestProfiling(CommonTest):
+    """Exercise the Server-Timing header and the profiling switch"""
+
+    FORM = dict(
+        gradebook='test_gradebook',
+        user='user@example.com',
+        datafile='a,b,c',
+        section='test_section',
+        submit='get-membership'
+    )
+
+    def setUp(self):
+        """Setup the test client and a profile directory"""
+        super(TestProfiling, self).setUp()
+        self.client = self.app.test_client()
+        temp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, temp_dir)
+        self.profile_dir = os.path.join(temp_dir, 'profiles')
+        self.app.config['LMODP_PROFILE_DIR'] = self.profile_dir
+
+    def post(self, **query):
+        """Make an API call with the given query string"""
+        return self.client.post(
+            '/edx_grades',
+            query_string=query,
+            data=self.FORM,
+            headers=self.get_basic_auth_headers()
+        )
+
+    def test_server_timing(self, patched_gradebook):
+        """Verify every phase is reported in order"""
+        patched_gradebook.return_value.get_students.return_value = []
+        with mock.patch('lmod_proxy.profiling.log') as log:
+            response = self.post()
+        self.assertEqual(200, response.status_code)
+        phases = [
+            timing.split(';')[0]
+            for timing in response.headers['Server-Timing'].split(', ')
+        ]
+        self.assertEqual(
+            [
+                'auth', 'rate_limit', 'validate', 'gradebook', 'action',
+                'render', 'total'
+            ],
+            phases
+        )
+        self.assertIn('"action": "get-membership"', log.info.call_args[0][1])
+        self.assertEqual(
+            'auth;dur=1.5, total;dur=20.0',
+            server_timing([('auth', 0.0015), ('total', 0.02)])
+        )
+
+    def test_profile(self, patched_gradebook):
+        """Verify profiles are only saved when asked for and sampled"""
+        patched_gradebook.return_value.get_students.return_value = []
+        self.post()
+        self.assertFalse(os.path.exists(self.profile_dir))
+
+        self.app.config['LMODP_PROFILE_SAMPLE_RATE'] = 0
+        self.post(profile=1)
+        self.assertFalse(os.path.exists(self.profile_dir))
+
+        self.app.config['LMODP_PROFILE_SAMPLE_RATE'] = 1
+        self.app.config['LMODP_ADMIN_USERS'] = 'someone'
+        self.post(profile=1)
+        self.assertFalse(os.path.exists(self.profile_dir))
+
+        self.app.config['LMODP_ADMIN_USERS'] = self.TEST_USER
+        response = self.post(profile=1)
+        self.assertEqual(200, response.status_code)
+        profiles = os.listdir(self.profile_dir)
+        self.assertEqual(1, len(profiles))
+        self.assertTrue(profiles[0].endswith('get-membership.prof'))
+        pstats.Stats(os.path.join(self.profile_dir, profiles[0]))
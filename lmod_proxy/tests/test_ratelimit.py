@@ -0,0 +1,169 @@
+# -*- coding: utf-8 -*-
+"""Verify per user rate limits"""
+import os
+import shutil
+import sqlite3
+import tempfile
+import time
+import unittest
+
+import unittest.mock as mock
+
+from lmod_proxy.edx_grades.ratelimit import RateLimiter
+from lmod_proxy.tests.common import CommonTest
+
+
+class TestRateLimiter(unittest.TestCase):
+    """Exercise token buckets shared through sqlite"""
+
+    def setUp(self):
+        temp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, temp_dir)
+        self.path = os.path.join(temp_dir, 'state.sqlite')
+
+    def test_take(self):
+        """Verify bursts, refills and separate buckets"""
+        limiter = RateLimiter(self.path)
+        now = time.time()
+        with mock.patch(
+                'lmod_proxy.edx_grades.ratelimit.time.time',
+                return_value=now
+        ) as patched_time:
+            for _ in range(3):
+                self.assertEqual(0, limiter.take('foo', 'read', 0.5, 3))
+            self.assertAlmostEqual(2, limiter.take('foo', 'read', 0.5, 3))
+
+            # Other buckets and users, and other workers, are separate
+            self.assertEqual(0, limiter.take('foo', 'post', 0.5, 3))
+            self.assertEqual(0, limiter.take('bar', 'read', 0.5, 3))
+            self.assertAlmostEqual(
+                2, RateLimiter(self.path).take('foo', 'read', 0.5, 3)
+            )
+
+            patched_time.return_value = now + 1
+            self.assertAlmostEqual(1, limiter.take('foo', 'read', 0.5, 3))
+            patched_time.return_value = now + 2
+            self.assertEqual(0, limiter.take('foo', 'read', 0.5, 3))
+
+            # Never refilled past the burst
+            patched_time.return_value = now + 3600
+            for _ in range(3):
+                self.assertEqual(0, limiter.take('foo', 'read', 0.5, 3))
+            self.assertLess(0, limiter.take('foo', 'read', 0.5, 3))
+
+        self.assertEqual(1, limiter.reset('bar'))
+        self.assertEqual(2, limiter.reset())
+
+    def test_cost(self):
+        """Verify requests take their cost, going into debt past the
+        burst"""
+        limiter = RateLimiter(self.path)
+        now = time.time()
+        with mock.patch(
+                'lmod_proxy.edx_grades.ratelimit.time.time',
+                return_value=now
+        ) as patched_time:
+            self.assertEqual(0, limiter.take('foo', 'read', 1, 10, cost=4))
+            self.assertAlmostEqual(
+                4, limiter.take('foo', 'read', 1, 10, cost=10)
+            )
+            patched_time.return_value = now + 4
+            self.assertEqual(0, limiter.take('foo', 'read', 1, 10, cost=30))
+            # Refills pay the debt off before anything else is allowed
+            patched_time.return_value = now + 24
+            self.assertAlmostEqual(1, limiter.take('foo', 'read', 1, 10))
+
+    def test_disabled(self):
+        """Verify a zero rate allows everything"""
+        limiter = RateLimiter(self.path)
+        for _ in range(10):
+            self.assertEqual(0, limiter.take('foo', 'read', 0, 1))
+
+    def test_database_error(self):
+        """Verify requests are allowed if the database is unusable"""
+        limiter = RateLimiter(self.path)
+        with mock.patch(
+                'lmod_proxy.edx_grades.ratelimit.connect',
+                side_effect=sqlite3.OperationalError('locked')
+        ):
+            self.assertEqual(0, limiter.take('foo', 'read', 0.1, 1))
+            self.assertEqual(0, limiter.take('foo', 'read', 0.1, 1))
+
+
+@mock.patch('lmod_proxy.edx_grades.pool.GradeBook', autospec=True)
+class TestRateLimits(CommonTest):
+    """Exercise rate limiting of API requests"""
+
+    FORM = dict(
+        gradebook='test_gradebook',
+        user='user@example.com',
+        section='',
+        submit='get-sections'
+    )
+
+    def setUp(self):
+        """Setup the test client"""
+        super(TestRateLimits, self).setUp()
+        self.client = self.app.test_client()
+
+    def post(self, url='/edx_grades', **form):
+        """Post the form updated with ``form``"""
+        return self.client.post(
+            url,
+            data=dict(self.FORM, **form),
+            headers=self.get_basic_auth_headers()
+        )
+
+    def test_rate_limits(self, patched_gradebook):
+        """Verify requests over a limit are refused without calling LMod"""
+        get_sections = patched_gradebook.return_value.get_sections
+        get_sections.return_value = []
+        self.app.config['LMODP_READ_RATE_LIMIT'] = 6
+        self.app.config['LMODP_READ_RATE_BURST'] = 2
+        self.app.config['read_cache'].ttl = 0
+        for _ in range(2):
+            self.assertEqual(200, self.post().status_code)
+        self.assertEqual(2, get_sections.call_count)
+        response = self.post()
+        self.assertEqual(429, response.status_code)
+        self.assertEqual('10', response.headers['Retry-After'])
+        self.assertIn('retry in 10 seconds', response.json['msg'])
+        self.assertEqual(
+            429, self.post('/edx_grades/batch', gradebooks='a').status_code
+        )
+        self.assertEqual(2, get_sections.call_count)
+
+        # Grade postings have their own limit
+        self.app.config['LMODP_POST_RATE_LIMIT'] = 6
+        self.app.config['LMODP_POST_RATE_BURST'] = 1
+        with mock.patch(
+                'lmod_proxy.edx_grades.dispatch',
+                return_value=('Successfully posted grades', [], True)
+        ) as patched_dispatch:
+            for status in (200, 429):
+                response = self.post(submit='post-grades')
+                self.assertEqual(status, response.status_code)
+        patched_dispatch.assert_called_once_with(mock.ANY)
+
+        self.app.config['LMODP_READ_RATE_LIMIT'] = 0
+        self.assertEqual(200, self.post().status_code)
+
+    def test_batch_cost(self, patched_gradebook):
+        """Verify each gradebook of a batch counts as a read"""
+        self.app.config['LMODP_READ_RATE_LIMIT'] = 6
+        self.app.config['LMODP_READ_RATE_BURST'] = 3
+        with mock.patch(
+                'lmod_proxy.edx_grades.dispatch',
+                return_value=('', [], True)
+        ) as patched_dispatch:
+            response = self.post('/edx_grades/batch', gradebooks='a,b,c')
+            self.assertEqual(200, response.status_code)
+            response.get_data()
+            self.assertEqual(3, patched_dispatch.call_count)
+            self.assertEqual(429, self.post().status_code)
+            # Malformed requests read nothing and cost nothing
+            self.app.config['rate_limiter'].reset()
+            self.assertEqual(
+                422, self.post('/edx_grades/batch', gradebooks='').status_code
+            )
+            self.assertEqual(200, self.post().status_code)
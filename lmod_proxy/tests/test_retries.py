@@ -0,0 +1,155 @@
+# -*- coding: utf-8 -*-
+"""Verify the grade posting retry queue"""
+import io
+import json
+import time
+
+import unittest.mock as mock
+from requests.exceptions import ConnectionError as RequestsConnectionError
+from werkzeug.datastructures import FileStorage
+
+from lmod_proxy.edx_grades.actions import post_grades
+from lmod_proxy.edx_grades.forms import EdXGradesForm
+from lmod_proxy.edx_grades.retries import RetryQueue
+from lmod_proxy.tests.common import CommonTest
+
+
+class TestRetryQueue(CommonTest):
+    """Exercise queueing, draining and reporting of grade retries"""
+
+    def setUp(self):
+        """Create a queue in the test database"""
+        super(TestRetryQueue, self).setUp()
+        self.queue = RetryQueue(self.state_db, 3, 10, 100, 1, 30)
+
+    def _make_due(self):
+        """Make every queued posting due now"""
+        self.queue._connect().execute(
+            'UPDATE grade_retries SET next_attempt = 0'
+        )
+
+    def test_backoff(self):
+        """Verify backoff grows exponentially, capped, with jitter"""
+        for attempts, low, high in ((0, 5, 10), (2, 20, 40), (9, 50, 100)):
+            for _ in range(20):
+                delay = self.queue.backoff(attempts)
+                self.assertTrue(low <= delay <= high)
+
+    def test_drain(self):
+        """Verify postings are retried until they succeed or give up"""
+        self.queue.enqueue('a', 'csv a', 'down')
+        self.queue.enqueue('b', 'csv b', 'down')
+        self.assertEqual(0, self.queue.drain(mock.Mock()))
+        self._make_due()
+
+        post = mock.Mock(side_effect=lambda gbuuid, csv_text: (
+            '' if gbuuid == 'a' else 'still down'
+        ))
+        self.assertEqual(2, self.queue.drain(post))
+        post.assert_any_call('a', 'csv a')
+        stats = self.queue.stats()
+        self.assertEqual(1, stats['depth'])
+        self.assertEqual(0, stats['in_flight'])
+
+        # Retries are scheduled in the future
+        self.assertEqual(0, self.queue.drain(post))
+        for _ in range(2):
+            self._make_due()
+            self.queue.drain(post)
+        stats = self.queue.stats()
+        self.assertEqual(0, stats['depth'])
+        self.assertEqual(1, stats['exhausted'])
+        self.assertIsNone(stats['oldest_pending'])
+
+    def test_drain_limit(self):
+        """Verify no more than max_drains postings are leased at once"""
+        self.queue.enqueue('a', 'csv', 'down')
+        self.queue.enqueue('b', 'csv', 'down')
+        self._make_due()
+        self.assertIsNotNone(self.queue.claim())
+        self.assertIsNone(self.queue.claim())
+        self.assertEqual(1, self.queue.stats()['in_flight'])
+
+    def test_supersede(self):
+        """Verify newer successful postings drop older queued ones"""
+        self.queue.enqueue('a', 'csv', 'down')
+        self.queue.enqueue('b', 'csv', 'down')
+        self.assertEqual(1, self.queue.supersede('a', time.time()))
+        self.assertEqual(1, self.queue.stats()['depth'])
+
+    def test_queue_failed_post(self):
+        """Verify failed grade posts are queued and successes
+        supersede them"""
+        form = dict(
+            gradebook='test_gradebook',
+            user='user@example.com',
+            submit='post-grades',
+            datafile=FileStorage(
+                stream=io.BytesIO(b'External email,a\r\n'),
+                filename='testfile.csv',
+                content_type='text/csv'
+            )
+        )
+        with self.app.app_context():
+            form = EdXGradesForm(**form)
+        gradebook = mock.MagicMock()
+        gradebook.spreadsheet2gradebook.side_effect = (
+            RequestsConnectionError('down')
+        )
+        queue = self.app.config['retry_queue']
+        with self.app.test_request_context():
+            message, _, success = post_grades(gradebook, form)
+        self.assertFalse(success)
+        self.assertEqual('down', message)
+        self.assertEqual(1, queue.stats()['depth'])
+        self.assertEqual(
+            ('test_gradebook', 'External email,a\r\n'),
+            queue._connect().execute(
+                'SELECT gradebook, csv FROM grade_retries'
+            ).fetchone()
+        )
+
+        gradebook.spreadsheet2gradebook.side_effect = None
+        gradebook.spreadsheet2gradebook.return_value = ({'data': {}}, 1)
+        form.datafile.data.stream.seek(0)
+        with self.app.test_request_context():
+            post_grades(gradebook, form)
+        self.assertEqual(0, queue.stats()['depth'])
+
+    def test_retry_status(self):
+        """Verify the queue report and its admin restriction"""
+        self.app.config['retry_queue'].enqueue('a', 'csv', 'down')
+        client = self.app.test_client()
+        response = client.get(
+            '/edx_grades/retries', headers=self.get_basic_auth_headers()
+        )
+        self.assertEqual(200, response.status_code)
+        stats = json.loads(response.data)
+        self.assertEqual(1, stats['depth'])
+        self.assertIsNotNone(stats['oldest_pending'])
+
+        with mock.patch.dict(
+                self.app.config, {'LMODP_ADMIN_USERS': 'admin, other'}
+        ):
+            response = client.get(
+                '/edx_grades/retries', headers=self.get_basic_auth_headers()
+            )
+        self.assertEqual(403, response.status_code)
+
+    def test_start(self):
+        """Verify one drain thread is started per process"""
+        post = mock.Mock()
+        with mock.patch(
+                'lmod_proxy.edx_grades.retries.threading.Thread'
+        ) as patched_thread:
+            self.queue.start(post)
+            self.queue.start(post)
+        self.assertEqual(1, patched_thread.call_count)
+        self.assertTrue(patched_thread.return_value.start.called)
+
+        disabled = RetryQueue(self.state_db, 0, 10, 100, 1, 30)
+        with mock.patch(
+                'lmod_proxy.edx_grades.retries.threading.Thread'
+        ) as patched_thread:
+            disabled.start(post)
+        self.assertFalse(patched_thread.called)
@@ -0,0 +1,61 @@
+# -*- coding: utf-8 -*-
+"""Verify connections to the local sqlite database"""
+import os
+import subprocess
+import sys
+import tempfile
+import unittest
+
+from lmod_proxy.store import connect
+
+try:
+    import gevent
+except ImportError:
+    gevent = None
+
+#: Counts the connections greenlets get in a monkey patched interpreter
+GREENLETS_SCRIPT = """
+from gevent import monkey
+monkey.patch_all()
+import sys
+import gevent
+from lmod_proxy.store import connect
+connections = []
+def use():
+    connections.append(connect(sys.argv[1]))
+    gevent.sleep(0)
+gevent.joinall([gevent.spawn(use) for _ in range(10)])
+print(len(set(map(id, connections))))
+"""
+
+
+class TestConnect(unittest.TestCase):
+    """Exercise caching of connections"""
+
+    def setUp(self):
+        """Make a temporary database path"""
+        temp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(temp_dir.cleanup)
+        self.path = os.path.join(temp_dir.name, 'state.db')
+
+    def test_cached(self):
+        """Verify a thread reuses its connection and runs schemas once"""
+        schema = 'CREATE TABLE test (value TEXT);'
+        connection = connect(self.path, schema)
+        self.assertIs(connection, connect(self.path, schema))
+        self.assertEqual(
+            'wal',
+            connection.execute('PRAGMA journal_mode').fetchone()[0]
+        )
+
+    @unittest.skipIf(gevent is None, 'gevent is not installed')
+    def test_greenlets_share(self):
+        """Verify greenlets of a monkey patched worker share their OS
+        thread's connection"""
+        output = subprocess.check_output(
+            [sys.executable, '-c', GREENLETS_SCRIPT, self.path],
+            cwd=os.path.dirname(os.path.dirname(os.path.dirname(
+                os.path.abspath(__file__)
+            )))
+        )
+        self.assertEqual(b'1', output.strip())
@@ -0,0 +1,77 @@
+# -*- coding: utf-8 -*-
+"""Verify streamed JSON responses match jsonify"""
+import copy
+
+import unittest.mock as mock
+from flask import jsonify
+
+from lmod_proxy.edx_grades.streaming import json_response
+from lmod_proxy.tests.common import CommonTest
+
+STUDENTS = [
+    dict(
+        accountEmail='student{0}@example.com'.format(number),
+        displayName='Student {0}'.format(number),
+        section='r01',
+        sectionId=1000,
+        studentId=number,
+    )
+    for number in range(250)
+]
+STUDENTS[3]['displayName'] = 'Zoë "quoted" \\ </script> '
+STUDENTS[5]['studentId'] = 2 ** 70
+STUDENTS[7]['ratio'] = 1e16
+STUDENTS[9]['active'] = True
+STUDENTS[11]['section'] = None
+
+
+class TestStreaming(CommonTest):
+    """Compare streamed responses with jsonify"""
+
+    def assert_matches(self, envelope, min_items=1):
+        """Verify ``envelope`` is streamed with the bytes of jsonify"""
+        with self.app.test_request_context('/edx_grades'):
+            expected = jsonify(envelope).get_data()
+            response = json_response(envelope, min_items)
+            self.assertTrue(response.is_streamed)
+            self.assertEqual(expected, response.get_data())
+            self.assertEqual('application/json', response.mimetype)
+
+    def test_matches_jsonify(self):
+        """Verify output is identical for any number of chunks"""
+        for length in (1, 99, 100, 101, 250):
+            self.assert_matches(
+                dict(msg='<div>Successfully</div>', data=STUDENTS[:length])
+            )
+
+    def test_without_orjson(self):
+        """Verify output is identical using only the standard library"""
+        with mock.patch('lmod_proxy.edx_grades.streaming.orjson', None):
+            self.assert_matches(dict(msg='ok', data=STUDENTS))
+
+    def test_config(self):
+        """Verify key order and non-ASCII settings are followed"""
+        for name in ('JSON_SORT_KEYS', 'JSON_AS_ASCII'):
+            with mock.patch.dict(self.app.config, {name: False}):
+                self.assert_matches(dict(msg='ok', data=STUDENTS))
+
+    def test_not_streamed(self):
+        """Verify short lists, other data and pretty printing are not
+        streamed"""
+        with self.app.test_request_context('/edx_grades'):
+            for envelope, min_items in (
+                    (dict(msg='ok', data=STUDENTS), 0),
+                    (dict(msg='ok', data=STUDENTS[:5]), 10),
+                    (dict(msg='ok', data={'a': 1}), 1),
+            ):
+                response = json_response(copy.deepcopy(envelope), min_items)
+                self.assertFalse(response.is_streamed)
+                self.assertEqual(
+                    jsonify(envelope).get_data(), response.get_data()
+                )
+            with mock.patch.dict(
+                    self.app.config, {'JSONIFY_PRETTYPRINT_REGULAR': True}
+            ):
+                self.assertFalse(
+                    json_response(dict(data=STUDENTS), 1).is_streamed
+                )
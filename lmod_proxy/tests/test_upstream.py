@@ -0,0 +1,150 @@
+# -*- coding: utf-8 -*-
+"""Verify the circuit breaker and concurrency limit of LMod calls"""
+import time
+import unittest
+
+import unittest.mock as mock
+from requests.exceptions import ConnectionError as RequestsConnectionError
+
+from lmod_proxy.edx_grades.upstream import (
+    CLOSED,
+    HALF_OPEN,
+    OPEN,
+    CircuitBreaker,
+    CircuitOpenError,
+    ConcurrencyLimiter,
+    Upstream,
+    UpstreamBusyError,
+)
+
+
+def failing():
+    """Fail like an unreachable LMod"""
+    raise RequestsConnectionError('down')
+
+
+class TestCircuitBreaker(unittest.TestCase):
+    """Exercise opening, probing and closing of the breaker"""
+
+    def test_open_probe_close(self):
+        """Verify failures open the circuit and successful probes close
+        it again"""
+        breaker = CircuitBreaker(4, 4, 0.5, 0, 30, 2)
+        upstream = Upstream(breaker=breaker)
+        upstream.call('a', lambda: 1)
+        upstream.call('a', lambda: 1)
+        for _ in range(2):
+            with self.assertRaises(RequestsConnectionError):
+                upstream.call('a', failing)
+        self.assertEqual(OPEN, breaker.state)
+        with self.assertRaises(CircuitOpenError):
+            upstream.call('a', lambda: 1)
+
+        later = time.monotonic() + 31
+        with mock.patch(
+                'lmod_proxy.edx_grades.upstream.time.monotonic',
+                return_value=later
+        ):
+            self.assertEqual(1, upstream.call('a', lambda: 1))
+            self.assertEqual(HALF_OPEN, breaker.state)
+            upstream.call('a', lambda: 1)
+        self.assertEqual(CLOSED, breaker.state)
+
+    def test_failed_probe_reopens(self):
+        """Verify a failed probe opens the circuit again"""
+        breaker = CircuitBreaker(2, 2, 0.5, 0, 30, 1)
+        upstream = Upstream(breaker=breaker)
+        for _ in range(2):
+            with self.assertRaises(RequestsConnectionError):
+                upstream.call('a', failing)
+        later = time.monotonic() + 31
+        with mock.patch(
+                'lmod_proxy.edx_grades.upstream.time.monotonic',
+                return_value=later
+        ):
+            with self.assertRaises(RequestsConnectionError):
+                upstream.call('a', failing)
+            self.assertEqual(OPEN, breaker.state)
+            with self.assertRaises(CircuitOpenError):
+                upstream.call('a', lambda: 1)
+
+    def test_slow_calls_and_other_errors(self):
+        """Verify slow calls count as failures and errors of the request
+        itself do not"""
+        breaker = CircuitBreaker(3, 3, 0.6, 5, 30, 1)
+        breaker.record(True, 6)
+        self.assertEqual(CLOSED, breaker.state)
+        upstream = Upstream(breaker=breaker)
+        with self.assertRaises(KeyError):
+            upstream.call('a', {}.__getitem__, 'missing')
+        self.assertEqual(CLOSED, breaker.state)
+        breaker.record(True, 6)
+        self.assertEqual(OPEN, breaker.state)
+
+    def test_untimed_calls(self):
+        """Verify slow grade postings count neither against the breaker
+        nor the limit, but their errors do"""
+        breaker = CircuitBreaker(4, 4, 0.5, 0.001, 30, 1)
+        limiter = ConcurrencyLimiter(1, 10, 0.001, 0.5, 1)
+        upstream = Upstream(breaker=breaker, limiter=limiter)
+        for name in ('multi_grade', 'spreadsheet2gradebook'):
+            upstream.call(name, time.sleep, 0.01)
+        self.assertEqual(CLOSED, breaker.state)
+        self.assertEqual(10, limiter.limit)
+        for _ in range(2):
+            with self.assertRaises(RequestsConnectionError):
+                upstream.call('multi_grade', failing)
+        self.assertEqual(OPEN, breaker.state)
+        self.assertEqual(2.5, limiter.limit)
+
+    def test_disabled(self):
+        """Verify a zero window never opens"""
+        breaker = CircuitBreaker(0, 0, 0, 0, 30, 1)
+        for _ in range(5):
+            self.assertFalse(breaker.allow())
+            breaker.record(False, 1)
+        self.assertEqual(CLOSED, breaker.state)
+
+
+class TestConcurrencyLimiter(unittest.TestCase):
+    """Exercise the adaptive limit"""
+
+    def test_aimd(self):
+        """Verify the limit shrinks on failure and slowly grows back"""
+        limiter = ConcurrencyLimiter(1, 4, 2, 0.5, 0)
+        self.assertEqual(4, limiter.limit)
+        limiter.acquire()
+        limiter.release(False, 0.1)
+        self.assertEqual(2, limiter.limit)
+        limiter.acquire()
+        limiter.release(True, 3)
+        self.assertEqual(1, limiter.limit)
+        limiter.acquire()
+        limiter.release(True, 0.1)
+        self.assertEqual(2, limiter.limit)
+        for _ in range(20):
+            limiter.acquire()
+            limiter.release(True, 0.1)
+        self.assertEqual(4, limiter.limit)
+        self.assertEqual(0, limiter.in_flight)
+
+    def test_busy(self):
+        """Verify calls give up once no slot frees in time"""
+        limiter = ConcurrencyLimiter(1, 1, 2, 0.5, 0.01)
+        breaker = CircuitBreaker(4, 4, 0.5, 0, 0, 1)
+        breaker.state = OPEN
+        upstream = Upstream(breaker=breaker, limiter=limiter)
+        limiter.acquire()
+        with self.assertRaises(UpstreamBusyError):
+            upstream.call('a', lambda: 1)
+        # The half-open probe was handed back
+        limiter.release(True, 0)
+        self.assertEqual(1, upstream.call('a', lambda: 1))
+        self.assertEqual(CLOSED, breaker.state)
+
+    def test_disabled(self):
+        """Verify a zero maximum never waits"""
+        limiter = ConcurrencyLimiter(1, 0, 2, 0.5, 0)
+        for _ in range(5):
+            limiter.acquire()
+        self.assertEqual(0, limiter.in_flight)
@@ -2,13 +2,39 @@
 """
 Test the root Web application
 """
+from datetime import datetime, timedelta
 import importlib
+import json
+import os
+import shutil
+import tempfile
 import unittest.mock as mock
+
+import OpenSSL.crypto
+from cryptography import x509
+from cryptography.hazmat.primitives import hashes, serialization
+from cryptography.hazmat.primitives.asymmetric import ec
+from cryptography.x509.oid import NameOID
 from passlib.apache import HtpasswdFile
+from requests.exceptions import RequestException
 
+from lmod_proxy.health import CertificateExpiration
 from lmod_proxy.tests.common import CommonTest
 
 
+def write_certificate(path, not_after):
+    """Write a self signed PEM certificate expiring at ``not_after``"""
+    key = ec.generate_private_key(ec.SECP256R1())
+    name = x509.Name([x509.NameAttribute(NameOID.COMMON_NAME, 'lmod')])
+    cert = x509.CertificateBuilder().subject_name(name).issuer_name(
+        name
+    ).public_key(key.public_key()).serial_number(1).not_valid_before(
+        datetime(2000, 1, 1)
+    ).not_valid_after(not_after).sign(key, hashes.SHA256())
+    with open(path, 'wb') as cert_file:
+        cert_file.write(cert.public_bytes(serialization.Encoding.PEM))
+
+
 class TestWeb(CommonTest):
     """Verify the root Web app.  Currently it just redirects to edx_grades"""
 
@@ -54,3 +80,131 @@ class TestWeb(CommonTest):
             local_app.config['users'].users(),
             HtpasswdFile().users()
         )
+
+
+class TestStatus(CommonTest):
+    """Verify the status, liveness and readiness endpoints"""
+
+    def setUp(self):
+        """Point the app at a temporary certificate"""
+        super(TestStatus, self).setUp()
+        import lmod_proxy.web
+        importlib.reload(lmod_proxy.web)
+        self.web_app = lmod_proxy.web.app
+        self.client = self.web_app.test_client()
+        temp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, temp_dir)
+        self.cert_path = os.path.join(temp_dir, 'cert.pem')
+        self.expires = datetime.now().replace(microsecond=0) + timedelta(
+            days=60
+        )
+        write_certificate(self.cert_path, self.expires)
+        self.web_app.config['cert_expiration'] = CertificateExpiration(
+            self.cert_path
+        )
+
+    def test_status(self):
+        """Verify the certificate is only parsed when it changes"""
+        with mock.patch(
+                'OpenSSL.crypto.load_certificate',
+                wraps=OpenSSL.crypto.load_certificate
+        ) as load_certificate:
+            for _ in range(2):
+                response = self.client.get('/status')
+                self.assertEqual(
+                    {
+                        'app_cert_expires': self.expires.strftime(
+                            '%Y-%m-%dT%H:%M:%S'
+                        ),
+                        'status': 'ok',
+                    },
+                    json.loads(response.data)
+                )
+            self.assertEqual(1, load_certificate.call_count)
+
+            write_certificate(
+                self.cert_path, datetime.now() + timedelta(days=10)
+            )
+            response = self.client.get('/status')
+            self.assertEqual('warn', json.loads(response.data)['status'])
+            self.assertEqual(2, load_certificate.call_count)
+
+    def test_live(self):
+        """Verify liveness needs nothing"""
+        os.remove(self.cert_path)
+        response = self.client.get('/status/live')
+        self.assertEqual(200, response.status_code)
+        self.assertEqual({'status': 'ok'}, json.loads(response.data))
+
+    def test_ready(self):
+        """Verify readiness checks the certificate and optionally LMod"""
+        response = self.client.get('/status/ready')
+        self.assertEqual(200, response.status_code)
+        self.assertEqual(
+            {'status': 'ok', 'checks': {'cert': 'ok'}},
+            json.loads(response.data)
+        )
+
+        pool = self.web_app.config['gradebook_pool']
+        with mock.patch.object(pool, 'check', return_value=None):
+            response = self.client.get('/status/ready?lmod=1')
+        self.assertEqual(200, response.status_code)
+        self.assertEqual(
+            'unknown', json.loads(response.data)['checks']['lmod']
+        )
+
+        # The LMod check result is reused
+        self.web_app.config['ready_cache'].clear()
+        with mock.patch.object(
+                pool, 'check', side_effect=RequestException('down')
+        ) as check:
+            for _ in range(2):
+                response = self.client.get('/status/ready?lmod=1')
+                self.assertEqual(503, response.status_code)
+        self.assertEqual(1, check.call_count)
+
+        write_certificate(self.cert_path, datetime(2001, 1, 1))
+        response = self.client.get('/status/ready')
+        self.assertEqual(503, response.status_code)
+        self.assertEqual(
+            'expired', json.loads(response.data)['checks']['cert']
+        )
+
+        os.remove(self.cert_path)
+        response = self.client.get('/status/ready')
+        self.assertEqual(503, response.status_code)
+        self.assertEqual('fail', json.loads(response.data)['checks']['cert'])
+
+
+class TestMetrics(CommonTest):
+    """Verify the metrics endpoint"""
+
+    def setUp(self):
+        """Setup the flask test client"""
+        super(TestMetrics, self).setUp()
+        import lmod_proxy.web
+        importlib.reload(lmod_proxy.web)
+        self.web_app = lmod_proxy.web.app
+        self.client = self.web_app.test_client()
+
+    def test_metrics(self):
+        """Verify requests and auth checks are measured"""
+        self.client.get('/edx_grades', headers=self.get_basic_auth_headers())
+        response = self.client.get(
+            '/metrics', headers=self.get_basic_auth_headers()
+        )
+        self.assertEqual(200, response.status_code)
+        self.assertTrue(response.content_type.startswith('text/plain'))
+        body = response.get_data(as_text=True)
+        self.assertIn('# TYPE lmodp_request_seconds histogram', body)
+        self.assertIn('lmodp_request_seconds_count{action="index"}', body)
+        self.assertIn('lmodp_auth_check_seconds_count{outcome="valid"}', body)
+
+    def test_metrics_protected(self):
+        """Verify only authenticated administrators see metrics"""
+        self.assertEqual(401, self.client.get('/metrics').status_code)
+        self.web_app.config['LMODP_ADMIN_USERS'] = 'someone'
+        response = self.client.get(
+            '/metrics', headers=self.get_basic_auth_headers()
+        )
+        self.assertEqual(403, response.status_code)
@@ -1,16 +1,40 @@
 # -*- coding: utf-8 -*-
 """Root flask application for lmod_proxy"""
 import json
-import OpenSSL.crypto
+import logging
 
-from .config import LMODP_CERT
 from datetime import datetime
-from flask import Flask, redirect, url_for
-from passlib.apache import HtpasswdFile
+from flask import Flask, Response, redirect, request, url_for
+from pylmod.exceptions import PyLmodException
+from requests.exceptions import RequestException
 
 from lmod_proxy import __project__
-from lmod_proxy.auth import requires_auth
+from lmod_proxy.auth import (
+    CredentialCache,
+    HtpasswdReloader,
+    is_admin,
+    requires_auth,
+)
+from lmod_proxy.cache import TTLCache
 from lmod_proxy.edx_grades import edx_grades
+from lmod_proxy.edx_grades.coalesce import SingleFlight
+from lmod_proxy.edx_grades.compression import available_encodings
+from lmod_proxy.edx_grades.deltas import PostedGrades
+from lmod_proxy.edx_grades.generations import ReadGenerations
+from lmod_proxy.edx_grades.gradebook_ids import GradebookIdCache
+from lmod_proxy.edx_grades.jobs import GradeJobs
+from lmod_proxy.edx_grades.messages import ApiMessages
+from lmod_proxy.edx_grades.pool import GradeBookPool
+from lmod_proxy.edx_grades.ratelimit import RateLimiter
+from lmod_proxy.edx_grades.retries import RetryQueue
+from lmod_proxy.edx_grades.upstream import (
+    CircuitBreaker,
+    ConcurrencyLimiter,
+    Upstream,
+)
+from lmod_proxy.health import CertificateError, CertificateExpiration
+from lmod_proxy.metrics import REGISTRY
+from lmod_proxy.preload import preload
 
 
 def app_factory():
@@ -19,28 +43,102 @@ def app_factory():
     new_app.config.from_object('lmod_proxy.config'.format(__project__))
 
     new_app.register_blueprint(edx_grades, url_prefix='/edx_grades')
+    new_app.config['api_messages'] = ApiMessages(new_app)
+    new_app.config['compression_encodings'] = available_encodings(
+        new_app.config['LMODP_COMPRESSION']
+    )
     # Load up user database
-    try:
-        new_app.config['users'] = HtpasswdFile(
-            new_app.config['LMODP_HTPASSWD_PATH']
-        )
-    except IOError:
-        new_app.logger.critical(
-            'No htpasswd file loaded, please set `LMODP_HTPASSWD`'
-            'environment variable to a valid apache htpasswd file.'
+    new_app.config['users_reloader'] = HtpasswdReloader(
+        new_app.config['LMODP_HTPASSWD_PATH'],
+        float(new_app.config['LMODP_HTPASSWD_RELOAD_INTERVAL'])
+    )
+    new_app.config['users'] = new_app.config['users_reloader'].load()
+    new_app.config['auth_cache'] = CredentialCache(
+        int(new_app.config['LMODP_AUTH_CACHE_SIZE']),
+        float(new_app.config['LMODP_AUTH_CACHE_TTL'])
+    )
+    new_app.config['lmod_upstream'] = Upstream(
+        CircuitBreaker(
+            int(new_app.config['LMODP_BREAKER_WINDOW']),
+            int(new_app.config['LMODP_BREAKER_MIN_CALLS']),
+            float(new_app.config['LMODP_BREAKER_FAILURE_RATE']),
+            float(new_app.config['LMODP_BREAKER_SLOW_CALL_SECONDS']),
+            float(new_app.config['LMODP_BREAKER_OPEN_SECONDS']),
+            int(new_app.config['LMODP_BREAKER_HALF_OPEN_CALLS'])
+        ),
+        ConcurrencyLimiter(
+            int(new_app.config['LMODP_LMOD_CONCURRENCY_MIN']),
+            int(new_app.config['LMODP_LMOD_CONCURRENCY_MAX']),
+            float(new_app.config['LMODP_LMOD_TARGET_SECONDS']),
+            float(new_app.config['LMODP_LMOD_CONCURRENCY_BACKOFF']),
+            float(new_app.config['LMODP_LMOD_QUEUE_SECONDS'])
         )
-        new_app.config['users'] = HtpasswdFile()
-    new_app.logger.debug(
-        'Starting with configuration:\n %s',
-        '\n'.join([
-            '{0}: {1}'.format(x, y)
-            for x, y in sorted(dict(new_app.config).items())
-        ])
     )
+    new_app.config['gradebook_pool'] = GradeBookPool(
+        new_app.config['LMODP_CERT'],
+        new_app.config['LMODP_URLBASE'],
+        int(new_app.config['LMODP_GRADEBOOK_POOL_SIZE']),
+        float(new_app.config['LMODP_GRADEBOOK_POOL_IDLE']),
+        id_cache=GradebookIdCache(
+            new_app.config['LMODP_STATE_DB'],
+            float(new_app.config['LMODP_GRADEBOOK_ID_TTL'])
+        ),
+        upstream=new_app.config['lmod_upstream']
+    )
+    new_app.config['read_cache'] = TTLCache(
+        int(new_app.config['LMODP_READ_CACHE_SIZE']),
+        float(new_app.config['LMODP_READ_CACHE_TTL'])
+    )
+    new_app.config['read_generations'] = ReadGenerations(
+        new_app.config['LMODP_STATE_DB']
+    )
+    new_app.config['stale_reads'] = TTLCache(
+        int(new_app.config['LMODP_READ_CACHE_SIZE']),
+        float(new_app.config['LMODP_STALE_READ_TTL'])
+    )
+    new_app.config['single_flight'] = SingleFlight()
+    new_app.config['grade_jobs'] = GradeJobs(
+        new_app.config['LMODP_STATE_DB'],
+        int(new_app.config['LMODP_JOB_WORKERS']),
+        float(new_app.config['LMODP_JOB_RETENTION'])
+    )
+    new_app.config['retry_queue'] = RetryQueue(
+        new_app.config['LMODP_STATE_DB'],
+        int(new_app.config['LMODP_RETRY_MAX_ATTEMPTS']),
+        float(new_app.config['LMODP_RETRY_BASE_DELAY']),
+        float(new_app.config['LMODP_RETRY_MAX_DELAY']),
+        int(new_app.config['LMODP_RETRY_MAX_DRAINS']),
+        float(new_app.config['LMODP_RETRY_POLL_INTERVAL'])
+    )
+    new_app.config['posted_grades'] = PostedGrades(
+        new_app.config['LMODP_STATE_DB']
+    )
+    new_app.config['rate_limiter'] = RateLimiter(
+        new_app.config['LMODP_STATE_DB']
+    )
+    new_app.config['cert_expiration'] = CertificateExpiration(
+        new_app.config['LMODP_CERT']
+    )
+    new_app.config['ready_cache'] = TTLCache(
+        1, float(new_app.config['LMODP_READY_CHECK_TTL'])
+    )
+    REGISTRY.configure(
+        new_app.config['LMODP_METRICS_DIR'],
+        float(new_app.config['LMODP_METRICS_FLUSH_INTERVAL'])
+    )
+    if new_app.logger.isEnabledFor(logging.DEBUG):
+        new_app.logger.debug(
+            'Starting with configuration:\n %s',
+            '\n'.join([
+                '{0}: {1}'.format(x, y)
+                for x, y in sorted(dict(new_app.config).items())
+            ])
+        )
     return new_app
 
 
 app = app_factory()
+preload(app)
 
 
 @app.route('/', methods=['GET'])
@@ -60,14 +158,78 @@ def status():
 
     Return: json object containing app_cert_expiration date and status
     """
-    app_cert_content = open(LMODP_CERT, 'rt').read()
-    app_cert = OpenSSL.crypto.load_certificate(OpenSSL.crypto.FILETYPE_PEM,
-                                               app_cert_content)
-    app_cert_expiration = datetime.strptime(
-        app_cert.get_notAfter().decode('utf8'), '%Y%m%d%H%M%SZ')
+    app_cert_expiration = app.config['cert_expiration'].get()
     date_delta = app_cert_expiration - datetime.now()
     retval = {
         'app_cert_expires': app_cert_expiration.strftime('%Y-%m-%dT%H:%M:%S'),
         'status': 'ok' if date_delta.days > 30 else 'warn'
     }
     return json.dumps(retval)
+
+
+@app.route('/status/live', methods=['GET'])
+def live():
+    """Liveness check that only shows the worker is serving requests
+
+    Return: json object with status ok
+    """
+    return json.dumps({'status': 'ok'})
+
+
+def lmod_ready():
+    """Check LMod through a pooled client, at most once every
+    ``LMODP_READY_CHECK_TTL`` seconds.
+
+    Return: ok, fail, or unknown if no client is pooled
+    """
+    ready_cache = app.config['ready_cache']
+    result = ready_cache.get('lmod')
+    if result is None:
+        try:
+            healthy = app.config['gradebook_pool'].check()
+        except (PyLmodException, RequestException, ValueError, KeyError):
+            app.logger.exception('LMod readiness check failed')
+            healthy = False
+        result = {True: 'ok', False: 'fail', None: 'unknown'}[healthy]
+        ready_cache.set('lmod', result)
+    return result
+
+
+@app.route('/status/ready', methods=['GET'])
+def ready():
+    """Readiness check that the client certificate is usable and, with
+    ``lmod=1`` in the query string, that LMod answers pooled clients.
+
+    Return: json object with overall status and each check, status 503
+    if not ready
+    """
+    checks = {}
+    try:
+        expired = app.config['cert_expiration'].get() <= datetime.now()
+        checks['cert'] = 'expired' if expired else 'ok'
+    except (OSError, CertificateError):
+        checks['cert'] = 'fail'
+    if request.args.get('lmod', '').lower() in ('1', 'true', 'yes', 'on'):
+        checks['lmod'] = lmod_ready()
+    is_ready = all(check in ('ok', 'unknown') for check in checks.values())
+    return Response(
+        json.dumps({'status': 'ok' if is_ready else 'fail', 'checks': checks}),
+        status=200 if is_ready else 503,
+        mimetype='application/json'
+    )
+
+
+@app.route('/metrics', methods=['GET'])
+@requires_auth
+def metrics(user):
+    """Prometheus metrics summed over every worker process
+
+    Return: metrics in the Prometheus text format, status 403 for users
+    that are not administrators
+    """
+    if not is_admin(user):
+        return Response('Forbidden\n', status=403, mimetype='text/plain')
+    return Response(
+        REGISTRY.render(),
+        mimetype='text/plain; version=0.0.4; charset=utf-8'
+    )
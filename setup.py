@@ -60,7 +60,7 @@ setup(
     description=('Flask application for proxying requests to the'
                  'MIT Learning Modules API from edx-platform'),
     long_description=README,
-    packages=find_packages(),
+    packages=find_packages(exclude=['benchmarks']),
     install_requires=[
         'Flask~=1.1',
         'passlib~=1.7',
@@ -69,8 +69,18 @@ setup(
         'PyYAML~=5.1',
         'uWSGI~=2.0',
         'Flask-WTF~=0.14.0',
+        'importlib_metadata; python_version<"3.8"',
     ],
     extras_require={
+        'async': [
+            'gevent>=1.4',
+        ],
+        'brotli': [
+            'brotli>=1.0',
+        ],
+        'fast': [
+            'orjson>=3',
+        ],
         'dev': [
             'pyflakes~=2.0',
             'pytest~=5.0',
@@ -84,6 +94,8 @@ setup(
     },
     entry_points={'console_scripts': [
         'lmod_proxy = lmod_proxy.cmd:run_server',
+        'lmod_proxy_invalidate_gradebooks = '
+        'lmod_proxy.cmd:invalidate_gradebook_ids',
     ]},
     classifiers=[
         'Development Status :: 5 - Production/Stable',